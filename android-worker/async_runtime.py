@@ -0,0 +1,310 @@
+"""
+Asynchronous worker runtime for AndroCompute
+Receiving, running and uploading jobs overlap on one event loop, so the next
+jobs are already leased while the current ones run and results upload while
+the next ones start. Jobs are pushed over the coordinator's event stream, or
+leased by long-polling while the stream is unavailable. Network calls go
+through the worker's keep-alive session on a few I/O threads, jobs run on the
+worker's execution pool. Leased jobs that no longer fit after the power
+governor cuts concurrency are handed back for other nodes to run.
+"""
+
+import asyncio
+import functools
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Jobs leased ahead per running job, so a slot never waits on the network
+PREFETCH_PER_SLOT = 1
+# Seconds to poll after the job stream drops before trying to reopen it
+STREAM_RETRY = 60
+# Failed uploads of a batch before its results are given up on, the coordinator
+# re-runs those jobs once their leases expire
+UPLOAD_RETRIES = 10
+# Longest wait between upload retries, which back off from the poll interval
+MAX_UPLOAD_BACKOFF = 300
+# Result of a job whose real result the coordinator refused
+UPLOAD_ERROR = 'ERROR: result could not be uploaded: '
+
+
+class ResultsRejected(Exception):
+    """Results the coordinator will never accept as they are, e.g. unencodable or refused with a 4xx"""
+
+
+class AsyncWorkerRuntime:
+    """Runs an AndroidWorker's fetch, execute, upload and heartbeat loops concurrently"""
+
+    def __init__(self, worker, heartbeat_interval=15, poll_interval=5, prefetch_per_slot=PREFETCH_PER_SLOT,
+                 use_stream=True):
+        self.worker = worker
+        self.use_stream = use_stream
+        self.streaming = False
+        self.stream = None
+        self.stopped = False
+        # When our resources last reached the coordinator, uploads carry them too
+        self.last_report = 0
+        self.heartbeat_interval = heartbeat_interval
+        self.poll_interval = poll_interval
+        self.prefetch_per_slot = prefetch_per_slot
+        # Leased jobs waiting for a free slot
+        self.ready = deque()
+        self.running = 0
+        # job_id -> execution pool future for each running job, to cancel copies we lose
+        self.futures = {}
+        # Finished jobs' reports waiting to be uploaded
+        self.results = []
+        self.completed = 0
+        # Consecutive failed attempts to upload the batch at the front of results
+        self.upload_failures = 0
+        # One thread each for the stream or long-poll, uploads, heartbeats and resource readings
+        self.io = ThreadPoolExecutor(max_workers=4)
+        self.loop = None
+        self.slot_freed = None
+        self.results_ready = None
+        self.stopping = None
+
+    async def call(self, func, *args):
+        """Run a blocking call, e.g. an HTTP request, on an I/O thread"""
+        return await self.loop.run_in_executor(self.io, functools.partial(func, *args))
+
+    async def run(self):
+        self.loop = asyncio.get_running_loop()
+        self.slot_freed = asyncio.Event()
+        self.results_ready = asyncio.Event()
+        self.stopping = asyncio.Event()
+        tasks = [asyncio.ensure_future(loop()) for loop in (self.receive_loop, self.upload_loop, self.heartbeat_loop)]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            self.stopped = True
+            for task in tasks:
+                task.cancel()
+            if self.stream is not None:
+                self.worker.close_stream(self.stream)
+            self.io.shutdown(wait=False)
+
+    def stop(self):
+        """
+        Stop leasing and uploading, run() returns once the calls in progress
+        finish. Must be called on the event loop, see AndroidWorker.stop
+        """
+        self.worker.running = False
+        self.stopped = True
+        # Wake every loop waiting for something to do, so they see we're stopping
+        self.stopping.set()
+        self.results_ready.set()
+        self.slot_freed.set()
+        if self.stream is not None:
+            self.worker.close_stream(self.stream)
+
+    async def pause(self, seconds):
+        """Sleep, cut short if the runtime stops"""
+        try:
+            await asyncio.wait_for(self.stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    def slots(self):
+        # Jobs to hold at once, running plus queued up behind them unless saving power
+        prefetch = self.prefetch_per_slot if self.worker.prefetch else 0
+        return self.worker.concurrency * (1 + prefetch)
+
+    def wanted(self):
+        return self.slots() - self.running - len(self.ready)
+
+    async def receive_loop(self):
+        while self.worker.running:
+            deadline = None
+            if self.use_stream:
+                try:
+                    self.streaming = True
+                    await self.call(self.follow_stream)
+                except Exception as e:
+                    # stop() closing the stream under the reader fails it too
+                    if self.worker.running:
+                        print(f"⚠️ Job stream error: {e}")
+                finally:
+                    self.streaming = False
+                if not self.worker.running:
+                    return
+                print(f"🔄 Polling for jobs, retrying the stream in {STREAM_RETRY}s")
+                deadline = time.monotonic() + STREAM_RETRY
+            while self.worker.running and (deadline is None or time.monotonic() < deadline):
+                await self.poll_once()
+
+    def follow_stream(self):
+        # Runs on an I/O thread, handing each pushed message to the event loop
+        slots = self.slots()
+        self.stream = self.worker.open_stream(slots)
+        print(f"📡 Following job stream ({slots} slots)")
+        try:
+            for event, data in self.worker.stream_events(self.stream):
+                if self.stopped:
+                    return
+                self.loop.call_soon_threadsafe(self.on_event, event, data)
+        finally:
+            self.stream.close()
+            self.stream = None
+
+    def on_event(self, event, data):
+        if event == 'jobs':
+            self.worker.in_flight.update(job_data['job_id'] for job_data in data)
+            self.ready.extend(data)
+            self.dispatch()
+        elif event == 'lost':
+            # Only the ones we still hold matter, the rest already finished here
+            self.worker.lost_jobs = (self.worker.lost_jobs | set(data)) & self.worker.in_flight.copy()
+            self.cancel_lost()
+
+    def cancel_lost(self):
+        """Stop running jobs the coordinator took back, e.g. because a backup copy finished first"""
+        for job_id in self.worker.lost_jobs & self.futures.keys():
+            if self.worker.pool.cancel(self.futures[job_id]):
+                print(f"🛑 Cancelled {job_id}, its lease was lost")
+
+    async def poll_once(self):
+        await self.call(self.worker.update_resources)
+        await self.hand_back()
+        wanted = self.wanted()
+        if wanted <= 0:
+            # Also what a paused worker does, the heartbeat wakes it to check the power state again
+            self.slot_freed.clear()
+            await self.slot_freed.wait()
+            return
+
+        try:
+            print(f"🔍 Leasing up to {wanted} jobs ({self.running} running, {len(self.ready)} queued)")
+            batch = await self.call(self.worker.lease_jobs, wanted)
+        except Exception as e:
+            print(f"⚠️ Job check error: {e}")
+            await self.pause(self.poll_interval)
+            return
+
+        if batch:
+            self.ready.extend(batch)
+            self.dispatch()
+        elif not self.worker.poll_wait:
+            await self.pause(self.poll_interval)
+
+    async def hand_back(self):
+        """Return queued jobs beyond our slots, e.g. after the power governor paused us"""
+        excess = min(self.running + len(self.ready) - self.slots(), len(self.ready))
+        if excess <= 0:
+            return
+        # The newest leases go back, the oldest are the next to start
+        returned = [self.ready.pop() for _ in range(excess)]
+        try:
+            await self.call(self.worker.release_jobs, [job_data['job_id'] for job_data in returned])
+        except Exception as e:
+            print(f"⚠️ Couldn't hand back jobs: {e}")
+            # Still leased to us, they start once there's room again
+            self.ready.extend(reversed(returned))
+
+    def dispatch(self):
+        """Start queued jobs while there are free slots"""
+        while self.ready and self.running < self.worker.concurrency:
+            job_data = self.ready.popleft()
+            future = self.worker.start_job(job_data)
+            if future is None:
+                continue
+            self.running += 1
+            self.futures[job_data['job_id']] = future
+            asyncio.ensure_future(self.finish(job_data, future))
+
+    async def finish(self, job_data, future):
+        try:
+            await asyncio.wrap_future(future)
+        except Exception:
+            # pool.result turns a crashed job into an error report below
+            pass
+        finally:
+            self.running -= 1
+            self.futures.pop(job_data['job_id'], None)
+        report = self.worker.job_report(job_data, self.worker.pool.result(future))
+        if report:
+            self.results.append(report)
+            self.results_ready.set()
+        self.dispatch()
+        self.slot_freed.set()
+
+    async def upload_loop(self):
+        while self.worker.running:
+            await self.results_ready.wait()
+            self.results_ready.clear()
+            if not self.results:
+                continue
+            # Everything that finished while the last upload was in flight goes up together
+            batch, self.results = self.results, []
+            try:
+                await self.upload(batch)
+                self.upload_failures = 0
+                self.last_report = time.time()
+                self.completed += len(batch)
+                print(f"📊 Total jobs completed: {self.completed}")
+            except Exception as e:
+                self.upload_failures += 1
+                if not self.worker.running:
+                    print(f"⚠️ Upload error while stopping, {len(batch)} results not submitted: {e}")
+                    return
+                if self.upload_failures >= UPLOAD_RETRIES:
+                    print(f"🗑️ Giving up on {len(batch)} results after {self.upload_failures} failed uploads: {e}")
+                    # Their leases lapse and the coordinator runs them elsewhere
+                    self.worker.in_flight.difference_update(report['job_id'] for report in batch)
+                    self.upload_failures = 0
+                    continue
+                backoff = min(self.poll_interval * 2 ** (self.upload_failures - 1), MAX_UPLOAD_BACKOFF)
+                print(f"⚠️ Upload error, retrying in {backoff}s: {e}")
+                # Keep them for the next upload, the leases are renewed until they land
+                self.results = batch + self.results
+                await self.pause(backoff)
+                self.results_ready.set()
+
+    async def upload(self, batch, as_failure=True):
+        """
+        Upload reports, isolating any the coordinator will never accept
+
+        A report rejected on its own goes up again as a failed job, and is
+        dropped if even that is rejected, so one bad result can't hold up the
+        others or leave its job executing forever.
+
+        Raises:
+            requests.RequestException: On transport errors, worth retrying
+        """
+        try:
+            await self.call(self.worker.upload_results, batch)
+            return
+        except ResultsRejected as e:
+            error = e
+        if len(batch) > 1:
+            for report in batch:
+                await self.upload([report], as_failure)
+            return
+        report = batch[0]
+        if not as_failure:
+            print(f"🗑️ Dropping the result of {report['job_id']}, the coordinator won't take it: {error}")
+            self.worker.in_flight.discard(report['job_id'])
+            return
+        print(f"⚠️ Result of {report['job_id']} rejected, reporting the job as failed: {error}")
+        await self.upload([dict(report, success=False, result=f"{UPLOAD_ERROR}{error}")], as_failure=False)
+
+    async def heartbeat_loop(self):
+        while self.worker.running:
+            await self.pause(self.heartbeat_interval)
+            if not self.worker.running:
+                return
+            power_state = self.worker.resources.get('power_state')
+            streamed = self.streaming and time.time() - self.last_report < self.heartbeat_interval * 4
+            if streamed:
+                # The open stream renews our leases and pushes lost jobs, only the
+                # device readings need refreshing and they go up with the next upload
+                await self.call(self.worker.update_resources)
+            if not streamed or self.worker.resources.get('power_state') != power_state:
+                # Also sent as soon as we pause or resume, so the coordinator stops or starts sending work
+                await self.call(self.worker.heartbeat)
+                self.last_report = time.time()
+                self.cancel_lost()
+            await self.hand_back()
+            # Concurrency may have gone up, or a lost lease freed a queued job's slot
+            self.dispatch()
+            self.slot_freed.set()
@@ -0,0 +1,138 @@
+"""
+Input blob cache for the AndroCompute worker
+Blobs that jobs reference by SHA-256 are downloaded once into a directory on
+disk, kept across restarts and evicted least recently used first. Jobs read
+them through a read-only memory map, so a dataset many jobs share is neither
+downloaded nor copied into memory again
+"""
+
+import hashlib
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+# Directory blobs are cached in
+BLOB_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'blob_cache')
+# Bytes of blobs kept on disk, least recently used are evicted first
+BLOB_CACHE_BYTES = 512 * 1024 * 1024
+
+
+def open_blob(path):
+    """Read-only memory map of a cached blob, bytes for an empty one which can't be mapped"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        # The map stays valid after the file is closed
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class BlobCache:
+    """On-disk LRU cache of blobs keyed by SHA-256, blobs in use by a job are never evicted"""
+
+    def __init__(self, fetch_blob=None, directory=BLOB_CACHE_DIR, capacity=BLOB_CACHE_BYTES):
+        """
+        Args:
+            fetch_blob (callable): (digest, path) -> None, downloads a blob to
+                path, resuming if path already holds the start of it
+            directory (str): Where blobs are cached
+            capacity (int): Bytes to keep cached
+        """
+        self.fetch_blob = fetch_blob
+        self.directory = directory
+        self.capacity = capacity
+        os.makedirs(directory, exist_ok=True)
+        # digest -> size, least recently used first. Blobs cached by an earlier
+        # run are picked up in the order they were last used
+        self._sizes = OrderedDict()
+        for name in sorted(os.listdir(directory), key=lambda name: os.path.getmtime(os.path.join(directory, name))):
+            if len(name) == 64:
+                self._sizes[name] = os.path.getsize(os.path.join(directory, name))
+        self._pinned = {}
+        self._downloads = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, digest):
+        return digest in self._sizes
+
+    def digests(self):
+        with self.lock:
+            return list(self._sizes)
+
+    def acquire(self, digest):
+        """
+        Path of a cached blob, downloading it first if needed. The blob can't be
+        evicted until release() is called for it
+
+        Raises:
+            ValueError: If the downloaded data doesn't match its digest
+        """
+        path = os.path.join(self.directory, digest)
+        with self.lock:
+            self._pinned[digest] = self._pinned.get(digest, 0) + 1
+            if digest in self._sizes:
+                self.hits += 1
+                self._sizes.move_to_end(digest)
+                cached = True
+            else:
+                self.misses += 1
+                cached = False
+                download_lock = self._downloads.setdefault(digest, threading.Lock())
+        if cached:
+            # Keeps the LRU order across restarts
+            os.utime(path)
+            return path
+
+        try:
+            # One download per blob, jobs wanting the same blob wait for it
+            with download_lock:
+                if digest not in self._sizes:
+                    self._download(digest, path)
+        except Exception:
+            self.release([digest])
+            raise
+        return path
+
+    def _download(self, digest, path):
+        partial = path + '.part'
+        print(f"📥 Downloading blob {digest[:12]}")
+        self.fetch_blob(digest, partial)
+        sha = hashlib.sha256()
+        with open(partial, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        if sha.hexdigest() != digest:
+            os.remove(partial)
+            raise ValueError(f"Blob hash mismatch: expected {digest[:12]}, got {sha.hexdigest()[:12]}")
+        os.replace(partial, path)
+        with self.lock:
+            self._sizes[digest] = os.path.getsize(path)
+            self._downloads.pop(digest, None)
+            self._evict()
+
+    def _evict(self):
+        total = sum(self._sizes.values())
+        for digest in list(self._sizes):
+            if total <= self.capacity:
+                break
+            if self._pinned.get(digest):
+                continue
+            total -= self._sizes.pop(digest)
+            try:
+                # Jobs still reading a mapped copy keep it until they finish
+                os.remove(os.path.join(self.directory, digest))
+            except OSError:
+                pass
+
+    def release(self, digests):
+        """Let blobs acquired for a finished job be evicted again"""
+        with self.lock:
+            for digest in digests:
+                count = self._pinned.get(digest, 0) - 1
+                if count > 0:
+                    self._pinned[digest] = count
+                else:
+                    self._pinned.pop(digest, None)
+            self._evict()
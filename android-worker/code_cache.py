@@ -0,0 +1,79 @@
+"""
+Compiled job code cache for the AndroCompute worker
+Job source is compiled once per content hash and reused for every repeat job,
+and a template's run() function is built once and reused for every call
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Compiled code objects kept, least recently used are evicted first
+CODE_CACHE_SIZE = 128
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+def clean_code(code):
+    """Strip the imports the execution environment already provides"""
+    if 'import hashlib' in code:
+        code = code.replace('import hashlib; ', '')
+    if 'import math' in code:
+        code = code.replace('import math; ', '')
+    return code
+
+
+class CodeCache:
+    """LRU cache of compiled code objects keyed by the SHA-256 of their source"""
+
+    def __init__(self, capacity=CODE_CACHE_SIZE):
+        self.capacity = capacity
+        self._compiled = OrderedDict()
+        # Template run() functions built from cached code, evicted with it
+        self.functions = {}
+        # Source of the cached code, for handing it on to other processes
+        self._sources = {}
+        self.hits = 0
+        self.misses = 0
+        # Jobs running on threads share the cache
+        self.lock = threading.Lock()
+
+    def __contains__(self, digest):
+        return digest in self._compiled
+
+    def get(self, digest):
+        with self.lock:
+            compiled = self._compiled.get(digest)
+            if compiled is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._compiled.move_to_end(digest)
+            return compiled
+
+    def source(self, digest):
+        """Cached source for a digest, marking it recently used, or None"""
+        return self._sources.get(digest) if self.get(digest) is not None else None
+
+    def put(self, code, digest=None):
+        """
+        Compile source and cache it
+
+        Raises:
+            ValueError: If digest is given and doesn't match the source
+        """
+        actual = code_hash(code)
+        if digest and digest != actual:
+            raise ValueError(f"Code hash mismatch: expected {digest[:12]}, got {actual[:12]}")
+        compiled = compile(clean_code(code), f"<job {actual[:12]}>", 'exec')
+        with self.lock:
+            self._compiled[actual] = compiled
+            self._compiled.move_to_end(actual)
+            self._sources[actual] = code
+            while len(self._compiled) > self.capacity:
+                evicted, _ = self._compiled.popitem(last=False)
+                self.functions.pop(evicted, None)
+                self._sources.pop(evicted, None)
+        return compiled
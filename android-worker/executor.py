@@ -0,0 +1,370 @@
+"""
+Job execution for the AndroCompute worker
+Runs job code and template functions, either in this process or spread over a
+pool of processes so a batch of jobs uses every core
+"""
+
+import base64
+import hashlib
+import itertools
+import math
+import mmap
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from blob_cache import open_blob
+from code_cache import CodeCache
+
+
+def decode_arg(value):
+    if isinstance(value, dict) and '$bytes' in value:
+        return base64.b64decode(value['$bytes'])
+    if isinstance(value, dict) and '$blob' in value:
+        return open_blob(value['path'])
+    return value
+
+
+def decode_args(args):
+    """
+    Template args are JSON, with binary values sent as {"$bytes": "<base64>"}
+    and blobs referenced as {"$blob": "<sha256>"}, which reach the job as a
+    read-only memory map once resolve_blobs has added their cached 'path'
+    """
+    return {name: decode_arg(value) for name, value in (args or {}).items()}
+
+
+def close_args(args):
+    for value in args.values():
+        if isinstance(value, mmap.mmap):
+            try:
+                value.close()
+            except BufferError:
+                # The job kept a view of it, the map closes once that's released
+                pass
+
+
+class JobRunner:
+    """Compiles and runs jobs, reusing compiled code and template functions across jobs"""
+
+    def __init__(self, fetch_code=None, blob_cache=None):
+        """
+        Args:
+            fetch_code (callable): digest -> source, for code the coordinator
+                didn't send because it expected it to be cached here
+            blob_cache (BlobCache): Where blobs referenced by args are cached,
+                None in pool processes, which get args already resolved
+        """
+        self.fetch_code = fetch_code
+        self.blob_cache = blob_cache
+        self.code_cache = CodeCache()
+        # Templates implemented natively on this device, by 'name@version'
+        self.local_templates = {}
+
+    def job_globals(self):
+        # FIXED: Use a safer execution environment with pre-imported modules
+        return {
+            'math': math,
+            'hashlib': hashlib,
+            'result': None
+        }
+
+    def source(self, code, digest):
+        """A job's source, from the job itself, the cache or the coordinator"""
+        if code is not None or not digest:
+            return code
+        cached = self.code_cache.source(digest)
+        return cached if cached is not None else self.fetch_code(digest)
+
+    def load_code(self, code, digest):
+        """Compiled code for a job, reusing the cache when its source was seen before"""
+        if digest:
+            compiled = self.code_cache.get(digest)
+            if compiled is not None:
+                return compiled
+            if code is None:
+                # The coordinator assumed we had it cached but it was evicted
+                code = self.fetch_code(digest)
+        return self.code_cache.put(code, digest)
+
+    def load_template(self, template, code, digest):
+        """A template's run() function, built once per code hash"""
+        func = self.local_templates.get(template)
+        if func is None and self.code_cache.get(digest) is not None:
+            # get() also marks the code recently used, so its function stays cached
+            func = self.code_cache.functions.get(digest)
+        if func is None:
+            namespace = self.job_globals()
+            exec(self.load_code(code, digest), namespace)
+            func = namespace['run']
+            self.code_cache.functions[digest] = func
+        return func
+
+    def resolve_blobs(self, args):
+        """
+        Download any blobs args reference and fill in their cached paths
+
+        Returns:
+            tuple: (args, digests) where the digests must be passed to
+            blob_cache.release() once the job is finished with them
+
+        Raises:
+            ValueError: If a blob can't be cached, e.g. it failed its hash check
+        """
+        refs = {name: value['$blob'] for name, value in (args or {}).items()
+                if isinstance(value, dict) and '$blob' in value}
+        if not refs:
+            return args, []
+        resolved, acquired = dict(args), []
+        try:
+            for name, digest in refs.items():
+                resolved[name] = {'$blob': digest, 'path': self.blob_cache.acquire(digest)}
+                acquired.append(digest)
+        except Exception:
+            self.blob_cache.release(acquired)
+            raise
+        return resolved, acquired
+
+    def execute(self, code, digest=None, template=None, args=None):
+        try:
+            start_time = time.time()
+
+            if template:
+                # Template jobs only carry arguments for an already-built function
+                job_args = decode_args(args)
+                try:
+                    result = self.load_template(template, code, digest)(**job_args)
+                finally:
+                    close_args(job_args)
+            else:
+                safe_globals = self.job_globals()
+                # Import statements are stripped when the code is compiled
+                exec(self.load_code(code, digest), safe_globals)
+                result = safe_globals.get('result', 'No result produced')
+
+            execution_time = time.time() - start_time
+            return {'success': True, 'result': result, 'execution_time': execution_time}
+
+        except Exception as e:
+            return {'success': False, 'error': str(e), 'execution_time': 0}
+
+
+# Result of a job stopped before it finished
+CANCELLED = {'success': False, 'error': 'Cancelled', 'execution_time': 0}
+
+
+def _serve(conn):
+    """Pool process loop: run each job sent over conn and send back its result"""
+    # Each pool process keeps its own runner, so code is compiled once per process
+    runner = JobRunner()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        result = runner.execute(*task)
+        try:
+            conn.send(result)
+        except Exception as e:
+            conn.send({'success': False, 'error': f"Result can't be sent back: {e}", 'execution_time': 0})
+
+
+class ExecutionPool:
+    """
+    Runs jobs concurrently on a pool of processes, one per core
+
+    Each job is handed to an idle pool process by one of max_workers threads,
+    so a job that has to be abandoned can be stopped by killing its process
+    without touching the others. Falls back to threads where processes can't
+    be started, e.g. on Android builds of Python that can't fork. Jobs for
+    local templates always run on threads in this process, their functions
+    can't be sent to another. Jobs on threads can't be interrupted once started.
+    """
+
+    def __init__(self, runner, max_workers):
+        self.runner = runner
+        self.max_workers = max(1, max_workers)
+        self.uses_processes = True
+        self._threads = ThreadPoolExecutor(max_workers=self.max_workers)
+        # (process, connection) for pool processes waiting for a job, started as jobs need them
+        self._idle = []
+        # Job token -> the process running it, None while one is being found
+        self._running = {}
+        # Tokens of jobs cancelled before they finished
+        self._cancelled = set()
+        self._tokens = itertools.count()
+        self.lock = threading.Lock()
+
+    def submit(self, code, digest=None, template=None, args=None):
+        """
+        Start a job
+
+        Returns:
+            Future: Resolves to the same result dict as JobRunner.execute
+        """
+        try:
+            # Blobs are downloaded here, so pool processes only have to map them
+            args, blobs = self.runner.resolve_blobs(args)
+        except Exception as e:
+            return self._failed(e)
+        future = self._submit(code, digest, template, args)
+        if blobs:
+            future.add_done_callback(lambda _: self.runner.blob_cache.release(blobs))
+        return future
+
+    def _failed(self, error):
+        future = Future()
+        future.set_result({'success': False, 'error': str(error), 'execution_time': 0})
+        return future
+
+    def _submit(self, code, digest, template, args):
+        token = next(self._tokens)
+        if template in self.runner.local_templates or not self.uses_processes:
+            future = self._threads.submit(self._run_on_thread, token, code, digest, template, args)
+        else:
+            # Pool processes have their own caches, so they always get the source
+            try:
+                code = self.runner.source(code, digest)
+                if digest and digest not in self.runner.code_cache:
+                    self.runner.code_cache.put(code, digest)
+            except Exception as e:
+                return self._failed(e)
+            future = self._threads.submit(self._run_on_process, token, (code, digest, template, args))
+        future.token = token
+        return future
+
+    def _take_cancelled(self, token):
+        # Under the lock
+        if token in self._cancelled:
+            self._cancelled.discard(token)
+            return True
+        return False
+
+    def _run_on_thread(self, token, code, digest, template, args):
+        with self.lock:
+            if self._take_cancelled(token):
+                return CANCELLED
+        return self.runner.execute(code, digest, template, args)
+
+    def _start_process(self):
+        parent_conn, child_conn = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=_serve, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def _run_on_process(self, token, task):
+        with self.lock:
+            if self._take_cancelled(token):
+                return CANCELLED
+            self._running[token] = None
+            worker = self._idle.pop() if self._idle else None
+        try:
+            if worker is None:
+                try:
+                    worker = self._start_process()
+                except (ImportError, OSError, NotImplementedError, ValueError) as e:
+                    print(f"⚠️ Job processes unavailable ({e}), running jobs on threads")
+                    self.uses_processes = False
+                    with self.lock:
+                        # Running on this thread now, so it can no longer be stopped
+                        self._running.pop(token, None)
+                        if self._take_cancelled(token):
+                            return CANCELLED
+                    return self.runner.execute(*task)
+            process, conn = worker
+            with self.lock:
+                if self._take_cancelled(token):
+                    self._idle.append(worker)
+                    return CANCELLED
+                self._running[token] = process
+
+            try:
+                conn.send(task)
+            except (EOFError, OSError):
+                # The idle process had died, e.g. killed by the system to free memory
+                self._discard(worker)
+                return self._run_on_process(token, task)
+            except Exception as e:
+                # Args that can't be pickled, nothing reached the process
+                self._idle_or_discard(token, worker)
+                return {'success': False, 'error': f"Job can't be sent to a pool process: {e}", 'execution_time': 0}
+
+            try:
+                result = conn.recv()
+            except (EOFError, OSError):
+                self._discard(worker)
+                with self.lock:
+                    cancelled = self._take_cancelled(token)
+                return CANCELLED if cancelled else {'success': False, 'error': 'Job process died', 'execution_time': 0}
+            self._idle_or_discard(token, worker)
+            return result
+        finally:
+            with self.lock:
+                self._running.pop(token, None)
+
+    def _idle_or_discard(self, token, worker):
+        with self.lock:
+            # A cancel that raced with the job finishing may have killed the process anyway
+            killed = self._take_cancelled(token)
+            if not killed:
+                self._idle.append(worker)
+        if killed:
+            self._discard(worker)
+
+    def _discard(self, worker):
+        process, conn = worker
+        process.kill()
+        process.join()
+        conn.close()
+
+    def cancel(self, future):
+        """
+        Stop a job that hasn't finished, killing its pool process if it's
+        already running there. Jobs already running on threads can't be stopped
+
+        Returns:
+            bool: Whether the job was stopped, it then resolves to CANCELLED
+            unless it finished at that very moment
+        """
+        token = getattr(future, 'token', None)
+        if token is None or future.done():
+            return False
+        with self.lock:
+            if token in self._running:
+                process = self._running[token]
+            elif not future.running():
+                # Still queued for a thread, which skips it
+                self._cancelled.add(token)
+                return True
+            else:
+                return False
+            self._cancelled.add(token)
+        if process is not None:
+            process.kill()
+        return True
+
+    def result(self, future):
+        """A job's result dict"""
+        try:
+            return future.result()
+        except Exception as e:
+            return {'success': False, 'error': str(e), 'execution_time': 0}
+
+    def shutdown(self):
+        # Lets running and queued jobs finish, then stops the idle pool processes
+        self._threads.shutdown()
+        with self.lock:
+            idle, self._idle = self._idle, []
+        for process, conn in idle:
+            try:
+                conn.send(None)
+            except OSError:
+                pass
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+            conn.close()
@@ -0,0 +1,78 @@
+"""
+Power governor for the AndroCompute worker
+Decides from the phone's battery, charging state and temperature how many
+jobs it runs at once and whether it leases work ahead of its free slots.
+Past the pause thresholds it takes no new work and hands back what it has
+queued, and only resumes once the phone has recharged or cooled down by a
+margin, so a hot phone runs in bursts instead of flapping on every reading
+"""
+
+# Off the charger, run one job at a time below LOW_BATTERY_LEVEL% and on half
+# the cores below BATTERY_SAVER_LEVEL%
+LOW_BATTERY_LEVEL = 20
+BATTERY_SAVER_LEVEL = 50
+# Degrees C, run on half the cores above WARM_TEMPERATURE and one job at a
+# time above HOT_TEMPERATURE so the phone doesn't throttle or overheat
+WARM_TEMPERATURE = 40
+HOT_TEMPERATURE = 45
+# Stop taking work off the charger below PAUSE_BATTERY_LEVEL%, or above
+# PAUSE_TEMPERATURE degrees C. Jobs already running finish
+PAUSE_BATTERY_LEVEL = 10
+PAUSE_TEMPERATURE = 50
+# Percent of charge or degrees C past the pause threshold before work resumes
+RESUME_MARGIN = 5
+
+NORMAL = 'normal'
+THROTTLED = 'throttled'
+PAUSED = 'paused'
+
+
+class PowerGovernor:
+    """Concurrency and prefetching for the device's current power state"""
+
+    def __init__(self):
+        self.state = NORMAL
+
+    def update(self, resources, max_concurrency):
+        """
+        Re-evaluate the power state from fresh device readings
+
+        Args:
+            resources (dict): battery_level, is_charging and temperature (None
+                if the device has no readable sensor)
+            max_concurrency (int): Jobs the worker runs at once at full power
+
+        Returns:
+            tuple: (state, concurrency, prefetch) where state is 'normal',
+            'throttled' or 'paused', concurrency is the jobs to run at once (0
+            while paused) and prefetch whether to lease jobs ahead of free slots
+        """
+        charging = resources.get('is_charging', True)
+        battery_level = resources.get('battery_level', 100)
+        temperature = resources.get('temperature')
+
+        # Once paused the readings have to clear the threshold by a margin
+        margin = RESUME_MARGIN if self.state == PAUSED else 0
+        if ((not charging and battery_level < PAUSE_BATTERY_LEVEL + margin)
+                or (temperature is not None and temperature >= PAUSE_TEMPERATURE - margin)):
+            self.state = PAUSED
+            return self.state, 0, False
+
+        limit = max_concurrency
+        if not charging:
+            if battery_level < LOW_BATTERY_LEVEL:
+                limit = 1
+            elif battery_level < BATTERY_SAVER_LEVEL:
+                limit = max(1, limit // 2)
+        if temperature is not None:
+            if temperature >= HOT_TEMPERATURE:
+                limit = 1
+            elif temperature >= WARM_TEMPERATURE:
+                limit = max(1, limit // 2)
+
+        throttled = (not charging and battery_level < BATTERY_SAVER_LEVEL) or (
+            temperature is not None and temperature >= WARM_TEMPERATURE)
+        self.state = THROTTLED if throttled else NORMAL
+        # Jobs leased ahead are held back from phones with power to spare, and
+        # would have to be handed back if this one pauses
+        return self.state, limit, not throttled
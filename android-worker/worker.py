@@ -1,17 +1,77 @@
+import asyncio
+import json
 import requests
-import time
 import psutil
 import os
-import math
-import hashlib
+import glob
+
+import wire
+
+from requests.adapters import HTTPAdapter
+
+from async_runtime import PREFETCH_PER_SLOT, AsyncWorkerRuntime, ResultsRejected
+from blob_cache import BlobCache
+from executor import ExecutionPool, JobRunner
+from power_governor import PowerGovernor
 
 COORDINATOR_URL = "https://sulebashir.pythonanywhere.com"
 
+# Seconds the coordinator may hold /get_job open waiting for work (0 = plain polling)
+LONG_POLL_WAIT = 20
+# Delay between polls when long-polling is off, and backoff after errors
+POLL_INTERVAL = 5
+# Seconds between heartbeats, keep well under the coordinator's lease timeout (60s)
+HEARTBEAT_INTERVAL = 15
+# Keep-alive connections held open to the coordinator, enough for a long-poll,
+# an upload, a heartbeat and a code fetch to overlap
+HTTP_POOL_SIZE = 4
+# Bytes written at a time while downloading a blob
+BLOB_CHUNK = 256 * 1024
+# Seconds without a byte on the job stream before it's considered dead, the
+# coordinator sends a keep-alive every 10
+STREAM_TIMEOUT = 35
+# Identifies this phone across worker restarts, so the coordinator keeps its performance profile
+DEVICE_ID_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'device_id')
+
 class AndroidWorker:
-    def __init__(self, coordinator_url):
+    def __init__(self, coordinator_url, poll_wait=LONG_POLL_WAIT, max_concurrency=None):
         self.coordinator_url = coordinator_url
         self.node_id = f"android_{os.urandom(4).hex()}"
+        self.device_id = self.load_device_id()
         self.running = True
+        # The AsyncWorkerRuntime while start() runs
+        self.runtime = None
+        self.poll_wait = poll_wait
+        # Jobs run at once, at most max_concurrency (default every core) and
+        # lowered, or 0 to pause, while the battery is low or the phone is hot
+        self.max_concurrency = max_concurrency
+        self.concurrency = 1
+        self.governor = PowerGovernor()
+        # Whether to lease jobs ahead of free slots, off while saving power
+        self.prefetch = True
+        # Leased jobs not yet reported, renewed by the heartbeat thread
+        self.in_flight = set()
+        # Jobs the coordinator has taken back, skipped if not started yet
+        self.lost_jobs = set()
+        self.blob_cache = BlobCache(fetch_blob=self.fetch_blob)
+        self.runner = JobRunner(fetch_code=self.fetch_code, blob_cache=self.blob_cache)
+        self.code_cache = self.runner.code_cache
+        self.local_templates = self.runner.local_templates
+        # Created at registration, once we know how many cores there are
+        self.pool = None
+        # Latest device readings, sent with heartbeats and result uploads
+        self.resources = {}
+        # Every request reuses these connections instead of a new TCP+TLS handshake
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # Responses come back in the most compact format we both speak, requests
+        # undoes their compression. Request bodies stay plain JSON until the
+        # coordinator says at registration what it can read
+        self.session.headers['Accept'] = ', '.join(wire.formats())
+        self.wire_format = wire.JSON
+        self.wire_encoding = None
 
     def get_system_info(self):
         try:
@@ -21,122 +81,320 @@ class AndroidWorker:
                 'memory_total': psutil.virtual_memory().total,
                 'battery_level': battery.percent if battery else 100,
                 'is_charging': battery.power_plugged if battery else True,
+                'temperature': self.read_temperature(),
             }
         except:
             return {'cpu_cores': 4, 'battery_level': 100, 'is_charging': True}
 
-    def register(self):
+    def read_temperature(self):
+        """Hottest temperature sensor in degrees C, None if the device has none we can read"""
+        readings = []
+        if hasattr(psutil, 'sensors_temperatures'):
+            try:
+                readings = [entry.current for entries in psutil.sensors_temperatures().values()
+                            for entry in entries if entry.current]
+            except Exception:
+                pass
+        if not readings:
+            # Android exposes thermal zones in sysfs but psutil doesn't read them there
+            for path in glob.glob('/sys/class/thermal/thermal_zone*/temp'):
+                try:
+                    with open(path) as f:
+                        value = int(f.read().strip())
+                except (OSError, ValueError):
+                    continue
+                # Most zones report millidegrees
+                readings.append(value / 1000 if value > 1000 else value)
+        return max(readings) if readings else None
+
+    def update_resources(self):
+        """Re-read the device's state and let the power governor set how many jobs to run at once"""
         resources = self.get_system_info()
+        try:
+            # Utilisation of each core since the last reading, goes up with heartbeats and result uploads
+            resources['cpu_percent'] = psutil.cpu_percent(percpu=True)
+        except Exception:
+            pass
+        if self.pool is None:
+            self.pool = ExecutionPool(self.runner, self.max_concurrency or resources.get('cpu_cores') or 1)
+        state, self.concurrency, self.prefetch = self.governor.update(resources, self.pool.max_workers)
+        previous = self.resources.get('power_state')
+        if previous and state != previous:
+            print(f"🔋 Power state {previous} -> {state}: running up to {self.concurrency} jobs at once "
+                  f"(battery {resources.get('battery_level')}%, "
+                  f"{'charging' if resources.get('is_charging', True) else 'on battery'}, "
+                  f"temperature {resources.get('temperature')})")
+        resources['power_state'] = state
+        resources['concurrency'] = self.concurrency
+        # Jobs the coordinator may push us at once, running plus prefetched
+        resources['slots'] = self.concurrency * (1 + PREFETCH_PER_SLOT) if self.prefetch else self.concurrency
+        # Lookups since the worker started, shows how much fetching and compiling the caches save
+        resources['code_cache'] = {'hits': self.code_cache.hits, 'misses': self.code_cache.misses}
+        resources['blob_cache'] = {'hits': self.blob_cache.hits, 'misses': self.blob_cache.misses}
+        self.resources = resources
+        return resources
+
+    def post(self, path, payload, timeout=10):
+        """POST payload to the coordinator in the negotiated format, compressed if it's large"""
+        body = wire.pack(payload, self.wire_format)
+        headers = {'Content-Type': self.wire_format}
+        if self.wire_encoding and len(body) >= wire.COMPRESS_MIN_BYTES:
+            body = wire.compress(body, self.wire_encoding)
+            headers['Content-Encoding'] = self.wire_encoding
+        return self.session.post(f"{self.coordinator_url}{path}", data=body, headers=headers, timeout=timeout)
+
+    def read(self, response):
+        """A coordinator response's body, in whichever format it was sent"""
+        return wire.unpack(response.content, response.headers.get('Content-Type'))
+
+    def load_device_id(self):
+        """This phone's device ID, created on first start and kept in DEVICE_ID_FILE"""
+        try:
+            with open(DEVICE_ID_FILE) as f:
+                device_id = f.read().strip()
+            if device_id:
+                return device_id
+        except OSError:
+            pass
+        device_id = f"device_{os.urandom(8).hex()}"
+        try:
+            with open(DEVICE_ID_FILE, 'w') as f:
+                f.write(device_id)
+        except OSError as e:
+            print(f"⚠️ Couldn't save device ID, performance history restarts with the worker: {e}")
+        return device_id
+
+    def register(self):
+        resources = self.update_resources()
         data = {
             'node_id': self.node_id,
-            'resources': resources
+            # Runtimes are profiled per device, so a restarted worker keeps its history
+            'device_id': self.device_id,
+            'resources': resources,
+            # Jobs over data we already hold are steered to us
+            'blobs': self.blob_cache.digests(),
+            # Lets the coordinator send a code hash instead of source we already compiled
+            'code_cache_size': self.code_cache.capacity
         }
 
         try:
-            response = requests.post(f"{self.coordinator_url}/register", json=data, timeout=10)
-            print(f"✅ Registered as: {self.node_id}")
+            response = self.post('/register', data)
+            offer = self.read(response).get('wire') or {}
+            self.wire_format = wire.negotiate(wire.formats(), offer.get('formats')) or wire.JSON
+            self.wire_encoding = wire.negotiate(wire.encodings(), offer.get('encodings'))
+            print(f"✅ Registered as: {self.node_id} (sending {self.wire_format}, {self.wire_encoding or 'uncompressed'})")
             return True
         except Exception as e:
             print(f"❌ Registration failed: {e}")
             return False
 
-    def execute_job(self, code):
+    def fetch_code(self, digest):
+        response = self.session.get(f"{self.coordinator_url}/code/{digest}", timeout=10)
+        response.raise_for_status()
+        return self.read(response)['code']
+
+    def fetch_blob(self, digest, path):
+        """Download a blob to path, resuming from however much of it path already holds"""
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        headers = {'Range': f"bytes={offset}-"} if offset else {}
+        with self.session.get(f"{self.coordinator_url}/blobs/{digest}", headers=headers,
+                              stream=True, timeout=(10, 60)) as response:
+            if response.status_code == 416:
+                # The previous attempt got all of it
+                return
+            response.raise_for_status()
+            with open(path, 'ab' if response.status_code == 206 else 'wb') as f:
+                for chunk in response.iter_content(BLOB_CHUNK):
+                    f.write(chunk)
+
+    def register_template(self, name, version, func):
+        """Run jobs for template name@version with a local function instead of its source"""
+        self.local_templates[f"{name}@{version}"] = func
+
+    def lease_jobs(self, max_jobs):
+        """
+        Lease up to max_jobs jobs, long-polling for the first
+
+        Returns:
+            list: Job payloads, already counted as in flight
+
+        Raises:
+            requests.RequestException: If the coordinator can't be reached or errors
+        """
+        response = self.session.get(
+            f"{self.coordinator_url}/get_jobs/{self.node_id}",
+            params={'wait': self.poll_wait, 'max': max_jobs},
+            timeout=self.poll_wait + 10
+        )
+        print(f"📡 Response status: {response.status_code}")
+        response.raise_for_status()
+        batch = self.read(response).get('jobs', [])
+        self.in_flight.update(job_data['job_id'] for job_data in batch)
+        return batch
+
+    def start_job(self, job_data):
+        """Start a leased job on the pool, returns None if its lease was already lost"""
+        if job_data['job_id'] in self.lost_jobs:
+            print(f"↩️ Skipping {job_data['job_id']}, lease lost")
+            self.in_flight.discard(job_data['job_id'])
+            return None
+        print(f"🎯 GOT JOB: {job_data['job_id']} ({job_data['type']})")
+        return self.pool.submit(job_data.get('code'), job_data.get('code_hash'),
+                                job_data.get('template'), job_data.get('args'))
+
+    def job_report(self, job_data, result):
+        """The result to upload for a finished job, None if another copy already finished"""
+        if job_data['job_id'] in self.lost_jobs:
+            # Another copy finished first, the coordinator cancelled ours
+            print(f"↩️ Dropping result for {job_data['job_id']}, already completed elsewhere")
+            self.in_flight.discard(job_data['job_id'])
+            return None
+
+        if result['success']:
+            print(f"✅ Job completed: {result['result']} (in {result['execution_time']:.3f}s)")
+            value = result['result']
+        else:
+            print(f"❌ Job failed: {result['error']}")
+            # Report the error so the job is cleared
+            value = f"ERROR: {result['error']}"
+
+        return {
+            'job_id': job_data['job_id'],
+            'node_id': self.node_id,
+            'result': value,
+            'success': result['success'],
+            'execution_time': result['execution_time']
+        }
+
+    def release_jobs(self, job_ids):
+        """Hand leased jobs we haven't started back to the coordinator for other nodes"""
+        response = self.post('/release_jobs', {'node_id': self.node_id, 'job_ids': job_ids,
+                                               'resources': self.resources})
+        response.raise_for_status()
+        self.in_flight.difference_update(job_ids)
+        print(f"↩️ Handed back {len(job_ids)} jobs ({self.resources.get('power_state')})")
+        return response
+
+    def upload_results(self, results):
+        """
+        Upload finished jobs' results in one request
+
+        Raises:
+            ResultsRejected: If they can't be encoded or the coordinator refused them
+            requests.RequestException: On transport errors and 5xx responses
+        """
+        payload = {'results': results, 'node_id': self.node_id, 'resources': self.resources}
         try:
-            start_time = time.time()
-            
-            # FIXED: Use a safer execution environment with pre-imported modules
-            safe_globals = {
-                'math': math,
-                'hashlib': hashlib,
-                'result': None
-            }
-            
-            # Remove import statements and execute the main logic
-            clean_code = code
-            if 'import hashlib' in code:
-                clean_code = code.replace('import hashlib; ', '')
-            if 'import math' in code:
-                clean_code = clean_code.replace('import math; ', '')
-            
-            exec(clean_code, safe_globals)
-            result = safe_globals.get('result', 'No result produced')
-            
-            execution_time = time.time() - start_time
-            return {'success': True, 'result': result, 'execution_time': execution_time}
-            
+            response = self.post('/submit_results', payload)
+        except requests.RequestException:
+            raise
         except Exception as e:
-            return {'success': False, 'error': str(e), 'execution_time': 0}
+            raise ResultsRejected(f"can't encode results: {e}")
+        if 400 <= response.status_code < 500:
+            raise ResultsRejected(f"coordinator refused them: {response.status_code} {response.text[:200]}")
+        response.raise_for_status()
+        self.in_flight.difference_update(report['job_id'] for report in results)
+        print(f"📤 {len(results)} results submitted: {response.status_code}")
+        return response
+
+    def open_stream(self, slots):
+        """
+        Open the coordinator's job stream, which pushes jobs as they are queued
+
+        Raises:
+            requests.RequestException: If the coordinator can't stream to us
+        """
+        response = self.session.get(
+            f"{self.coordinator_url}/stream/{self.node_id}",
+            params={'slots': slots},
+            stream=True,
+            timeout=(10, STREAM_TIMEOUT)
+        )
+        if response.status_code != 200 or not response.headers.get('Content-Type', '').startswith('text/event-stream'):
+            response.close()
+            raise requests.HTTPError(f"Job stream unavailable: {response.status_code}")
+        if not response.raw.chunked:
+            # Without chunked encoding (an HTTP/1.0 server) reads block until a
+            # whole buffer fills, so pushed jobs would sit in it
+            response.close()
+            raise requests.HTTPError("Job stream isn't chunked, the coordinator must speak HTTP/1.1")
+        return response
+
+    def stream_events(self, response):
+        """(event, data) for each message on an open job stream, until it closes"""
+        event, data = None, []
+        for line in response.iter_lines(decode_unicode=True):
+            if line.startswith('event:'):
+                event = line[6:].strip()
+            elif line.startswith('data:'):
+                data.append(line[5:].strip())
+            elif not line:
+                # A blank line ends a message, lines starting with ':' are keep-alives
+                if event and data:
+                    yield event, json.loads('\n'.join(data))
+                event, data = None, []
+
+    def close_stream(self, response):
+        """
+        Close a job stream from another thread. The thread reading it stops at
+        the next keep-alive, or when the STREAM_TIMEOUT read timeout runs out
+        if the coordinator has gone quiet
+        """
+        response.close()
 
-    def check_for_jobs(self):
+    def heartbeat(self):
+        """Renew leases on in-flight jobs and re-register if the coordinator forgot us"""
         try:
-            print(f"🔍 Checking jobs at: /get_job/{self.node_id}")
-            response = requests.get(f"{self.coordinator_url}/get_job/{self.node_id}", timeout=10)
-            print(f"📡 Response status: {response.status_code}")
-
-            if response.status_code == 200:
-                job_data = response.json()
-                
-                if job_data.get('job_id'):
-                    print(f"🎯 GOT JOB: {job_data['job_id']} ({job_data['type']})")
-                    result = self.execute_job(job_data['code'])
-
-                    if result['success']:
-                        print(f"✅ Job completed: {result['result']} (in {result['execution_time']:.3f}s)")
-                        
-                        # Submit result
-                        result_data = {
-                            'job_id': job_data['job_id'],
-                            'node_id': self.node_id,
-                            'result': result['result'],
-                            'execution_time': result['execution_time']
-                        }
-
-                        submit_response = requests.post(
-                            f"{self.coordinator_url}/submit_result",
-                            json=result_data,
-                            timeout=10
-                        )
-                        print(f"📤 Result submitted: {submit_response.status_code}")
-                        return True
-                    else:
-                        print(f"❌ Job failed: {result['error']}")
-                        # Mark as failed to clear the job
-                        result_data = {
-                            'job_id': job_data['job_id'],
-                            'node_id': self.node_id,
-                            'result': f"ERROR: {result['error']}",
-                            'execution_time': result['execution_time']
-                        }
-                        requests.post(f"{self.coordinator_url}/submit_result", json=result_data, timeout=5)
-                else:
-                    print("📭 No job available")
-            else:
-                print(f"❌ HTTP Error: {response.status_code}")
-                
+            resources = self.update_resources()
+            response = self.post('/heartbeat', {
+                # copy() is atomic, the set may change under us while jobs finish on other threads
+                'node_id': self.node_id, 'job_ids': list(self.in_flight.copy()), 'resources': resources,
+                'blobs': self.blob_cache.digests()
+            })
+            data = self.read(response)
+            self.lost_jobs = set(data.get('lost', []))
+            if not data.get('registered', True):
+                print("🔁 Coordinator lost our registration, registering again")
+                self.register()
         except Exception as e:
-            print(f"⚠️ Job check error: {e}")
-            
-        return False
+            print(f"⚠️ Heartbeat error: {e}")
 
     def start(self):
         print("🚀 Starting Android Worker...")
         print(f"📡 Coordinator: {self.coordinator_url}")
 
         if self.register():
-            print("🔄 Worker running. Checking for jobs every 5 seconds...")
+            print(f"⚙️ Running up to {self.concurrency} of {self.pool.max_workers} jobs at once")
+            if self.poll_wait:
+                print("🔄 Worker running. Waiting for jobs (long-poll)...")
+            else:
+                print(f"🔄 Worker running. Checking for jobs every {POLL_INTERVAL} seconds...")
             print("💡 Press Ctrl+C to stop")
-            job_count = 0
             try:
-                while self.running:
-                    if self.check_for_jobs():
-                        job_count += 1
-                        print(f"📊 Total jobs completed: {job_count}")
-                    time.sleep(5)
+                # Leasing, running and uploading overlap, see async_runtime
+                self.runtime = AsyncWorkerRuntime(self, HEARTBEAT_INTERVAL, POLL_INTERVAL)
+                asyncio.run(self.runtime.run())
+                print("🛑 Worker stopped")
             except KeyboardInterrupt:
                 print("\n🛑 Worker stopped by user")
+            finally:
+                self.running = False
+                self.runtime = None
+                self.pool.shutdown()
         else:
             print("💥 Failed to start worker.")
 
+    def stop(self):
+        """Stop a running worker from any thread, start() returns once its running jobs finish"""
+        self.running = False
+        runtime = self.runtime
+        if runtime is not None and runtime.loop is not None:
+            try:
+                runtime.loop.call_soon_threadsafe(runtime.stop)
+            except RuntimeError:
+                # The event loop already closed
+                pass
+
 if __name__ == "__main__":
     worker = AndroidWorker(COORDINATOR_URL)
     worker.start()
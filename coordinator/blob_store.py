@@ -0,0 +1,126 @@
+"""
+Blob storage for the AndroCompute coordinator
+Input data is stored once as a file named by its SHA-256 and referenced from
+job args by that hash, so a dataset is uploaded once and every job over it
+carries only the hash. Large blobs can be uploaded in chunks and resumed
+"""
+
+import hashlib
+import os
+import re
+import shutil
+import threading
+
+# Bytes read or written at a time while copying and hashing
+COPY_CHUNK = 1024 * 1024
+
+_DIGEST = re.compile(r'^[0-9a-f]{64}$')
+
+
+def is_digest(digest):
+    return isinstance(digest, str) and bool(_DIGEST.match(digest))
+
+
+def file_digest(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def blob_refs(args):
+    """SHA-256 hashes of the blobs a job's args reference as {"$blob": "<sha256>"}"""
+    return [value['$blob'] for value in (args or {}).values() if isinstance(value, dict) and '$blob' in value]
+
+
+class BlobStore:
+    """Content-addressed files in one directory, uploaded whole or in chunks and verified on completion"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        # Uploads still in progress are kept as <digest>.part until they verify,
+        # each under its own lock so a slow upload doesn't hold up the others
+        self._uploads = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, digest):
+        return is_digest(digest) and os.path.exists(self._path(digest))
+
+    def _path(self, digest):
+        return os.path.join(self.directory, digest)
+
+    def path(self, digest):
+        """File holding a complete blob, None if it isn't stored"""
+        return self._path(digest) if digest in self else None
+
+    def size(self, digest):
+        return os.path.getsize(self._path(digest)) if digest in self else None
+
+    def received(self, digest):
+        """Bytes of a blob uploaded so far, its full size once complete"""
+        if digest in self:
+            return self.size(digest)
+        partial = self._path(digest) + '.part'
+        return os.path.getsize(partial) if is_digest(digest) and os.path.exists(partial) else 0
+
+    def write(self, digest, stream, offset=0, total=None):
+        """
+        Append one chunk of an upload, or store a whole blob
+
+        Args:
+            digest (str): SHA-256 the finished blob must have
+            stream: File-like request body holding the chunk
+            offset (int): Where the chunk starts, must be the bytes received so far
+            total (int): Size of the whole blob, None if this chunk is all of it
+
+        Returns:
+            int: Bytes received so far, the blob's size once it is complete
+
+        Raises:
+            ValueError: If the digest is malformed, the chunk doesn't continue
+                the upload or the finished blob doesn't match its digest
+        """
+        if not is_digest(digest):
+            raise ValueError('Blobs are named by the lowercase hex SHA-256 of their content')
+        partial = self._path(digest) + '.part'
+        with self.lock:
+            upload_lock = self._uploads.setdefault(digest, threading.Lock())
+        with upload_lock:
+            if digest in self:
+                # Already stored, e.g. by another client, nothing to upload
+                return self.size(digest)
+            received = os.path.getsize(partial) if os.path.exists(partial) else 0
+            if offset != received:
+                raise ValueError(f"Upload of {digest} continues at byte {received}, not {offset}")
+            with open(partial, 'ab' if offset else 'wb') as f:
+                shutil.copyfileobj(stream, f, COPY_CHUNK)
+            received = os.path.getsize(partial)
+            if total is not None and received < total:
+                return received
+            if (total is not None and received > total) or file_digest(partial) != digest:
+                os.remove(partial)
+                raise ValueError(f"Upload doesn't match {digest}, start again")
+            os.replace(partial, self._path(digest))
+        with self.lock:
+            self._uploads.pop(digest, None)
+        return received
+
+    def remove(self, digest):
+        """Delete a blob and any partial upload of it, returns whether anything was deleted"""
+        removed = False
+        with self.lock:
+            upload_lock = self._uploads.setdefault(digest, threading.Lock())
+        with upload_lock:
+            for path in (self._path(digest), self._path(digest) + '.part'):
+                if is_digest(digest) and os.path.exists(path):
+                    os.remove(path)
+                    removed = True
+        with self.lock:
+            self._uploads.pop(digest, None)
+        return removed
+
+    def list(self):
+        """{digest: size} for every complete blob"""
+        return {name: os.path.getsize(self._path(name)) for name in os.listdir(self.directory) if is_digest(name)}
@@ -0,0 +1,133 @@
+"""
+Structured event log for the AndroCompute coordinator
+Request threads only put a record on a bounded queue, a background thread
+formats and writes it, so a slow terminal or log pipe never holds up the
+request path. Frequent per-job events can be sampled, and when the queue is
+full records are dropped and counted rather than waited for
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+
+
+class TextFormatter(logging.Formatter):
+    """The human-readable message, as the coordinator has always printed it"""
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None)
+        if fields is None:
+            # Records from other libraries' loggers routed through capture()
+            return record.getMessage()
+        try:
+            return record.msg.format(**fields)
+        except (KeyError, IndexError, ValueError):
+            return record.msg
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, event and the event's fields"""
+
+    def format(self, record):
+        entry = {'time': record.created, 'level': record.levelname.lower(),
+                 'event': getattr(record, 'event', record.name)}
+        fields = getattr(record, 'fields', None)
+        if fields is None:
+            entry['message'] = record.getMessage()
+        else:
+            entry.update(fields)
+            if getattr(record, 'sample_rate', 1) < 1:
+                # Lets counts derived from the log be scaled back up
+                entry['sample_rate'] = record.sample_rate
+        return json.dumps(entry, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue, event_log):
+        super().__init__(log_queue)
+        self.event_log = event_log
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread, not the request thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.event_log.dropped += 1
+
+
+class EventLog:
+    """Non-blocking, optionally sampled, text or JSON event log"""
+
+    def __init__(self, name='androcompute', format='text', sample_rate=1.0, queue_size=10000, stream=None):
+        """
+        Args:
+            name (str): Logger name
+            format (str): 'text' for readable messages, 'json' for one object per line
+            sample_rate (float): Fraction of sampled events that are logged
+            queue_size (int): Records buffered for the writer before new ones are dropped
+            stream: Where to write, stdout by default
+        """
+        self.sample_rate = sample_rate
+        self.dropped = 0
+        self.sampled_out = 0
+        self.queue = queue.Queue(queue_size)
+        self.handler = _DroppingQueueHandler(self.queue, self)
+
+        writer = logging.StreamHandler(stream or sys.stdout)
+        writer.setFormatter(JsonFormatter() if format == 'json' else TextFormatter())
+        self.listener = logging.handlers.QueueListener(self.queue, writer)
+        self.listener.start()
+        atexit.register(self.close)
+
+        self.logger = self.capture(name)
+
+    def capture(self, name):
+        """Route another logger, e.g. the web server's request log, through the queue"""
+        logger = logging.getLogger(name)
+        logger.handlers = [self.handler]
+        logger.propagate = False
+        if logger.level == logging.NOTSET:
+            logger.setLevel(logging.INFO)
+        return logger
+
+    def event(self, event, message, level=logging.INFO, sampled=False, **fields):
+        """
+        Log one event
+
+        Args:
+            event (str): Machine-readable event name, e.g. 'job_sent'
+            message (str): str.format template filled from fields, for the text format
+            level (int): logging level
+            sampled (bool): Whether this is a frequent event subject to sample_rate
+            **fields: The event's data, must be JSON-serializable or str()-able
+        """
+        if sampled and self.sample_rate < 1 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        if not self.logger.isEnabledFor(level):
+            return
+        record = logging.LogRecord(self.logger.name, level, '', 0, message, None, None)
+        record.event = event
+        record.fields = fields
+        record.sample_rate = self.sample_rate if sampled else 1
+        self.logger.handle(record)
+
+    def info(self, event, message, sampled=False, **fields):
+        self.event(event, message, logging.INFO, sampled, **fields)
+
+    def warning(self, event, message, sampled=False, **fields):
+        self.event(event, message, logging.WARNING, sampled, **fields)
+
+    def close(self):
+        """Write out whatever is still queued"""
+        if self.listener._thread is not None:
+            self.listener.stop()
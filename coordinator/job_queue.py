@@ -0,0 +1,748 @@
+"""
+Job queue for the AndroCompute coordinator
+Keeps per-node pending queues, a shared unassigned queue and status indexes
+so polling a node or changing a job's status never scans every job
+"""
+
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Journal event name for each status a job can move to
+STATUS_EVENTS = {
+    'assigned': 'assign',
+    'pending': 'requeue',
+    'executing': 'execute',
+    'completed': 'complete',
+    'failed': 'fail',
+    'blocked': 'block'
+}
+# Deferred jobs one claim looks past in the shared queue before giving up
+MAX_DEFERRED_SCAN = 100
+
+
+class JobQueue:
+    """Indexed job storage with O(1) enqueue, dequeue and status transitions"""
+
+    def __init__(self, lease_timeout=60, max_attempts=3, max_finished=None, finished_ttl=None):
+        """
+        Args:
+            lease_timeout (float): Seconds a node holds a job before it is re-queued
+            max_attempts (int): Dispatches before a job is dead-lettered
+            max_finished (int): Completed and failed job records kept, the oldest
+                are removed past this, None keeps them until removed
+            finished_ttl (float): Seconds a finished job record is kept, None
+                keeps it until removed
+        """
+        self.lease_timeout = lease_timeout
+        self.max_attempts = max_attempts
+        self.max_finished = max_finished
+        self.finished_ttl = finished_ttl
+        self.jobs = {}
+        # job_id -> finished_at for completed and failed jobs, oldest first
+        self.finished = OrderedDict()
+        self.unassigned = deque()
+        self.node_queues = {}
+        # node_id -> {job_id: None} for jobs the node is currently running
+        self.node_executing = {}
+        # status -> {job_id: None}, a dict used as an insertion-ordered set
+        self.by_status = {}
+        # (lease_expires_at, job_id) min-heap, entries go stale when a lease is renewed
+        self.leases = []
+        # Optional callable (job, node_id) -> seconds a run should take before a
+        # backup copy is launched elsewhere, or None to never speculate
+        self.straggler_threshold = None
+        # Optional callable (job, node_id) -> seconds the node is expected to take
+        # over the job, or None if unknown, used to size batches to a time budget
+        self.expected_runtime = None
+        # (speculate_at, job_id) min-heap and the backup copies waiting for an idle node
+        self.speculation = []
+        self.backups = deque()
+        # Optional callable (job, node_id) -> seconds a job in the shared queue must
+        # have waited before the node may claim it, e.g. so a node that has its input
+        # data cached gets the first chance at it. Runs under the lock, like on_failed
+        self.claim_delay = None
+        # (claimable_at, job_id) min-heap of shared jobs a claim passed over that way
+        self.deferred = []
+        # Optional callable (job_id) run under the lock when a job is dead-lettered,
+        # must not call into anything that takes its own locks before this one
+        self.on_failed = None
+        # Optional callable (job, seconds queued) run under the lock each time a
+        # job is leased to a node, e.g. to record dispatch latency
+        self.on_dispatch = None
+        # Leases that ran out before the node reported, re-queued or dead-lettered
+        self.expired_leases = 0
+        # Optional callable (job_id) run under the lock whenever a job is added,
+        # changes status or is removed, e.g. to tell observers what changed
+        self.on_change = None
+        # Optional Journal that every job change is logged to
+        self.journal = None
+        self.lock = threading.RLock()
+        # node_id -> Condition its long-polls and streams wait on, signalled when
+        # a job is queued for the node or one it runs finishes
+        self.node_ready = {}
+        # node_id -> steal_min_depth of nodes waiting for shared work, longest
+        # waiting first. Shared, stolen and backup work wakes just one that can take it
+        self.idle = {}
+        # Thread of the one waiter that also wakes up for lease expiries and straggler checks
+        self.timekeeper = None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def __contains__(self, job_id):
+        return job_id in self.jobs
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def snapshot(self):
+        """Copy of every job record, safe to iterate or serialize"""
+        with self.lock:
+            self._evict_finished()
+            return {job_id: dict(job) for job_id, job in self.jobs.items()}
+
+    def add(self, job_id, job):
+        """
+        Store a job and queue it for its node, or the shared queue if unassigned.
+        Blocked jobs aren't queued until unblock is called
+
+        Args:
+            job_id (str): Unique job identifier
+            job (dict): Job record, must contain 'status' and 'assigned_to'
+        """
+        with self.lock:
+            self.jobs[job_id] = job
+            self.by_status.setdefault(job['status'], {})[job_id] = None
+            if self.journal:
+                self.journal.append('submit', job_id=job_id, job=job)
+            if self.on_change:
+                self.on_change(job_id)
+            if job['status'] == 'blocked':
+                return
+            job['queued_at'] = time.time()
+            node_id = job.get('assigned_to')
+            self._enqueue(job_id, node_id)
+
+    def _enqueue(self, job_id, node_id):
+        # Under the lock
+        if not node_id:
+            self.unassigned.append(job_id)
+            self._wake_shared(job_id)
+            return
+        queue = self.node_queues.setdefault(node_id, deque())
+        queue.append(job_id)
+        self._notify(node_id)
+        depth = len(queue)
+        if depth > 1:
+            # Deep enough that an idle node might steal from it
+            self._wake(lambda waiter, min_depth: (
+                min_depth and waiter != node_id and depth >= min_depth
+                and depth > len(self.node_executing.get(waiter, ())) + 1))
+
+    def _notify(self, node_id):
+        ready = self.node_ready.get(node_id)
+        if ready:
+            ready.notify_all()
+
+    def _wake(self, eligible):
+        """
+        Wake the longest waiting node that eligible(node_id, steal_min_depth)
+        accepts, it stops counting as idle until it waits again
+
+        Returns:
+            bool: Whether a node was woken
+        """
+        for node_id, steal_min_depth in self.idle.items():
+            if eligible(node_id, steal_min_depth):
+                del self.idle[node_id]
+                self._notify(node_id)
+                return True
+        return False
+
+    def _wake_any(self):
+        return self._wake(lambda node_id, steal_min_depth: True)
+
+    def _wake_shared(self, job_id):
+        # Prefer a node that can claim the job right away over one that would defer it
+        if self.claim_delay:
+            job = self.jobs[job_id]
+            if self._wake(lambda node_id, steal_min_depth: not self.claim_delay(job, node_id)):
+                return True
+        return self._wake_any()
+
+    def _wait(self, node_id, timeout, shared=False, steal_min_depth=0):
+        # Under the lock
+        ready = self.node_ready.get(node_id)
+        if ready is None:
+            ready = self.node_ready[node_id] = threading.Condition(self.lock)
+        if shared:
+            self.idle[node_id] = steal_min_depth
+        try:
+            ready.wait(timeout)
+        finally:
+            self.idle.pop(node_id, None)
+
+    def pop(self, node_id, timeout=0, shared=True, steal_min_depth=0):
+        """
+        Claim the next queued job for a node and mark it executing
+
+        Jobs queued for the node come first, then the shared unassigned queue,
+        then work stolen from the most backed-up node, then backup copies of
+        straggling jobs if the node is idle.
+
+        Args:
+            node_id (str): Node asking for work
+            timeout (float): Seconds to wait for a job to be queued (long-poll)
+            shared (bool): Whether the node may take shared or stolen work
+            steal_min_depth (int): Only steal from queues at least this deep, 0 disables stealing
+
+        Returns:
+            tuple: (job_id, job) or (None, None) if nothing was queued in time
+        """
+        with self.lock:
+            claimed = self._pop(node_id, timeout, shared, steal_min_depth)
+            self._pass_on()
+            return claimed
+
+    def _pop(self, node_id, timeout, shared, steal_min_depth):
+        deadline = time.monotonic() + timeout
+        thread = threading.get_ident()
+        while True:
+            self.expire_leases()
+            self.launch_backups()
+            self._release_deferred()
+            job_id, job = self._claim(node_id, shared, steal_min_depth)
+            remaining = deadline - time.monotonic()
+            if job_id or remaining <= 0:
+                return job_id, job
+            if self.timekeeper is None:
+                self.timekeeper = thread
+            if self.timekeeper == thread:
+                # Wake up for the next lease expiry, straggler check or deferred
+                # job too, any of them may make a job claimable
+                for heap in (self.leases, self.speculation, self.deferred):
+                    if heap:
+                        remaining = min(remaining, max(heap[0][0] - time.time(), 0.01))
+            try:
+                self._wait(node_id, remaining, shared, steal_min_depth)
+            finally:
+                if self.timekeeper == thread:
+                    self.timekeeper = None
+
+    def _pass_on(self):
+        # Under the lock. A woken node may have claimed other work than what it
+        # was woken for, or was the timekeeper, so another waiter takes over
+        if (self.unassigned or self.backups) and self._wake_any():
+            return
+        if self.timekeeper is None and (self.leases or self.speculation or self.deferred):
+            self._wake_any()
+
+    def pop_many(self, node_id, max_jobs, timeout=0, shared=True, steal_min_depth=0, budget=None, slots=1):
+        """
+        Claim up to max_jobs queued jobs for a node
+
+        Only the first claim waits, the rest are taken if already queued.
+
+        Args:
+            budget (float): Seconds of work to hand out per slot, once every
+                slot has a job no more are claimed past this. None claims up
+                to max_jobs regardless of how long they take
+            slots (int): Jobs the node runs at once
+
+        Returns:
+            list: (job_id, job) tuples, empty if nothing was queued in time
+        """
+        with self.lock:
+            job_id, job = self._pop(node_id, timeout, shared, steal_min_depth)
+            if not job_id:
+                self._pass_on()
+                return []
+            claimed = [(job_id, job)]
+            work = self._expected(job, node_id)
+            while len(claimed) < max_jobs:
+                # Long jobs aren't hoarded by one node while another could start them
+                if budget and len(claimed) >= slots and work >= budget * slots:
+                    break
+                job_id, job = self._claim(node_id, shared, steal_min_depth, position=len(claimed))
+                if not job_id:
+                    break
+                claimed.append((job_id, job))
+                work += self._expected(job, node_id)
+            self._pass_on()
+            return claimed
+
+    def _expected(self, job, node_id):
+        # Jobs without a prediction don't count against a batch budget
+        return (self.expected_runtime and self.expected_runtime(job, node_id)) or 0
+
+    def _claim(self, node_id, shared=True, steal_min_depth=0, position=0):
+        with self.lock:
+            queue = self.node_queues.get(node_id)
+            while queue:
+                job_id = queue.popleft()
+                if self._is_queued(job_id):
+                    return self._start(job_id, node_id, position)
+            if shared:
+                job_id, job = self._claim_shared(node_id, position)
+                if job_id:
+                    return job_id, job
+            if shared and steal_min_depth:
+                job_id, job = self._steal(node_id, steal_min_depth, position)
+                if job_id:
+                    return job_id, job
+            if shared and not self.node_executing.get(node_id):
+                return self._claim_backup(node_id)
+            return None, None
+
+    def _claim_shared(self, node_id, position=0):
+        """Take the oldest job in the shared queue the node may claim yet, see claim_delay"""
+        deferred = []
+        now = time.time()
+        try:
+            while self.unassigned and len(deferred) < MAX_DEFERRED_SCAN:
+                job_id = self.unassigned.popleft()
+                if not self._is_queued(job_id):
+                    continue
+                job = self.jobs[job_id]
+                delay = self.claim_delay and self.claim_delay(job, node_id)
+                claimable_at = job.get('queued_at', job['submitted_at']) + delay if delay else now
+                if claimable_at <= now:
+                    return self._start(job_id, node_id, position)
+                deferred.append(job_id)
+                if claimable_at < job.get('deferred_until', float('inf')):
+                    # Someone gets woken when it's this node's turn, should it be waiting then
+                    job['deferred_until'] = claimable_at
+                    heapq.heappush(self.deferred, (claimable_at, job_id))
+            return None, None
+        finally:
+            self.unassigned.extendleft(reversed(deferred))
+
+    def _release_deferred(self):
+        # Wake a waiter for each deferred job whose delay has run out for some node
+        now = time.time()
+        while self.deferred and self.deferred[0][0] <= now:
+            claimable_at, job_id = heapq.heappop(self.deferred)
+            job = self.jobs.get(job_id)
+            if job is None or job.get('deferred_until') != claimable_at:
+                continue
+            del job['deferred_until']
+            if self._is_queued(job_id) and not job.get('assigned_to'):
+                self._wake_any()
+
+    def _steal(self, node_id, min_depth, position=0):
+        """Take the newest unpinned job from the deepest other node queue"""
+        victims = [(len(queue), owner) for owner, queue in self.node_queues.items() if owner != node_id]
+        if not victims:
+            return None, None
+        depth, owner = max(victims)
+        # Stop once the thief holds about as much work as its victim has left
+        if depth < min_depth or depth <= len(self.node_executing.get(node_id, ())) + 1:
+            return None, None
+
+        # Work from the tail so the owner keeps the jobs it will reach next
+        queue = self.node_queues[owner]
+        pinned = []
+        try:
+            while queue:
+                job_id = queue.pop()
+                if not self._is_queued(job_id):
+                    continue
+                if self.jobs[job_id].get('pinned'):
+                    pinned.append(job_id)
+                    continue
+                return self._start(job_id, node_id, position)
+            return None, None
+        finally:
+            queue.extend(reversed(pinned))
+
+    def _is_queued(self, job_id):
+        # Entries can go stale if a job was removed while queued
+        job = self.jobs.get(job_id)
+        return job is not None and job['status'] in ('assigned', 'pending')
+
+    def _start(self, job_id, node_id, position=0):
+        job = self.jobs[job_id]
+        job.pop('deferred_until', None)
+        job['assigned_to'] = node_id
+        job['attempts'] = job.get('attempts', 0) + 1
+        self.set_status(job_id, 'executing')
+        self._lease(job_id, job)
+        if self.on_dispatch:
+            self.on_dispatch(job, time.time() - job.get('queued_at', job['submitted_at']))
+
+        threshold = self.straggler_threshold and self.straggler_threshold(job, node_id)
+        if threshold:
+            # Jobs leased in a batch run one after another, so allow for those ahead
+            job['speculate_at'] = time.time() + threshold * (position + 1)
+            heapq.heappush(self.speculation, (job['speculate_at'], job_id))
+        return job_id, job
+
+    def launch_backups(self):
+        """
+        Queue a backup copy of every executing job that has run past its
+        straggler threshold, for the next idle node to pick up
+
+        Returns:
+            list: IDs of the jobs that got a backup copy
+        """
+        launched = []
+        now = time.time()
+        with self.lock:
+            while self.speculation and self.speculation[0][0] <= now:
+                speculate_at, job_id = heapq.heappop(self.speculation)
+                job = self.jobs.get(job_id)
+                if (job is None or job['status'] != 'executing' or job.get('backups')
+                        or job.get('speculate_at') != speculate_at):
+                    continue
+                self.backups.append(job_id)
+                launched.append(job_id)
+                # Backups only go to a node with nothing running, never the original's
+                self._wake(lambda node_id, steal_min_depth: (
+                    node_id != job['assigned_to'] and not self.node_executing.get(node_id)))
+        return launched
+
+    def _claim_backup(self, node_id):
+        skipped = []
+        try:
+            while self.backups:
+                job_id = self.backups.popleft()
+                job = self.jobs.get(job_id)
+                if job is None or job['status'] != 'executing':
+                    continue
+                if job['assigned_to'] == node_id:
+                    skipped.append(job_id)
+                    continue
+                # The first copy to report wins, see set_status for the loser
+                job['backups'] = [node_id]
+                self.node_executing.setdefault(node_id, {})[job_id] = None
+                return job_id, job
+            return None, None
+        finally:
+            self.backups.extendleft(reversed(skipped))
+
+    def _lease(self, job_id, job):
+        job['lease_expires_at'] = time.time() + self.lease_timeout
+        heapq.heappush(self.leases, (job['lease_expires_at'], job_id))
+
+    def renew(self, node_id, job_ids):
+        """
+        Extend the leases a node holds on the jobs it is still running
+
+        Returns:
+            list: IDs the node no longer holds (completed, expired or re-dispatched),
+            the worker can abandon these
+        """
+        lost = []
+        with self.lock:
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job and job['status'] == 'executing' and job['assigned_to'] == node_id:
+                    self._lease(job_id, job)
+                elif job and job['status'] == 'executing' and node_id in job.get('backups', ()):
+                    # Backup copies ride on the original's lease
+                    continue
+                else:
+                    lost.append(job_id)
+        return lost
+
+    def expire_leases(self):
+        """
+        Re-queue executing jobs whose lease ran out, dead-lettering any that
+        have used up max_attempts
+
+        Returns:
+            tuple: (requeued job IDs, dead-lettered job IDs)
+        """
+        requeued, dead = [], []
+        now = time.time()
+        with self.lock:
+            while self.leases and self.leases[0][0] <= now:
+                expires_at, job_id = heapq.heappop(self.leases)
+                job = self.jobs.get(job_id)
+                if (job is None or job['status'] != 'executing'
+                        or job.get('lease_expires_at') != expires_at):
+                    continue
+                self.expired_leases += 1
+                if job['attempts'] >= self.max_attempts:
+                    self.set_status(job_id, 'failed')
+                    dead.append(job_id)
+                    if self.on_failed:
+                        self.on_failed(job_id)
+                else:
+                    self.requeue(job_id)
+                    requeued.append(job_id)
+        return requeued, dead
+
+    def unblock(self, job_id, node_id, args):
+        """
+        Queue a blocked job now that its dependencies have reported
+
+        Args:
+            job_id (str): The blocked job
+            node_id (str): Node to queue it for, None for the shared pool
+            args (dict): Its args with the upstream results filled in
+
+        Returns:
+            bool: False if the job is gone or no longer blocked
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] != 'blocked':
+                return False
+            job['args'] = args
+            job['assigned_to'] = node_id
+            status = 'assigned' if node_id else 'pending'
+            self.by_status['blocked'].pop(job_id, None)
+            self.by_status.setdefault(status, {})[job_id] = None
+            job['status'] = status
+            job['queued_at'] = time.time()
+            if self.on_change:
+                self.on_change(job_id)
+            if self.journal:
+                # Logged with the filled args, recovery can't rebuild them from the submit event
+                self.journal.append('unblock', job_id=job_id, args=args, status=status,
+                                    assigned_to=node_id, attempts=job.get('attempts', 0),
+                                    pinned=job.get('pinned', False))
+            self._enqueue(job_id, node_id)
+            return True
+
+    def wait(self, node_id, timeout):
+        """Block until a job is queued for a node or one it runs finishes, or timeout passes"""
+        with self.lock:
+            self._wait(node_id, timeout)
+
+    def requeue(self, job_id):
+        """Put a queued or executing job back in the shared pool for any node to claim"""
+        with self.lock:
+            job = self.jobs[job_id]
+            self.set_status(job_id, 'pending')
+            job['assigned_to'] = None
+            job['pinned'] = False
+            job['queued_at'] = time.time()
+            job.pop('lease_expires_at', None)
+            self._log_status(job_id, job)
+            self.unassigned.appendleft(job_id)
+            self._wake_shared(job_id)
+
+    def release_node(self, node_id):
+        """Re-queue everything queued for or running on a node that has gone away"""
+        with self.lock:
+            job_ids = list(self.node_executing.pop(node_id, {}))
+            job_ids.extend(self.node_queues.pop(node_id, ()))
+            released = []
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job is None or job['status'] not in ('assigned', 'executing'):
+                    continue
+                if node_id in job.get('backups', ()):
+                    # Only a backup copy was lost, the original keeps running
+                    job['backups'].remove(node_id)
+                    continue
+                released.append(job_id)
+            for job_id in released:
+                self.requeue(job_id)
+            return released
+
+    def hand_back(self, node_id, job_ids=(), queued=False):
+        """
+        Re-queue work a node won't run, e.g. because it paused to save its battery
+
+        Args:
+            node_id (str): The node giving work back
+            job_ids (list): Jobs it leased but hasn't started, these don't
+                count as a dispatch attempt
+            queued (bool): Also re-queue every unpinned job still queued for it
+
+        Returns:
+            list: IDs of the jobs re-queued
+        """
+        with self.lock:
+            released = []
+            for job_id in job_ids:
+                job = self.jobs.get(job_id)
+                if job is None or job['status'] != 'executing':
+                    continue
+                if node_id in job.get('backups', ()):
+                    # The original copy keeps running elsewhere
+                    job['backups'].remove(node_id)
+                    self.node_executing.get(node_id, {}).pop(job_id, None)
+                elif job['assigned_to'] == node_id:
+                    job['attempts'] -= 1
+                    released.append(job_id)
+
+            kept = deque()
+            for job_id in self.node_queues.get(node_id, ()) if queued else ():
+                if not self._is_queued(job_id):
+                    continue
+                if self.jobs[job_id].get('pinned'):
+                    kept.append(job_id)
+                else:
+                    released.append(job_id)
+            if queued and node_id in self.node_queues:
+                self.node_queues[node_id] = kept
+
+            # requeue puts each at the front of the shared pool, so go backwards to keep their order
+            for job_id in reversed(released):
+                self.requeue(job_id)
+            return released
+
+    def set_status(self, job_id, status):
+        with self.lock:
+            job = self.jobs[job_id]
+            self.by_status.get(job['status'], {}).pop(job_id, None)
+            self.by_status.setdefault(status, {})[job_id] = None
+            if job['status'] == 'executing':
+                for node_id in [job['assigned_to']] + job.pop('backups', []):
+                    self.node_executing.get(node_id, {}).pop(job_id, None)
+                    # A slot freed up, wakes streams waiting to push the node more work
+                    self._notify(node_id)
+            if status == 'executing':
+                self.node_executing.setdefault(job['assigned_to'], {})[job_id] = None
+            job['status'] = status
+            self._log_status(job_id, job)
+            if self.on_change:
+                self.on_change(job_id)
+            if status in ('completed', 'failed'):
+                job['finished_at'] = self.finished[job_id] = time.time()
+                self.finished.move_to_end(job_id)
+                self._evict_finished()
+            else:
+                self.finished.pop(job_id, None)
+
+    def _evict_finished(self):
+        # Under the lock. Finished records go oldest first, like their results
+        cutoff = time.time() - self.finished_ttl if self.finished_ttl else None
+        while self.finished:
+            job_id, finished_at = next(iter(self.finished.items()))
+            over = self.max_finished is not None and len(self.finished) > self.max_finished
+            if not over and not (cutoff and finished_at < cutoff):
+                return
+            self.remove(job_id)
+
+    def _log_status(self, job_id, job):
+        # Logged under the lock so the journal sees changes to a job in order
+        if self.journal:
+            self.journal.append(STATUS_EVENTS.get(job['status'], job['status']), job_id=job_id,
+                                status=job['status'], assigned_to=job['assigned_to'],
+                                attempts=job.get('attempts', 0), pinned=job.get('pinned', False))
+
+    def complete(self, job_id):
+        """
+        Atomically mark a job completed
+
+        Returns:
+            tuple: (job, True) for the first completion, (job, False) if it was
+            already completed, (None, False) if the job is unknown
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] == 'completed':
+                return job, False
+            self.set_status(job_id, 'completed')
+            return job, True
+
+    def with_status(self, *statuses):
+        """Return the IDs of all jobs in any of the given statuses"""
+        with self.lock:
+            return [job_id for status in statuses
+                    for job_id in self.by_status.get(status, ())]
+
+    def count(self, status):
+        return len(self.by_status.get(status, ()))
+
+    def counts(self):
+        """status -> number of jobs in it"""
+        with self.lock:
+            return {status: len(job_ids) for status, job_ids in self.by_status.items()}
+
+    def page(self, statuses, cursor=0, limit=50):
+        """
+        Jobs in any of the given statuses, grouped by status in the order given
+        and oldest first within each
+
+        Args:
+            statuses (list): Statuses to include
+            cursor (int): next_cursor from the previous page, 0 for the first
+            limit (int): Most jobs to return
+
+        Returns:
+            tuple: (dict job_id -> job, next_cursor or None at the end, total jobs in those statuses)
+        """
+        with self.lock:
+            total = sum(self.count(status) for status in statuses)
+            ordered = itertools.chain.from_iterable(self.by_status.get(status, ()) for status in statuses)
+            page = {job_id: dict(self.jobs[job_id]) for job_id in itertools.islice(ordered, cursor, cursor + limit)}
+            end = cursor + len(page)
+            return page, (end if end < total else None), total
+
+    def node_loads(self):
+        """node_id -> (jobs queued for it, jobs it is running)"""
+        with self.lock:
+            return {node_id: (self.queue_depth(node_id), len(self.node_executing.get(node_id, ())))
+                    for node_id in set(self.node_queues) | set(self.node_executing)}
+
+    def queue_depth(self, node_id):
+        queue = self.node_queues.get(node_id)
+        return len(queue) if queue else 0
+
+    def load(self, node_id):
+        """Jobs queued for or running on a node"""
+        return self.queue_depth(node_id) + len(self.node_executing.get(node_id, ()))
+
+    def restore(self, jobs):
+        """
+        Rebuild the queues and indexes from recovered job records
+
+        Jobs that were executing lost their worker with the restart, so they go
+        back to the shared pool with their attempt count kept.
+
+        Args:
+            jobs (dict): job_id -> job record, in submission order
+        """
+        with self.lock:
+            for job_id, job in jobs.items():
+                # The deferral heap isn't persisted, claims defer the job again if they should
+                job.pop('deferred_until', None)
+                if job['status'] == 'executing':
+                    job['status'] = 'pending'
+                    job['assigned_to'] = None
+                    for field in ('lease_expires_at', 'speculate_at', 'backups'):
+                        job.pop(field, None)
+                self.jobs[job_id] = job
+                self.by_status.setdefault(job['status'], {})[job_id] = None
+                if job['status'] == 'assigned':
+                    self.node_queues.setdefault(job['assigned_to'], deque()).append(job_id)
+                elif job['status'] == 'pending':
+                    self.unassigned.append(job_id)
+            # Jobs that finished after the last snapshot have no finished_at, their time starts now
+            now = time.time()
+            for finished_at, job_id in sorted((job.get('finished_at', now), job_id) for job_id, job in jobs.items()
+                                              if job['status'] in ('completed', 'failed')):
+                self.finished[job_id] = finished_at
+            self._evict_finished()
+            for ready in self.node_ready.values():
+                ready.notify_all()
+
+    def remove_with_status(self, status):
+        with self.lock:
+            job_ids = list(self.by_status.get(status, ()))
+            for job_id in job_ids:
+                self.remove(job_id)
+            return job_ids
+
+    def remove(self, job_id):
+        with self.lock:
+            job = self.jobs.pop(job_id, None)
+            self.finished.pop(job_id, None)
+            if job is not None:
+                if self.journal:
+                    self.journal.append('remove', job_id=job_id)
+                if self.on_change:
+                    self.on_change(job_id)
+                self.by_status.get(job['status'], {}).pop(job_id, None)
+                for node_id in [job['assigned_to']] + job.get('backups', []):
+                    self.node_executing.get(node_id, {}).pop(job_id, None)
+            return job
@@ -0,0 +1,230 @@
+"""
+Write-ahead journal for the AndroCompute coordinator
+Job lifecycle events are appended to a log that a background thread writes
+and fsyncs in groups, with periodic compacted snapshots so recovery only has
+to replay the log written since the last snapshot
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+
+SNAPSHOT_FILE = 'snapshot.json'
+SEGMENT_PATTERN = 'journal-{:08d}.log'
+# Seconds between attempts to write a batch after the disk failed, e.g. because it was full
+RETRY_INTERVAL = 1
+
+
+class JournalError(Exception):
+    """The journal couldn't make events durable, so the changes they record may be lost on a restart"""
+
+
+class Journal:
+    """
+    Append-only event log with group-committed fsync
+
+    Every event must carry absolute values (the job's new status, the full
+    result) rather than deltas, so replaying events on top of a snapshot that
+    already includes some of them gives the same state.
+    """
+
+    def __init__(self, directory, snapshot_every=10000):
+        self.directory = directory
+        self.snapshot_every = snapshot_every
+        os.makedirs(directory, exist_ok=True)
+
+        self._pending = []
+        self._appended = 0
+        self._durable = 0
+        self._since_snapshot = 0
+        self._rotate = False
+        self._rotated = threading.Event()
+        self.lock = threading.Lock()
+        self._wakeup = threading.Condition(self.lock)
+        self._flushed = threading.Condition(self.lock)
+
+        # Always start a fresh segment so a torn tail from a crash stays at the end of its own file
+        segments = self._segments()
+        self.segment = segments[-1] + 1 if segments else 0
+        self._file = open(self._segment_path(self.segment), 'ab')
+
+        # Last write, fsync or snapshot failure, None once writes succeed again
+        self.error = None
+        # Optional callable (OSError) run whenever writing the log or a snapshot fails, e.g. to log it
+        self.on_error = None
+
+        self.snapshot_source = None
+        self._snapshot_due = threading.Event()
+        threading.Thread(target=self._flush_loop, daemon=True).start()
+        threading.Thread(target=self._snapshot_loop, daemon=True).start()
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, SEGMENT_PATTERN.format(segment))
+
+    def _segments(self):
+        paths = glob.glob(os.path.join(self.directory, 'journal-*.log'))
+        return sorted(int(os.path.basename(path)[8:-4]) for path in paths)
+
+    def append(self, event, **fields):
+        """
+        Queue an event for the next group commit without waiting for it
+
+        Returns:
+            int: Sequence number to pass to wait_durable
+        """
+        fields['event'] = event
+        line = json.dumps(fields, separators=(',', ':'), default=str).encode() + b'\n'
+        with self.lock:
+            self._pending.append(line)
+            self._appended += 1
+            self._since_snapshot += 1
+            if self._since_snapshot >= self.snapshot_every:
+                self._since_snapshot = 0
+                self._snapshot_due.set()
+            self._wakeup.notify()
+            return self._appended
+
+    @property
+    def last_seq(self):
+        return self._appended
+
+    def wait_durable(self, seq):
+        """
+        Block until every event up to seq has been fsynced
+
+        Raises:
+            JournalError: If writing the journal is failing
+        """
+        with self.lock:
+            while self._durable < seq:
+                if self.error is not None:
+                    raise JournalError(f"Journal write failed: {self.error}")
+                self._flushed.wait()
+
+    def _failed(self, error):
+        with self.lock:
+            first = self.error is None
+            self.error = error
+            # Waiters raise instead of blocking until the disk recovers
+            self._flushed.notify_all()
+        # Once per outage rather than on every retry
+        if first and self.on_error:
+            self.on_error(error)
+
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                while not self._pending and not self._rotate:
+                    self._wakeup.wait()
+                batch, self._pending = self._pending, []
+                rotate, self._rotate = self._rotate, False
+                seq = self._appended
+
+            # Everything queued while this batch is written goes into the next one
+            try:
+                if self.error is not None:
+                    # The failed write may have left a torn line, which ends replay of
+                    # its segment, so the retry and everything after go in a new one
+                    self._next_segment()
+                if batch:
+                    self._file.write(b''.join(batch))
+                    self._file.flush()
+                    os.fsync(self._file.fileno())
+                    batch = []
+                if rotate:
+                    self._next_segment()
+                    self._rotated.set()
+            except OSError as e:
+                self._failed(e)
+                with self.lock:
+                    # Retried ahead of anything queued since, once the disk recovers
+                    self._pending = batch + self._pending
+                    self._rotate = self._rotate or rotate
+                time.sleep(RETRY_INTERVAL)
+                continue
+
+            with self.lock:
+                self._durable = seq
+                self.error = None
+                self._flushed.notify_all()
+
+    def _next_segment(self):
+        segment_file = open(self._segment_path(self.segment + 1), 'ab')
+        try:
+            self._file.close()
+        except OSError:
+            # Whatever it couldn't flush is rewritten to the new segment
+            pass
+        self._file = segment_file
+        self.segment += 1
+
+    def _snapshot_loop(self):
+        while True:
+            self._snapshot_due.wait()
+            self._snapshot_due.clear()
+            if self.snapshot_source:
+                try:
+                    self.snapshot(self.snapshot_source)
+                except OSError as e:
+                    # The log keeps growing and the next snapshot tries again, requests aren't affected
+                    if self.on_error:
+                        self.on_error(e)
+
+    def snapshot(self, source):
+        """
+        Write a compacted snapshot and drop the log segments it covers
+
+        Args:
+            source (callable): Returns the JSON-serializable state to save, called
+                only after the log has moved to a new segment so the state
+                includes every event in the old ones
+        """
+        with self.lock:
+            self._rotated.clear()
+            self._rotate = True
+            self._wakeup.notify()
+        self._rotated.wait()
+        segment = self.segment
+
+        state = {'segment': segment, 'state': source()}
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f, separators=(',', ':'), default=str)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+        for old in self._segments():
+            if old < segment:
+                os.remove(self._segment_path(old))
+
+    def recover(self):
+        """
+        Load the last snapshot and the events logged after it
+
+        Returns:
+            tuple: (snapshot state or None, list of event dicts in log order)
+        """
+        state = None
+        first_segment = 0
+        path = os.path.join(self.directory, SNAPSHOT_FILE)
+        if os.path.exists(path):
+            with open(path) as f:
+                snapshot = json.load(f)
+            state = snapshot['state']
+            first_segment = snapshot['segment']
+
+        events = []
+        for segment in self._segments():
+            if segment < first_segment:
+                continue
+            with open(self._segment_path(segment), 'rb') as f:
+                for line in f:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        # A torn write at the tail from a crash, nothing after it was acknowledged
+                        break
+        return state, events
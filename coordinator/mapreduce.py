@@ -0,0 +1,303 @@
+"""
+Map/reduce jobs for the AndroCompute coordinator
+A map/reduce job splits a template job's input range or list into shards that
+run in parallel across nodes, and merges each shard's result into a running
+total with a reducer as soon as it arrives
+"""
+
+import heapq
+import threading
+import time
+
+
+def _concat(total, partial):
+    total = total if total is not None else []
+    total.extend(partial)
+    return total
+
+
+def _add(total, partial):
+    return partial if total is None else total + partial
+
+
+def _merge_dicts(total, partial):
+    # Numbers are summed, anything else takes the newer shard's value
+    total = total if total is not None else {}
+    for key, value in partial.items():
+        current = total.get(key)
+        if isinstance(current, (int, float)) and isinstance(value, (int, float)):
+            total[key] = current + value
+        else:
+            total[key] = value
+    return total
+
+
+class Reducer:
+    """
+    Merges shard results into a running total
+
+    Args:
+        merge (callable): (total or None, shard result) -> new total
+        finish (callable): total -> final result, also used for partial results
+        ordered (bool): Shards must be merged in shard order, not arrival order
+    """
+
+    def __init__(self, merge, finish=None, ordered=False):
+        self.merge = merge
+        self.finish = finish or (lambda total, k: total)
+        self.ordered = ordered
+
+
+def _top_k_merge(total, partial):
+    # Count dicts (e.g. word_frequency) are summed, lists keep only what could make the top k
+    if isinstance(partial, dict):
+        return _merge_dicts(total, partial)
+    return _concat(total, partial)
+
+
+def _top_k_finish(total, k):
+    if isinstance(total, dict):
+        return [[key, count] for key, count in heapq.nlargest(k, total.items(), key=lambda item: item[1])]
+    return heapq.nlargest(k, total or [])
+
+
+REDUCERS = {
+    'sum': Reducer(_add),
+    'concat': Reducer(_concat, ordered=True),
+    'top_k': Reducer(_top_k_merge, _top_k_finish),
+    'dict_merge': Reducer(_merge_dicts),
+}
+
+# Largest k a top_k reducer keeps, bounds the running total for list shards
+MAX_TOP_K = 10000
+
+
+def split_range(start, stop, shards):
+    """Split [start, stop) into at most shards contiguous, near-equal (start, stop) pieces"""
+    shards = max(1, min(shards, stop - start))
+    size, extra = divmod(stop - start, shards)
+    pieces = []
+    for index in range(shards):
+        end = start + size + (1 if index < extra else 0)
+        pieces.append((start, end))
+        start = end
+    return pieces
+
+
+def split_sizes(start, sizes):
+    """Contiguous (start, stop) pieces of the given sizes, in order, starting at start"""
+    pieces = []
+    for size in sizes:
+        pieces.append((start, start + size))
+        start += size
+    return pieces
+
+
+def split_units(args, split):
+    """
+    How much work a map/reduce job's split covers: the range's length or the
+    number of items
+
+    Raises:
+        ValueError: If split doesn't name args of the right type
+    """
+    if 'range' in split:
+        start_arg, stop_arg = split['range']
+        start, stop = args.get(start_arg), args.get(stop_arg)
+        if not isinstance(start, int) or not isinstance(stop, int) or stop <= start:
+            raise ValueError(f"Range split needs integer args {start_arg} < {stop_arg}")
+        return stop - start
+
+    if 'items' in split:
+        items = args.get(split['items'])
+        if not isinstance(items, list) or not items:
+            raise ValueError(f"Items split needs a non-empty list arg {split['items']}")
+        return len(items)
+
+    raise ValueError('split must be {"range": [start_arg, stop_arg]} or {"items": list_arg}')
+
+
+def shard_args(args, split, shards):
+    """
+    The args for each shard of a map/reduce job
+
+    Args:
+        args (dict): The template args for the whole job
+        split (dict): {"range": ["start_arg", "stop_arg"]} to split an integer
+            range, or {"items": "list_arg"} to split a list
+        shards (int or list): Most shards to create, split near-equally, or
+            the units of work in each shard in order, summing to split_units
+
+    Returns:
+        list: One args dict per shard, in shard order
+
+    Raises:
+        ValueError: If split doesn't name args of the right type
+    """
+    units = split_units(args, split)
+    pieces = split_range(0, units, shards) if isinstance(shards, int) else split_sizes(0, shards)
+    if 'range' in split:
+        start_arg, stop_arg = split['range']
+        start = args[start_arg]
+        return [dict(args, **{start_arg: start + lo, stop_arg: start + hi}) for lo, hi in pieces]
+    items = args[split['items']]
+    return [dict(args, **{split['items']: items[lo:hi]}) for lo, hi in pieces]
+
+
+class MapReduceRegistry:
+    """Running map/reduce jobs and their partially merged results"""
+
+    def __init__(self):
+        self._jobs = {}
+        # shard job ID -> (map/reduce ID, shard index)
+        self._shards = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, mr_id):
+        return mr_id in self._jobs
+
+    def add(self, mr_id, definition):
+        """
+        Track a map/reduce job
+
+        Args:
+            mr_id (str): Map/reduce job ID
+            definition (dict): 'template', 'reducer', 'k', 'job_ids' in shard
+                order and 'submitted_at', everything needed to rebuild it
+        """
+        with self.lock:
+            self._jobs[mr_id] = dict(definition, **{
+                'total': None,
+                'received': 0,
+                'merged': 0,
+                # Shards that arrived ahead of next_shard, for reducers that merge in order
+                'next_shard': 0,
+                'waiting': {},
+                'errors': {},
+                'completed_at': None
+            })
+            for index, job_id in enumerate(definition['job_ids']):
+                self._shards[job_id] = (mr_id, index)
+
+    def merge(self, job_id, record):
+        """
+        Merge a shard's result into its map/reduce job's total
+
+        Args:
+            job_id (str): The shard job
+            record (dict): The stored result record, {'result', 'success', ...}
+
+        Returns:
+            str: The map/reduce ID if this was its last shard, else None
+        """
+        with self.lock:
+            mr_id, index = self._shards.pop(job_id, (None, None))
+            mr = self._jobs.get(mr_id)
+            if mr is None:
+                return None
+            mr['received'] += 1
+
+            reducer = REDUCERS[mr['reducer']]
+            if not reducer.ordered:
+                self._merge_one(mr, reducer, job_id, record)
+            else:
+                # Hold shards that arrive early until every shard before them is merged
+                mr['waiting'][index] = (job_id, record)
+                while mr['next_shard'] in mr['waiting']:
+                    self._merge_one(mr, reducer, *mr['waiting'].pop(mr['next_shard']))
+                    mr['next_shard'] += 1
+
+            if mr['received'] < len(mr['job_ids']):
+                return None
+            mr['completed_at'] = time.time()
+            return mr_id
+
+    def _merge_one(self, mr, reducer, job_id, record):
+        if not record.get('success', True):
+            mr['errors'][job_id] = record.get('result')
+            return
+        try:
+            mr['total'] = reducer.merge(mr['total'], record.get('result'))
+        except (TypeError, AttributeError, ValueError) as e:
+            mr['errors'][job_id] = f"Can't reduce {record.get('result')!r:.50}: {e}"
+            return
+        if mr['reducer'] == 'top_k' and isinstance(mr['total'], list) and len(mr['total']) > mr['k']:
+            mr['total'] = heapq.nlargest(mr['k'], mr['total'])
+        mr['merged'] += 1
+
+    def status(self, mr_id):
+        """Progress and the result merged so far, None if unknown"""
+        with self.lock:
+            mr = self._jobs.get(mr_id)
+            if mr is None:
+                return None
+            reducer = REDUCERS[mr['reducer']]
+            done = mr['completed_at'] is not None
+            # Copy the running total, later shards keep merging into it in place
+            total = mr['total']
+            if isinstance(total, (dict, list)):
+                total = type(total)(total)
+            return {
+                'mapreduce_id': mr_id,
+                'template': mr['template'],
+                'reducer': mr['reducer'],
+                'status': ('failed' if mr['errors'] else 'completed') if done else 'running',
+                'shards': len(mr['job_ids']),
+                'job_ids': list(mr['job_ids']),
+                'shards_merged': mr['merged'],
+                'errors': dict(mr['errors']),
+                'result': reducer.finish(total, mr['k']),
+                'submitted_at': mr['submitted_at'],
+                'completed_at': mr['completed_at'],
+                'elapsed': (mr['completed_at'] or time.time()) - mr['submitted_at']
+            }
+
+    def remove_completed(self):
+        """Forget finished map/reduce jobs and return their IDs"""
+        with self.lock:
+            done = [mr_id for mr_id, mr in self._jobs.items() if mr['completed_at'] is not None]
+            for mr_id in done:
+                for job_id in self._jobs.pop(mr_id)['job_ids']:
+                    self._shards.pop(job_id, None)
+            return done
+
+    def snapshot(self):
+        """
+        Every map/reduce job with its merged total and the shards still to
+        merge, so recovery doesn't depend on shard results that may have been
+        evicted since
+        """
+        with self.lock:
+            pending = {}
+            for job_id, (mr_id, _) in self._shards.items():
+                pending.setdefault(mr_id, []).append(job_id)
+            snapshot = {}
+            for mr_id, mr in self._jobs.items():
+                # Copied like in status(), shards keep merging into the total while it's written out
+                total = mr['total']
+                if isinstance(total, (dict, list)):
+                    total = type(total)(total)
+                snapshot[mr_id] = dict(mr, total=total, errors=dict(mr['errors']), pending=pending.get(mr_id, []),
+                                       waiting={str(index): shard for index, shard in mr['waiting'].items()})
+            return snapshot
+
+    def restore(self, mr_id, state):
+        """
+        Track a map/reduce job recovered from a snapshot, or from its definition
+        alone if it was logged after the snapshot. Merging a shard it already
+        merged does nothing, so results can be replayed over it
+
+        Args:
+            mr_id (str): Map/reduce job ID
+            state (dict): An entry of snapshot(), or a definition as for add()
+        """
+        if 'pending' not in state:
+            self.add(mr_id, state)
+            return
+        with self.lock:
+            mr = {field: value for field, value in state.items() if field != 'pending'}
+            mr['waiting'] = {int(index): tuple(shard) for index, shard in state['waiting'].items()}
+            self._jobs[mr_id] = mr
+            shard_index = {job_id: index for index, job_id in enumerate(state['job_ids'])}
+            for job_id in state['pending']:
+                self._shards[job_id] = (mr_id, shard_index[job_id])
@@ -0,0 +1,157 @@
+"""
+Metrics for the AndroCompute coordinator
+Counters and histograms are updated in place on the request path, each under
+its own lock, while gauges are read from the live state only when /metrics is
+scraped. Everything is rendered in the Prometheus text exposition format, so
+no client library is needed
+"""
+
+import bisect
+import math
+import threading
+
+# Request latencies, seconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Job queueing and execution times, seconds
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labels)
+        with self.lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+
+class Histogram:
+    """Bucketed observations per label set, with their sum and count"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        if not isinstance(value, (int, float)) or value < 0:
+            return
+        key = tuple(labels.get(name, '') for name in self.labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                yield self.name + '_bucket', key + (_format_value(bound),), cumulative
+            yield self.name + '_sum', key, counts[-1]
+            yield self.name + '_count', key, cumulative
+
+    def label_names(self, sample_name):
+        return self.labels + ('le',) if sample_name.endswith('_bucket') else self.labels
+
+
+class Collected:
+    """Gauge or counter read from live state at scrape time instead of updated in place"""
+
+    def __init__(self, name, help, collect, labels=(), kind='gauge'):
+        """
+        Args:
+            collect (callable): () -> a number for an unlabelled metric, or
+                {label values tuple: number}
+        """
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labels = tuple(labels)
+        self.kind = kind
+
+    def samples(self):
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            yield self.name, key, value
+
+
+class MetricsRegistry:
+    """The metrics /metrics exposes, in registration order"""
+
+    def __init__(self, prefix=''):
+        self.prefix = prefix
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self._add(Counter(self.prefix + name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self.prefix + name, help, labels, buckets))
+
+    def gauge(self, name, help, collect, labels=()):
+        return self._add(Collected(self.prefix + name, help, collect, labels))
+
+    def collected_counter(self, name, help, collect, labels=()):
+        return self._add(Collected(self.prefix + name, help, collect, labels, kind='counter'))
+
+    def render(self):
+        """Every metric in the Prometheus text format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, key, value in metric.samples():
+                names = metric.label_names(name) if hasattr(metric, 'label_names') else metric.labels
+                lines.append(f"{name}{_format_labels(names, key)} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,160 @@
+"""
+Result storage for the AndroCompute coordinator
+Keeps recently used results in a bounded in-memory LRU cache, spills the rest
+to disk and drops results past a TTL or total capacity, oldest first
+"""
+
+import os
+import shelve
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultStore:
+    """Bounded job result store with LRU caching, TTL expiry and disk spill"""
+
+    def __init__(self, memory_capacity=1000, max_results=100000, ttl=None, spill_path=None):
+        """
+        Args:
+            memory_capacity (int): Results kept in memory, least recently used spill first
+            max_results (int): Results kept in total, oldest are dropped past this
+            ttl (float): Seconds a result is kept after completion, None keeps them until evicted
+            spill_path (str): File to spill evicted results to, None drops them instead
+        """
+        self.memory_capacity = memory_capacity
+        self.max_results = max_results if spill_path else min(max_results, memory_capacity)
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        # seq -> (job_id, completed_at) in completion order. Results are dropped
+        # oldest first, so the retained seqs stay nearly dense between
+        # _first_seq and _next_seq and a cursor is just the next seq to read
+        self._order = {}
+        self._seqs = {}
+        self._first_seq = 0
+        self._next_seq = 0
+        self._spill = None
+        if spill_path:
+            os.makedirs(os.path.dirname(spill_path) or '.', exist_ok=True)
+            self._spill = shelve.open(spill_path, flag='n')
+        self.lock = threading.Lock()
+
+    def __contains__(self, job_id):
+        return job_id in self._seqs
+
+    def __len__(self):
+        return len(self._seqs)
+
+    def get(self, job_id):
+        with self.lock:
+            self._expire()
+            return self._load(job_id, promote=True)
+
+    def add(self, job_id, result):
+        with self.lock:
+            if job_id in self._seqs:
+                self._drop_one(job_id)
+            self._order[self._next_seq] = (job_id, result.get('completed_at', time.time()))
+            self._seqs[job_id] = self._next_seq
+            self._next_seq += 1
+            self._cache(job_id, result)
+            self._expire()
+
+    def restore(self, results):
+        for job_id, result in results.items():
+            self.add(job_id, result)
+
+    def page(self, cursor=None, limit=100):
+        """
+        Results completed after cursor, oldest first
+
+        Args:
+            cursor (int): next_cursor from the previous page, None to start from the oldest
+            limit (int): Most results to return
+
+        Returns:
+            tuple: (OrderedDict job_id -> result, next_cursor or None at the end)
+        """
+        with self.lock:
+            self._expire()
+            seq = self._first_seq if cursor is None else max(cursor, self._first_seq)
+            page = OrderedDict()
+            while seq < self._next_seq and len(page) < limit:
+                if seq in self._order:
+                    job_id = self._order[seq][0]
+                    page[job_id] = self._load(job_id, promote=False)
+                seq += 1
+            return page, (seq if seq < self._next_seq else None)
+
+    def recent(self, count):
+        """The newest count results, newest first"""
+        with self.lock:
+            self._expire()
+            newest = OrderedDict()
+            seq = self._next_seq - 1
+            while seq >= self._first_seq and len(newest) < count:
+                if seq in self._order:
+                    job_id = self._order[seq][0]
+                    newest[job_id] = self._load(job_id, promote=False)
+                seq -= 1
+            return newest
+
+    def snapshot(self):
+        """Every retained result, oldest first, without disturbing the LRU order"""
+        with self.lock:
+            self._expire()
+            return {self._order[seq][0]: self._load(self._order[seq][0], promote=False)
+                    for seq in range(self._first_seq, self._next_seq) if seq in self._order}
+
+    def trim(self, keep):
+        """Drop all but the newest keep results and return the dropped IDs"""
+        with self.lock:
+            dropped = []
+            while len(self._seqs) > keep:
+                dropped.append(self._drop_oldest())
+            return dropped
+
+    def _cache(self, job_id, result):
+        self._memory[job_id] = result
+        self._memory.move_to_end(job_id)
+        while len(self._memory) > self.memory_capacity:
+            evicted, evicted_result = self._memory.popitem(last=False)
+            if self._spill is not None:
+                self._spill[evicted] = evicted_result
+            else:
+                self._drop_one(evicted)
+
+    def _load(self, job_id, promote):
+        result = self._memory.get(job_id)
+        if result is not None:
+            if promote:
+                self._memory.move_to_end(job_id)
+            return result
+        if self._spill is None or job_id not in self._seqs:
+            return None
+        result = self._spill.get(job_id)
+        if result is not None and promote:
+            del self._spill[job_id]
+            self._cache(job_id, result)
+        return result
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl if self.ttl else None
+        while self._seqs and (len(self._seqs) > self.max_results
+                              or (cutoff and self._order[self._first_seq][1] < cutoff)):
+            self._drop_oldest()
+
+    def _drop_oldest(self):
+        job_id = self._order[self._first_seq][0]
+        self._drop_one(job_id)
+        return job_id
+
+    def _drop_one(self, job_id):
+        seq = self._seqs.pop(job_id)
+        self._order.pop(seq)
+        self._memory.pop(job_id, None)
+        if self._spill is not None and job_id in self._spill:
+            del self._spill[job_id]
+        # Keep the retained range dense by skipping anything dropped from the front
+        while self._first_seq < self._next_seq and self._first_seq not in self._order:
+            self._first_seq += 1
@@ -0,0 +1,151 @@
+"""
+Execution time history for the AndroCompute coordinator
+Keeps a performance profile per job type and per job type on each device: a
+sliding window of reported runtimes for quantiles, plus moving averages of the
+runtime and, for jobs that say how much work they covered, of the seconds per
+unit of work. Profiles are keyed by device rather than node registration, so a
+phone that restarts its worker keeps its history, and are carried in journal
+snapshots across coordinator restarts
+"""
+
+import threading
+from collections import deque
+
+# Samples kept per job type and per (job type, device)
+WINDOW_SIZE = 200
+# Samples needed before a device's own history is trusted over the job type's
+MIN_SAMPLES = 5
+# Weight of the newest sample in the moving averages
+EWMA_ALPHA = 0.2
+
+
+class RuntimeStats:
+    """Sliding-window runtime history and moving averages with percentile and throughput predictions"""
+
+    def __init__(self, window_size=WINDOW_SIZE):
+        self.window_size = window_size
+        self.by_type = {}
+        self.by_node = {}
+        # job_type or (job_type, device) -> {'count', 'seconds', 'seconds_per_unit'}
+        self.averages = {}
+        self.lock = threading.Lock()
+
+    def record(self, job_type, node_id, execution_time, units=None):
+        """
+        Fold in a finished job's runtime
+
+        Args:
+            job_type (str): Job type or template ID
+            node_id (str): Device that ran it
+            execution_time (float): Seconds the worker reported
+            units (int): How much work the job covered, e.g. a map/reduce
+                shard's range length or item count, None if unknown
+        """
+        if not isinstance(execution_time, (int, float)) or execution_time < 0:
+            return
+        execution_time = float(execution_time)
+        per_unit = execution_time / units if isinstance(units, int) and units > 0 else None
+        with self.lock:
+            for key, history in ((job_type, self.by_type), ((job_type, node_id), self.by_node)):
+                if key not in history:
+                    history[key] = deque(maxlen=self.window_size)
+                history[key].append(execution_time)
+
+                average = self.averages.setdefault(key, {'count': 0, 'seconds': None, 'seconds_per_unit': None})
+                average['count'] += 1
+                average['seconds'] = _ewma(average['seconds'], execution_time)
+                if per_unit is not None:
+                    average['seconds_per_unit'] = _ewma(average['seconds_per_unit'], per_unit)
+
+    def _samples(self, job_type, node_id):
+        samples = self.by_node.get((job_type, node_id))
+        if not samples or len(samples) < MIN_SAMPLES:
+            samples = self.by_type.get(job_type)
+        if not samples or len(samples) < MIN_SAMPLES:
+            return None
+        return samples
+
+    def _average(self, job_type, node_id, field):
+        # The device's own average once it has enough history, else the job type's
+        for key in ((job_type, node_id), job_type):
+            average = self.averages.get(key)
+            if average and average['count'] >= MIN_SAMPLES and average[field] is not None:
+                return average[field]
+        return None
+
+    def predict(self, job_type, node_id, percentile):
+        """
+        Runtime a job of this type should finish within on this device
+
+        Args:
+            job_type (str): Job type to predict for
+            node_id (str): Device running the job
+            percentile (float): 0-100, e.g. 90 for the p90 runtime
+
+        Returns:
+            float: Predicted seconds, or None without enough history
+        """
+        with self.lock:
+            samples = self._samples(job_type, node_id)
+            if samples is None:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+        return ordered[index]
+
+    def expected(self, job_type, node_id):
+        """Moving average runtime of this job type on this device, None without enough history"""
+        with self.lock:
+            return self._average(job_type, node_id, 'seconds')
+
+    def seconds_per_unit(self, job_type, node_id):
+        """Moving average seconds per unit of work on this device, None without enough history"""
+        with self.lock:
+            return self._average(job_type, node_id, 'seconds_per_unit')
+
+    def profile(self, node_id):
+        """
+        A device's profile for every job type it has run
+
+        Returns:
+            dict: job_type -> {'samples', 'ewma_seconds', 'p50', 'p90', 'units_per_second'}
+        """
+        with self.lock:
+            keys = [key for key in self.by_node if key[1] == node_id]
+            profiles = {}
+            for key in keys:
+                ordered = sorted(self.by_node[key])
+                average = self.averages.get(key, {})
+                per_unit = average.get('seconds_per_unit')
+                profiles[key[0]] = {
+                    'samples': average.get('count', len(ordered)),
+                    'ewma_seconds': average.get('seconds'),
+                    'p50': ordered[int(len(ordered) * 0.5)],
+                    'p90': ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))],
+                    'units_per_second': 1 / per_unit if per_unit else None
+                }
+            return profiles
+
+    def snapshot(self):
+        """Every profile as JSON-safe records, for journal snapshots"""
+        with self.lock:
+            records = []
+            for key, history in list(self.by_type.items()) + list(self.by_node.items()):
+                job_type, node_id = key if isinstance(key, tuple) else (key, None)
+                records.append(dict(self.averages.get(key, {}), job_type=job_type, node_id=node_id,
+                                    history=list(history)))
+            return records
+
+    def restore(self, records):
+        with self.lock:
+            for record in records or ():
+                key = record['job_type'] if record['node_id'] is None else (record['job_type'], record['node_id'])
+                target = self.by_type if record['node_id'] is None else self.by_node
+                target[key] = deque(record['history'], maxlen=self.window_size)
+                self.averages[key] = {'count': record.get('count', len(record['history'])),
+                                      'seconds': record.get('seconds'),
+                                      'seconds_per_unit': record.get('seconds_per_unit')}
+
+
+def _ewma(previous, value):
+    return value if previous is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * previous
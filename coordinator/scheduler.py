@@ -0,0 +1,192 @@
+"""
+Scheduling policies for the AndroCompute coordinator
+Each policy picks the node a job should be queued for from the active nodes,
+using the resources they reported, their live load, observed job runtimes and
+how much of the job's input data each node would still have to download.
+Nodes whose power governor has paused them (low battery or overheating) get
+no new work under any policy
+"""
+
+import threading
+
+# Assumed runtime for a node that hasn't returned any results yet
+DEFAULT_EXECUTION_TIME = 1.0
+# Weight of the newest sample in the execution time moving average
+EXECUTION_TIME_ALPHA = 0.3
+# Nodes below this battery level that aren't charging only get work as a last resort
+MIN_BATTERY_LEVEL = 20
+
+
+class Scheduler:
+    """Base policy, tracks per-node runtimes and estimates load"""
+
+    name = None
+
+    def __init__(self, locality_weight, transfer_rate):
+        """
+        Args:
+            locality_weight (float): How heavily to weigh downloading input data
+                a node hasn't cached against its load, 0 ignores where data is cached
+            transfer_rate (float): Assumed download speed to a node in bytes per second
+        """
+        self.execution_times = {}
+        self.locality_weight = locality_weight
+        self.transfer_rate = transfer_rate
+        self.lock = threading.RLock()
+
+    def record_result(self, node_id, execution_time):
+        """Fold a finished job's runtime into the node's moving average"""
+        if not isinstance(execution_time, (int, float)) or execution_time < 0:
+            return
+        with self.lock:
+            previous = self.execution_times.get(node_id)
+            if previous is None:
+                self.execution_times[node_id] = float(execution_time)
+            else:
+                self.execution_times[node_id] = (EXECUTION_TIME_ALPHA * execution_time
+                                                 + (1 - EXECUTION_TIME_ALPHA) * previous)
+
+    def forget(self, node_id):
+        with self.lock:
+            self.execution_times.pop(node_id, None)
+
+    def expected_time(self, node_id):
+        return self.execution_times.get(node_id, DEFAULT_EXECUTION_TIME)
+
+    def cores(self, node_data):
+        # Jobs the node runs at once, which it lowers below its core count when hot or on low battery
+        resources = node_data.get('resources', {})
+        return max(1, resources.get('concurrency') or resources.get('cpu_cores') or 1)
+
+    def is_paused(self, node_data):
+        """Whether the node has stopped taking work to save its battery or cool down"""
+        return node_data.get('resources', {}).get('power_state') == 'paused'
+
+    def load(self, node_id, node_data, depth):
+        """Estimated seconds for the node to drain its queue plus one more job"""
+        return (depth + 1) * self.expected_time(node_id) / self.cores(node_data)
+
+    def transfer_time(self, node_data, blobs):
+        """Weighted seconds to download the input blobs the node hasn't cached"""
+        if not blobs or not self.locality_weight:
+            return 0.0
+        held = node_data.get('blobs', ())
+        missing = sum(size for digest, size in blobs.items() if digest not in held)
+        return self.locality_weight * missing / self.transfer_rate
+
+    def is_eligible(self, node_id, node_data):
+        """Whether a node may claim shared or stolen work under late binding"""
+        return not self.is_paused(node_data)
+
+    def select(self, candidates, depth, blobs=None):
+        """
+        Choose a node for the next job
+
+        Args:
+            candidates (dict): node_id -> node data for the active nodes
+            depth (callable): node_id -> jobs queued or running on that node
+            blobs (dict): digest -> size of the input blobs the job reads
+
+        Returns:
+            str: The chosen node_id, None if every candidate is paused
+        """
+        candidates = {node_id: node_data for node_id, node_data in candidates.items()
+                      if not self.is_paused(node_data)}
+        if not candidates:
+            return None
+
+        def transfer(node_id):
+            return self.transfer_time(candidates[node_id], blobs)
+
+        with self.lock:
+            return self.pick(candidates, depth, transfer)
+
+    def pick(self, candidates, depth, transfer):
+        """
+        Policy-specific choice, called by select with the lock held. transfer
+        is node_id -> seconds to fetch the job's input data there
+        """
+        raise NotImplementedError
+
+
+class LeastLoadedScheduler(Scheduler):
+    """Queue on the node expected to finish its current backlog first"""
+
+    name = 'least_loaded'
+
+    def pick(self, candidates, depth, transfer):
+        return min(candidates, key=lambda node_id: (self.load(node_id, candidates[node_id], depth(node_id))
+                                                    + transfer(node_id)))
+
+
+class WeightedRoundRobinScheduler(Scheduler):
+    """Smooth weighted round robin, weighted by cores and observed speed"""
+
+    name = 'weighted_round_robin'
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.current_weights = {}
+
+    def forget(self, node_id):
+        with self.lock:
+            super().forget(node_id)
+            self.current_weights.pop(node_id, None)
+
+    def weight(self, node_id, node_data, transfer_time=0.0):
+        # Jobs per second, slowed by any input data the node would have to download first
+        return self.cores(node_data) / (self.expected_time(node_id) + transfer_time)
+
+    def pick(self, candidates, depth, transfer):
+        weights = {node_id: self.weight(node_id, node_data, transfer(node_id))
+                   for node_id, node_data in candidates.items()}
+        for node_id, weight in weights.items():
+            self.current_weights[node_id] = self.current_weights.get(node_id, 0) + weight
+        chosen = max(weights, key=lambda node_id: self.current_weights[node_id])
+        self.current_weights[chosen] -= sum(weights.values())
+        return chosen
+
+
+class BatteryAwareScheduler(LeastLoadedScheduler):
+    """Least loaded, but steer work away from draining batteries"""
+
+    name = 'battery_aware'
+
+    def battery_factor(self, node_data):
+        resources = node_data.get('resources', {})
+        if resources.get('is_charging', True):
+            return 1.0
+        return max(resources.get('battery_level', 100), 1) / 100
+
+    def load(self, node_id, node_data, depth):
+        return super().load(node_id, node_data, depth) / self.battery_factor(node_data)
+
+    def is_eligible(self, node_id, node_data):
+        return super().is_eligible(node_id, node_data) and self.battery_factor(node_data) * 100 >= MIN_BATTERY_LEVEL
+
+    def pick(self, candidates, depth, transfer):
+        healthy = {node_id: node_data for node_id, node_data in candidates.items()
+                   if self.is_eligible(node_id, node_data)}
+        return super().pick(healthy or candidates, depth, transfer)
+
+
+SCHEDULERS = {
+    policy.name: policy
+    for policy in (LeastLoadedScheduler, WeightedRoundRobinScheduler, BatteryAwareScheduler)
+}
+
+
+def create_scheduler(name, **options):
+    """
+    Build the scheduling policy registered under name
+
+    Args:
+        name (str): Policy name, see SCHEDULERS
+        **options: locality_weight and transfer_rate, see Scheduler
+
+    Raises:
+        ValueError: If no policy has that name
+    """
+    if name not in SCHEDULERS:
+        raise ValueError(f"Unknown scheduler '{name}', choose from {', '.join(SCHEDULERS)}")
+    return SCHEDULERS[name](**options)
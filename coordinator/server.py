@@ -1,14 +1,309 @@
-from flask import Flask, jsonify, request, render_template_string
+from flask import Flask, Request, Response, g, has_request_context, jsonify, request, render_template_string, send_file
+from flask.json.provider import DefaultJSONProvider
+from collections import Counter
+from werkzeug.exceptions import BadRequest, RequestEntityTooLarge
+from werkzeug.http import parse_content_range_header
+from werkzeug.serving import WSGIRequestHandler
+import functools
+import json
 import time
 import os
 
+from blob_store import BlobStore, blob_refs
+from event_log import EventLog
+from job_queue import JobQueue
+from journal import Journal, JournalError
+from mapreduce import MAX_TOP_K, REDUCERS, MapReduceRegistry, shard_args, split_units
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, JOB_BUCKETS, MetricsRegistry
+from result_store import ResultStore
+from runtime_stats import RuntimeStats
+from scheduler import create_scheduler
+from state import ChangeFeed, CodeCatalog, IdAllocator, NodeRegistry
+from templates import BUILTIN_TEMPLATES, TemplateRegistry
+from workflows import DependencyTracker, workflow_order
+import wire
+
+
+class WireRequest(Request):
+    """Request whose body may be msgpack and/or compressed, see wire"""
+
+    _wire_body = None
+
+    def get_json(self, force=False, silent=False, cache=True):
+        if self.mimetype != wire.MSGPACK and not self.content_encoding:
+            return super().get_json(force=force, silent=silent, cache=cache)
+        if self._wire_body is None:
+            try:
+                body = wire.decompress(self.get_data(cache=cache), self.content_encoding)
+                self._wire_body = wire.unpack(body, self.mimetype)
+            except wire.BodyTooLarge as e:
+                if silent:
+                    return None
+                raise RequestEntityTooLarge(str(e))
+            except ValueError as e:
+                if silent:
+                    return None
+                raise BadRequest(f"Can't decode request body: {e}")
+        return self._wire_body
+
+
+class WireJSONProvider(DefaultJSONProvider):
+    """jsonify() answers in msgpack when the client accepts it and it's installed"""
+
+    def response(self, *args, **kwargs):
+        if not has_request_context() or wire.negotiate(wire.formats(), request.accept_mimetypes.values()) != wire.MSGPACK:
+            return super().response(*args, **kwargs)
+        body = wire.pack(self._prepare_response_obj(args, kwargs), wire.MSGPACK)
+        return self._app.response_class(body, mimetype=wire.MSGPACK)
+
+
 app = Flask(__name__)
+app.request_class = WireRequest
+app.json = WireJSONProvider(app)
+
+# Seconds a worker holds a job before it is re-dispatched, unless renewed by /heartbeat
+LEASE_TIMEOUT = float(os.environ.get('ANDROCOMPUTE_LEASE_TIMEOUT', 60))
+# Dispatch attempts before a job is moved to the dead-letter list
+MAX_ATTEMPTS = int(os.environ.get('ANDROCOMPUTE_MAX_ATTEMPTS', 3))
+# What dependents and map/reduce totals see as a dead-lettered job's result
+DEAD_LETTER_ERROR = 'ERROR: dead-lettered'
+# Scheduling policy: least_loaded, weighted_round_robin or battery_aware
+SCHEDULER_POLICY = os.environ.get('ANDROCOMPUTE_SCHEDULER', 'least_loaded')
+# 'early' picks a node at submit time, 'late' pools jobs until a worker claims them
+DISPATCH_MODE = os.environ.get('ANDROCOMPUTE_DISPATCH', 'early')
+# Assumed download speed to a node in bytes per second, and how much the time
+# to download input blobs a node hasn't cached counts against picking it
+# (0 ignores data locality, higher keeps jobs with their data at the cost of balance)
+TRANSFER_RATE = float(os.environ.get('ANDROCOMPUTE_TRANSFER_RATE', 1024 * 1024))
+LOCALITY_WEIGHT = float(os.environ.get('ANDROCOMPUTE_LOCALITY_WEIGHT', 1))
+# Idle nodes steal from queues at least this deep (0 disables work stealing)
+STEAL_MIN_DEPTH = int(os.environ.get('ANDROCOMPUTE_STEAL_MIN_DEPTH', 2))
+# Launch a backup copy of a job once it runs past this percentile of its
+# type's runtime history on that node (0 disables speculative execution)
+SPECULATION_PERCENTILE = float(os.environ.get('ANDROCOMPUTE_SPECULATION_PERCENTILE', 95))
+# Never speculate before a job has run this long, backups of short jobs cost more than they save
+SPECULATION_MIN_SECONDS = float(os.environ.get('ANDROCOMPUTE_SPECULATION_MIN_SECONDS', 2))
+# Seconds of work each dispatch should carry. Map/reduce shards are sized from each
+# device's measured throughput to take about this long on the node they're queued for,
+# and a leased batch stops growing once every slot has this much (0 disables both)
+TARGET_JOB_SECONDS = float(os.environ.get('ANDROCOMPUTE_TARGET_JOB_SECONDS', 2))
+
+# Directory for the job journal and snapshots, empty to keep state in memory only
+JOURNAL_DIR = os.environ.get('ANDROCOMPUTE_JOURNAL_DIR',
+                             os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data'))
+# Events between compacted snapshots, bounds how much log a restart replays
+SNAPSHOT_EVERY = int(os.environ.get('ANDROCOMPUTE_SNAPSHOT_EVERY', 10000))
+
+# Results kept in memory, the least recently used beyond this spill to the journal directory
+RESULTS_IN_MEMORY = int(os.environ.get('ANDROCOMPUTE_RESULTS_IN_MEMORY', 1000))
+# Results kept in total, the oldest are dropped beyond this
+RESULTS_MAX = int(os.environ.get('ANDROCOMPUTE_RESULTS_MAX', 100000))
+# Seconds a result is kept after completion (0 keeps it until evicted)
+RESULTS_TTL = float(os.environ.get('ANDROCOMPUTE_RESULTS_TTL', 24 * 3600))
+
+# Directory for input blobs, kept on disk even when the journal is off
+BLOB_DIR = os.environ.get('ANDROCOMPUTE_BLOB_DIR',
+                          os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'blobs'))
+
+# 'text' logs readable messages, 'json' one object per line for log pipelines
+LOG_FORMAT = os.environ.get('ANDROCOMPUTE_LOG_FORMAT', 'text')
+# Fraction of per-job events (queued, sent, result) logged, lower it under heavy load
+LOG_SAMPLE_RATE = float(os.environ.get('ANDROCOMPUTE_LOG_SAMPLE_RATE', 1))
+
+# Longest time /get_job will hold a request open waiting for work
+MAX_LONG_POLL = 20
+# Most jobs accepted by /submit_jobs or leased by /get_jobs in one request
+MAX_BATCH_SIZE = 500
+# Most jobs one template fan-out in /submit_jobs can create
+MAX_FANOUT = 10000
+# Shards one map/reduce job is split into per active CPU core
+SHARDS_PER_CORE = int(os.environ.get('ANDROCOMPUTE_SHARDS_PER_CORE', 1))
+# Most results returned by one page of /results
+MAX_RESULTS_PAGE = 1000
+# Results shown on the dashboard
+DASHBOARD_RESULTS = 20
+# Jobs per dashboard page, and the most /api/jobs returns at once
+DASHBOARD_PAGE_SIZE = 50
+MAX_JOBS_PAGE = 500
+# Most changed jobs an /api/state delta lists, beyond that the dashboard reloads its page
+MAX_DELTA_JOBS = 500
+# Statuses a job can be in, in the order the dashboard lists them
+JOB_STATUSES = ('executing', 'assigned', 'pending', 'blocked', 'failed', 'completed')
+# Seconds between keep-alive comments on an idle event stream. A worker's stream
+# also renews the leases on the jobs it pushed this often
+STREAM_KEEPALIVE = 10
+# Most dashboard updates pushed per second, bursts of changes are coalesced
+DASHBOARD_PUSH_RATE = 2
+
+# Storage, every structure locks itself so request threads can share it
+nodes = NodeRegistry()
+job_id_allocator = IdAllocator('job_')
+code_catalog = CodeCatalog()
+templates = TemplateRegistry()
+mapreduce_id_allocator = IdAllocator('mr_')
+mapreduces = MapReduceRegistry()
+dependencies = DependencyTracker()
+job_results = ResultStore(memory_capacity=RESULTS_IN_MEMORY, max_results=RESULTS_MAX,
+                          ttl=RESULTS_TTL or None,
+                          spill_path=os.path.join(JOURNAL_DIR, 'results') if JOURNAL_DIR else None)
+# Finished job records, code and args included, are kept as long as their results
+job_queue = JobQueue(lease_timeout=LEASE_TIMEOUT, max_attempts=MAX_ATTEMPTS,
+                     max_finished=job_results.max_results, finished_ttl=job_results.ttl)
+scheduler = create_scheduler(SCHEDULER_POLICY, locality_weight=LOCALITY_WEIGHT, transfer_rate=TRANSFER_RATE)
+runtime_stats = RuntimeStats()
+blobs = BlobStore(BLOB_DIR)
+# Bumped on every change the dashboard shows, its event stream waits on it
+changes = ChangeFeed()
+journal = Journal(JOURNAL_DIR, snapshot_every=SNAPSHOT_EVERY) if JOURNAL_DIR else None
+# Written by a background thread, the request log included
+log = EventLog(format=LOG_FORMAT, sample_rate=LOG_SAMPLE_RATE)
+log.capture('werkzeug')
+
+metrics = MetricsRegistry('androcompute_')
+request_latency = metrics.histogram('request_duration_seconds', 'Time to handle a request, by route',
+                                    ('route', 'method', 'status'))
+jobs_submitted = metrics.counter('jobs_submitted_total', 'Jobs submitted, by job type', ('type',))
+dispatch_wait = metrics.histogram('job_dispatch_wait_seconds', 'Time jobs spent queued before a node leased them',
+                                  ('type',), JOB_BUCKETS)
+execution_time_seconds = metrics.histogram('job_execution_seconds', 'Execution time reported by workers',
+                                           ('type',), JOB_BUCKETS)
+jobs_finished = metrics.counter('jobs_finished_total', 'First results received, by job type and outcome',
+                                ('type', 'success'))
+node_events = metrics.counter('node_events_total', 'Node registrations, re-registrations and removals', ('event',))
+jobs_handed_back = metrics.counter('jobs_handed_back_total', 'Jobs nodes gave back unstarted to save power')
+metrics.gauge('jobs', 'Jobs by status', lambda: {(status,): count for status, count in job_queue.counts().items()},
+              ('status',))
+metrics.gauge('node_jobs', 'Jobs queued for and running on each node',
+              lambda: {key: value for node_id, (queued, running) in job_queue.node_loads().items()
+                       for key, value in (((node_id, 'queued'), queued), ((node_id, 'executing'), running))},
+              ('node', 'state'))
+metrics.gauge('nodes', 'Registered nodes and those heard from in the last 30 seconds',
+              lambda: {('registered',): len(nodes), ('active',): len(nodes.active(30))}, ('state',))
+metrics.gauge('node_power_states', 'Active nodes by the power state their governor reported',
+              lambda: dict(Counter((node_data.get('resources', {}).get('power_state', 'normal'),)
+                                   for node_data in nodes.active(30).values())), ('state',))
+metrics.gauge('results_stored', 'Results held by the result store', lambda: len(job_results))
+metrics.collected_counter('lease_expiries_total', 'Leases that ran out before the node reported',
+                          lambda: job_queue.expired_leases)
+metrics.collected_counter('log_events_dropped_total', 'Log events dropped because the writer fell behind',
+                          lambda: log.dropped)
+metrics.collected_counter('log_events_sampled_out_total', 'Per-job log events skipped by sampling',
+                          lambda: log.sampled_out)
+
+def register_template(name, version, source, description=''):
+    template = templates.register(name, version, source, description)
+    code_catalog.add(source)
+    return template
+
+for builtin in BUILTIN_TEMPLATES:
+    register_template(builtin['name'], builtin['version'], builtin['source'], builtin['description'])
+
+def journal_state():
+    return {'jobs': job_queue.snapshot(), 'results': job_results.snapshot(),
+            'templates': templates.snapshot(), 'mapreduces': mapreduces.snapshot(),
+            'profiles': runtime_stats.snapshot()}
+
+def recover_state():
+    """Rebuild jobs and results from the last snapshot plus the journal written after it"""
+    state, events = journal.recover()
+    jobs = state['jobs'] if state else {}
+    results = state['results'] if state else {}
+    mr_definitions = state.get('mapreduces', {}) if state else {}
+    # Results and failures logged since the snapshot, kept for map/reduce shards even if dropped or removed later
+    logged_results, logged_failures = {}, set()
+    # Performance profiles are only snapshotted, anything newer is relearned
+    runtime_stats.restore(state.get('profiles') if state else None)
+    for template in (state.get('templates', {}) if state else {}).values():
+        register_template(template['name'], template['version'], template['source'], template['description'])
+    
+    for event in events:
+        kind = event['event']
+        if kind == 'template':
+            template = event['template']
+            register_template(template['name'], template['version'], template['source'], template['description'])
+        elif kind == 'submit':
+            jobs[event['job_id']] = event['job']
+        elif kind == 'remove':
+            jobs.pop(event['job_id'], None)
+        elif kind == 'result':
+            results[event['job_id']] = logged_results[event['job_id']] = event['result']
+        elif kind == 'drop_results':
+            for job_id in event['job_ids']:
+                results.pop(job_id, None)
+        elif kind == 'unblock':
+            if event['job_id'] not in jobs:
+                # Dropped by a snapshot or removal after it was released
+                continue
+            jobs[event['job_id']].update({field: event[field] for field in
+                                          ('args', 'status', 'assigned_to', 'attempts', 'pinned')})
+        elif kind == 'mapreduce':
+            # The snapshot may already hold it, merged state and all
+            mr_definitions.setdefault(event['mapreduce_id'], event['mapreduce'])
+        elif kind == 'drop_mapreduces':
+            for mr_id in event['mapreduce_ids']:
+                mr_definitions.pop(mr_id, None)
+        elif event['job_id'] in jobs:
+            if kind == 'fail':
+                logged_failures.add(event['job_id'])
+            # assign/execute/complete/fail/requeue all carry the job's new status fields
+            jobs[event['job_id']].update({field: event[field] for field in
+                                          ('status', 'assigned_to', 'attempts', 'pinned')})
+    
+    for job in jobs.values():
+        if 'code' in job:
+            job['code_hash'] = code_catalog.add(job['code'])
+    job_queue.restore(jobs)
+    job_results.restore(results)
+    job_id_allocator.advance_past(jobs)
+    
+    # Map/reduce totals come from the snapshot, shards that reported after it are merged
+    # again (merging an already merged shard does nothing). Definitions from old
+    # snapshots have no totals, those are rebuilt from whatever shard results remain
+    for mr_id, definition in mr_definitions.items():
+        mapreduces.restore(mr_id, definition)
+        for job_id in definition['job_ids']:
+            record = logged_results.get(job_id) or results.get(job_id)
+            if record is not None:
+                mapreduces.merge(job_id, record)
+            elif job_id in logged_failures or jobs.get(job_id, {}).get('status') == 'failed':
+                mapreduces.merge(job_id, {'result': DEAD_LETTER_ERROR, 'success': False})
+    mapreduce_id_allocator.advance_past(mr_definitions)
+    
+    # Blocked jobs wait on their upstream jobs again, releasing any whose results arrived before the crash
+    for job_id, job in jobs.items():
+        if job['status'] == 'blocked':
+            track_dependencies(job_id, job)
+    log.info('recovered', "💾 Recovered {jobs} jobs, {results} results and {mapreduces} map/reduce jobs "
+             "({events} journal events)", jobs=len(jobs), results=len(results), mapreduces=len(mr_definitions),
+             events=len(events))
 
-# Storage
-nodes = {}
-jobs = {}
-job_id_counter = 1
-job_results = {}
+def sync_journal():
+    """Wait until everything this request logged is on disk"""
+    if journal:
+        journal.wait_durable(journal.last_seq)
+
+@app.errorhandler(JournalError)
+def journal_failed(error):
+    # The change was applied in memory but may not survive a restart, so don't acknowledge it
+    return jsonify({'error': str(error)}), 503
+
+def journal_write_failed(error):
+    log.warning('journal_write_failed', "💥 Journal write failed, retrying: {error}", error=str(error))
+
+JOB_DEFINITIONS = {
+    'hash_file': {
+        'code': "import hashlib; result = hashlib.md5(b'androcompute').hexdigest()",
+        'description': 'Calculate MD5 hash of sample data'
+    },
+    'calculate_pi': {
+        'code': "import math; result = str(math.pi)[:10]",
+        'description': 'Calculate Pi to 10 digits'
+    },
+    'process_data': {
+        'code': "result = sum(i*i for i in range(1000))",
+        'description': 'Process numerical data'
+    }
+}
 
 DASHBOARD_HTML = """
 <!DOCTYPE html>
@@ -22,7 +317,9 @@ DASHBOARD_HTML = """
         .node { background: #e0e0e0; padding: 10px; margin: 5px; border-radius: 5px; }
         .job { background: #e0f0ff; padding: 10px; margin: 5px; border-radius: 5px; }
         .result { background: #f0ffe0; padding: 10px; margin: 5px; border-radius: 5px; }
+        .counter { display: inline-block; background: white; padding: 8px 12px; margin: 5px; border-radius: 5px; }
         button { background: #4CAF50; color: white; padding: 10px; border: none; border-radius: 5px; cursor: pointer; margin: 5px; }
+        button:disabled { background: #9e9e9e; cursor: default; }
         .completed { background: #d4edda; }
         .assigned { background: #fff3cd; }
     </style>
@@ -31,24 +328,14 @@ DASHBOARD_HTML = """
     <div class="container">
         <div class="header">
             <h1>🖥️ AndroCompute Dashboard</h1>
-            <p>Coordinator URL: {{ url }}</p>
-            <p>📊 System Status: <strong>{{ "ACTIVE" if nodes else "IDLE" }}</strong></p>
+            <p>Coordinator URL: <span id="url"></span></p>
+            <p>📊 System Status: <strong id="system-status">IDLE</strong></p>
         </div>
         
-        <h2>📱 Connected Android Nodes ({{ nodes|length }})</h2>
-        <div id="nodes">
-            {% for node_id, node_data in nodes.items() %}
-            <div class="node">
-                📱 <strong>{{ node_id }}</strong><br>
-                Status: <span style="color: green;">{{ node_data.status }}</span><br>
-                Battery: {{ node_data.resources.battery_level }}%<br>
-                Cores: {{ node_data.resources.cpu_cores }}<br>
-                Last Seen: {{ "%.1f"|format(time.time() - node_data.last_seen) }}s ago
-            </div>
-            {% else %}
-            <p>No nodes connected yet...</p>
-            {% endfor %}
-        </div>
+        <div id="counters"></div>
+        
+        <h2>📱 Connected Android Nodes (<span id="node-count">0</span>)</h2>
+        <div id="nodes"><p>No nodes connected yet...</p></div>
         
         <h2>📋 Job Control</h2>
         <div>
@@ -58,38 +345,179 @@ DASHBOARD_HTML = """
             <button onclick="clearCompletedJobs()">🗑️ Clear Completed</button>
         </div>
         
-        <h2>📊 Active Jobs ({{ jobs|length }})</h2>
-        <div id="jobs">
-            {% for job_id, job_data in jobs.items() %}
-            <div class="job {{ 'completed' if job_data.status == 'completed' else 'assigned' }}">
-                🆔 <strong>{{ job_id }}</strong><br>
-                Type: {{ job_data.type }}<br>
-                Status: <strong>{{ job_data.status }}</strong><br>
-                Assigned: {{ job_data.assigned_to }}<br>
-                Submitted: {{ "%.1f"|format(time.time() - job_data.submitted_at) }}s ago
-            </div>
-            {% else %}
-            <p>No active jobs...</p>
-            {% endfor %}
+        <h2>📊 Jobs (<span id="job-count">0</span>)</h2>
+        <div>
+            Status: <select id="job-status" onchange="jobCursors = [0]; loadJobs()">
+                <option value="">all</option>
+                {% for status in statuses %}<option>{{ status }}</option>{% endfor %}
+            </select>
+            <button id="jobs-prev" onclick="jobCursors.pop(); loadJobs()">◀ Newer</button>
+            <button id="jobs-next" onclick="jobCursors.push(nextJobCursor); loadJobs()">Older ▶</button>
         </div>
+        <div id="jobs"><p>No active jobs...</p></div>
         
-        <h2>📈 Job Results ({{ job_results|length }})</h2>
-        <div id="results">
-            {% for job_id, result in job_results.items() %}
-            <div class="result">
-                ✅ <strong>{{ job_id }}</strong><br>
-                Result: <code>{{ result.result }}</code><br>
-                Node: {{ result.node_id }}<br>
-                Time: {{ "%.3f"|format(result.execution_time) }}s<br>
-                Completed: {{ "%.1f"|format(time.time() - result.completed_at) }}s ago
-            </div>
-            {% else %}
-            <p>No results yet...</p>
-            {% endfor %}
-        </div>
+        <h2>📈 Job Results (<span id="results-total">0</span>, newest <span id="results-shown">0</span> shown)</h2>
+        <div id="results"><p>No results yet...</p></div>
     </div>
     
     <script>
+        // The page is static, it keeps its own copy of what it shows and applies
+        // /api/state deltas to it, so an open dashboard costs the coordinator
+        // the changes since its last update rather than a render of everything
+        const PAGE_SIZE = {{ page_size }};
+        const RESULTS_SHOWN = {{ results_shown }};
+        let version = null;
+        let nodes = {};
+        let jobs = new Map();
+        let results = [];
+        let jobCursors = [0];
+        let nextJobCursor = null;
+        let updating = false;
+        let pending = false;
+        
+        function escapeHtml(value) {
+            return String(value).replace(/[&<>"']/g, c => ({'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'}[c]));
+        }
+        
+        function ago(timestamp) {
+            return (Date.now() / 1000 - timestamp).toFixed(1) + 's ago';
+        }
+        
+        function selectedStatus() {
+            return document.getElementById('job-status').value;
+        }
+        
+        function renderCounters(counters) {
+            const parts = Object.entries(counters.jobs).map(([status, count]) => [status + ' jobs', count]);
+            parts.push(['active nodes', counters.nodes.active], ['results', counters.results]);
+            document.getElementById('counters').innerHTML = parts.map(([name, count]) =>
+                `<span class="counter"><strong>${count}</strong> ${escapeHtml(name)}</span>`).join('');
+            document.getElementById('node-count').textContent = counters.nodes.registered;
+            document.getElementById('system-status').textContent = counters.nodes.registered ? 'ACTIVE' : 'IDLE';
+            document.getElementById('results-total').textContent = counters.results;
+        }
+        
+        function renderNodes() {
+            const html = Object.entries(nodes).map(([nodeId, node]) => {
+                const r = node.resources || {};
+                return `<div class="node">
+                    📱 <strong>${escapeHtml(nodeId)}</strong><br>
+                    Status: <span style="color: green;">${escapeHtml(node.status)}</span><br>
+                    Battery: ${escapeHtml(r.battery_level)}%<br>
+                    Cores: ${escapeHtml(r.cpu_cores)}${r.concurrency ? ` (running ${escapeHtml(r.concurrency)} at once)` : ''}<br>
+                    ${r.cpu_percent ? 'CPU: ' + r.cpu_percent.map(p => p.toFixed(0) + '% ').join('') + '<br>' : ''}
+                    ${r.temperature ? `Temperature: ${r.temperature.toFixed(1)}°C<br>` : ''}
+                    Last Seen: ${ago(node.last_seen)}
+                </div>`;
+            }).join('');
+            document.getElementById('nodes').innerHTML = html || '<p>No nodes connected yet...</p>';
+        }
+        
+        function renderJobs() {
+            const html = Array.from(jobs.values()).map(job => `
+                <div class="job ${job.status == 'completed' ? 'completed' : 'assigned'}">
+                    🆔 <strong>${escapeHtml(job.job_id)}</strong><br>
+                    Type: ${escapeHtml(job.type)}<br>
+                    Status: <strong>${escapeHtml(job.status)}</strong><br>
+                    Assigned: ${escapeHtml(job.assigned_to)}<br>
+                    Submitted: ${ago(job.submitted_at)}
+                </div>`).join('');
+            document.getElementById('jobs').innerHTML = html || '<p>No active jobs...</p>';
+            document.getElementById('jobs-prev').disabled = jobCursors.length < 2;
+            document.getElementById('jobs-next').disabled = nextJobCursor === null;
+        }
+        
+        function renderResults() {
+            const html = results.map(([jobId, result]) => `
+                <div class="result">
+                    ✅ <strong>${escapeHtml(jobId)}</strong><br>
+                    Result: <code>${escapeHtml(JSON.stringify(result.result))}</code><br>
+                    Node: ${escapeHtml(result.node_id)}<br>
+                    Time: ${Number(result.execution_time || 0).toFixed(3)}s<br>
+                    Completed: ${ago(result.completed_at)}
+                </div>`).join('');
+            document.getElementById('results').innerHTML = html || '<p>No results yet...</p>';
+            document.getElementById('results-shown').textContent = results.length;
+        }
+        
+        function loadJobs() {
+            const cursor = jobCursors[jobCursors.length - 1];
+            return fetch(`/api/jobs?status=${selectedStatus()}&cursor=${cursor}&limit=${PAGE_SIZE}`)
+            .then(response => response.json())
+            .then(data => {
+                jobs = new Map(data.jobs.map(job => [job.job_id, job]));
+                nextJobCursor = data.next_cursor;
+                document.getElementById('job-count').textContent = data.total;
+                renderJobs();
+            });
+        }
+        
+        function applyJobChanges(changed) {
+            // Status changes to jobs already on the page are applied in place,
+            // anything that could add or remove a row reloads just this page
+            const status = selectedStatus();
+            let reload = changed === null;
+            for (const [jobId, job] of Object.entries(changed || {})) {
+                if (jobs.has(jobId)) {
+                    if (job === null || (status && job.status != status)) {
+                        reload = true;
+                    } else {
+                        jobs.set(jobId, Object.assign({job_id: jobId}, job));
+                    }
+                } else if (job !== null && (!status || job.status == status)) {
+                    reload = true;
+                }
+            }
+            return reload ? loadJobs() : renderJobs();
+        }
+        
+        function applyResults(changed) {
+            const updated = Object.entries(changed);
+            const seen = new Set(updated.map(([jobId]) => jobId));
+            results = updated.concat(results.filter(([jobId]) => !seen.has(jobId)))
+                .filter(([jobId, result]) => result !== null)
+                .sort((a, b) => b[1].completed_at - a[1].completed_at)
+                .slice(0, RESULTS_SHOWN);
+        }
+        
+        function update() {
+            // One request at a time, updates that arrive meanwhile are folded into the next
+            if (updating) {
+                pending = true;
+                return;
+            }
+            updating = true;
+            fetch('/api/state' + (version === null ? '' : '?since=' + version))
+            .then(response => response.json())
+            .then(data => {
+                version = data.version;
+                renderCounters(data.counters);
+                if (data.full) {
+                    nodes = data.nodes;
+                    results = [];
+                } else {
+                    for (const [nodeId, node] of Object.entries(data.nodes)) {
+                        if (node === null) {
+                            delete nodes[nodeId];
+                        } else {
+                            nodes[nodeId] = node;
+                        }
+                    }
+                }
+                applyResults(data.results);
+                renderNodes();
+                renderResults();
+                return applyJobChanges(data.full ? null : data.jobs);
+            })
+            .finally(() => {
+                updating = false;
+                if (pending) {
+                    pending = false;
+                    update();
+                }
+            });
+        }
+        
         function submitJob(jobType) {
             fetch('/submit_job', {
                 method: 'POST',
@@ -99,11 +527,11 @@ DASHBOARD_HTML = """
             .then(response => response.json())
             .then(data => {
                 if (data.job_id) {
-                    alert('✅ Job submitted: ' + data.job_id + ' to ' + data.assigned_to);
+                    alert('✅ Job submitted: ' + data.job_id + ' to ' + (data.assigned_to || 'shared pool'));
                 } else {
                     alert('❌ Job submission failed: ' + data.error);
                 }
-                setTimeout(() => location.reload(), 1000);
+                if (!window.EventSource) update();
             })
             .catch(error => {
                 alert('❌ Error: ' + error);
@@ -113,12 +541,19 @@ DASHBOARD_HTML = """
         function clearCompletedJobs() {
             if (confirm('Clear all completed jobs and results?')) {
                 fetch('/clear_completed', {method: 'POST'})
-                .then(() => location.reload());
+                .then(() => window.EventSource || update());
             }
         }
         
-        // Auto-refresh every 3 seconds
-        setInterval(() => location.reload(), 3000);
+        document.getElementById('url').textContent = location.origin + '/';
+        update();
+        // Ages tick locally, only changes need the coordinator
+        setInterval(() => { renderNodes(); renderJobs(); renderResults(); }, 1000);
+        if (window.EventSource) {
+            new EventSource('/dashboard/stream').addEventListener('update', update);
+        } else {
+            setInterval(update, 3000);
+        }
     </script>
 </body>
 </html>
@@ -132,153 +567,984 @@ def home():
 def register_node():
     data = request.json
     node_id = data.get('node_id')
-    nodes[node_id] = {
-        'resources': data.get('resources', {}),
-        'status': 'online',
-        'last_seen': time.time()
-    }
-    print(f"📱 Node registered: {node_id}")
-    return jsonify({'status': 'registered', 'node_id': node_id})
+    node_events.inc(event='reregistered' if node_id in nodes else 'registered')
+    # Workers get a new node_id each start, their device_id keeps the phone's performance profile
+    nodes.register(node_id, data.get('resources', {}), data.get('device_id'))
+    # Blob hashes already in the worker's cache, so jobs over that data go to it
+    nodes.set_blobs(node_id, data.get('blobs'))
+    code_catalog.reset_node(node_id, data.get('code_cache_size', 0))
+    changes.notify('node', node_id)
+    log.info('node_registered', "📱 Node registered: {node_id}", node_id=node_id)
+    # The formats and encodings the worker may send us, see wire
+    return jsonify({'status': 'registered', 'node_id': node_id,
+                    'wire': {'formats': wire.formats(), 'encodings': wire.encodings()}})
 
 @app.route('/nodes')
 def get_nodes():
-    return jsonify(nodes)
+    return jsonify(nodes.snapshot())
+
+@functools.lru_cache(maxsize=1)
+def dashboard_page():
+    return render_template_string(DASHBOARD_HTML, statuses=JOB_STATUSES, page_size=DASHBOARD_PAGE_SIZE,
+                                  results_shown=DASHBOARD_RESULTS)
 
 @app.route('/dashboard')
 def dashboard():
-    return render_template_string(DASHBOARD_HTML, nodes=nodes, jobs=jobs, job_results=job_results, url=request.url_root, time=time)
+    # A static page, rendered once, that keeps itself up to date from /api/state
+    return dashboard_page()
+
+def job_summary(job):
+    """What the dashboard shows of a job, without its code or args"""
+    return {field: job.get(field) for field in ('type', 'status', 'assigned_to', 'submitted_at', 'attempts')}
+
+@app.route('/api/state')
+def api_state():
+    # Dashboard state as deltas: counters every time, then only the nodes, jobs and
+    # results that changed after ?since=<version>. Without since, or when it is too old,
+    # "full" is true and every node and the newest results are sent instead. Changed
+    # jobs come as summaries, null if removed, and the job list itself is paged
+    # through /api/jobs. The cost is the number of changes, not of jobs
+    version, changed = changes.changes_since(request.args.get('since', type=int))
+    state = {
+        'version': version,
+        'full': changed is None,
+        'counters': {
+            'jobs': job_queue.counts(),
+            'nodes': {'registered': len(nodes), 'active': len(nodes.active(30))},
+            'results': len(job_results)
+        }
+    }
+    if changed is None:
+        state['nodes'] = nodes.snapshot()
+        state['jobs'] = None
+        state['results'] = job_results.recent(DASHBOARD_RESULTS)
+        return jsonify(state)
+    
+    node_ids = changed.get('node', ())
+    current = nodes.snapshot(node_ids)
+    state['nodes'] = {node_id: current.get(node_id) for node_id in node_ids}
+    job_ids = changed.get('job', ())
+    if len(job_ids) > MAX_DELTA_JOBS:
+        # Too many to list, the dashboard reloads its page instead
+        state['jobs'] = None
+    else:
+        state['jobs'] = {job_id: job_summary(job) if job else None
+                         for job_id, job in ((job_id, job_queue.get(job_id)) for job_id in job_ids)}
+    # Only the newest results fit on the dashboard, older ones in a big delta are skipped
+    added = {job_id: job_results.get(job_id) for job_id in changed.get('result', ())}
+    newest = sorted(added, key=lambda job_id: (added[job_id] or {}).get('completed_at', 0), reverse=True)
+    state['results'] = {job_id: added[job_id] for job_id in newest[:DASHBOARD_RESULTS]}
+    return jsonify(state)
+
+@app.route('/api/jobs')
+def api_jobs():
+    # One page of job summaries: /api/jobs?status=executing&cursor=<next_cursor>&limit=50,
+    # several statuses comma-separated, all of them by default
+    statuses = [status for status in request.args.get('status', '').split(',') if status in JOB_STATUSES]
+    cursor = max(request.args.get('cursor', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', DASHBOARD_PAGE_SIZE, type=int), 1), MAX_JOBS_PAGE)
+    page, next_cursor, total = job_queue.page(statuses or JOB_STATUSES, cursor, limit)
+    return jsonify({'jobs': [dict(job_summary(job), job_id=job_id) for job_id, job in page.items()],
+                    'next_cursor': next_cursor, 'total': total})
+
+def input_blobs(args):
+    """digest -> size of the blobs a job's args reference"""
+    return {digest: blobs.size(digest) or 0 for digest in blob_refs(args)}
+
+def find_target_node(pinned_to=None, args=None):
+    """
+    Pick the node a new job should be queued for
+
+    Args:
+        pinned_to (str): Node the client asked for explicitly, if any
+        args (dict): The job's template args, nodes that have cached the
+            blobs they reference are preferred
+
+    Returns:
+        tuple: (node_id, None) or (None, error message), node_id is None for
+        jobs left in the shared pool under late binding
+    """
+    if pinned_to:
+        if pinned_to not in nodes:
+            return None, f'Unknown node {pinned_to}'
+        nodes.add_blobs(pinned_to, blob_refs(args))
+        return pinned_to, None
+    if not nodes:
+        return None, 'No nodes available'
+    
+    active_nodes = nodes.active(30)  # Nodes active in last 30 seconds
+    if not active_nodes:
+        return None, 'No active nodes available'
+    
+    if DISPATCH_MODE == 'late':
+        return None, None
+    
+    # Let the scheduling policy balance work across the active nodes
+    node_id = scheduler.select(active_nodes, job_queue.load, input_blobs(args))
+    if node_id is None:
+        # Every active node has paused to save power, the first to resume claims it
+        return None, None
+    # The node fetches the blobs for this job, so later jobs over the same data
+    # follow it before its next heartbeat says so
+    nodes.add_blobs(node_id, blob_refs(args))
+    return node_id, None
+
+def job_fields(spec, pending=()):
+    """
+    What to run for a submitted job spec, either {"type": ...} for a built-in
+    code job or {"template": "name@version", "args": {...}} for a template job.
+    Either can wait on other jobs with "after": [job IDs], and template jobs can
+    take other jobs' results as args with "inputs": {arg: job ID}
+
+    Args:
+        spec (dict): The submitted job spec
+        pending (iterable): Job IDs being created in the same request, valid
+            dependencies though they don't exist yet
+
+    Raises:
+        ValueError: If the template isn't registered, args isn't an object or
+            the dependencies aren't known jobs
+    """
+    fields = dependency_fields(spec, pending)
+    if spec.get('template'):
+        template = templates.get(spec['template'])
+        if template is None:
+            raise ValueError(f"Unknown template {spec['template']}")
+        args = spec.get('args') or {}
+        if not isinstance(args, dict):
+            raise ValueError('Template args must be a JSON object')
+        missing = [digest for digest in blob_refs(args) if digest not in blobs]
+        if missing:
+            raise ValueError(f"Unknown blob {missing[0]}, upload it to /blobs first")
+        return dict(fields, **{
+            'type': template['id'],
+            'template': template['id'],
+            'args': args,
+            'code_hash': template['code_hash'],
+            'description': template['description']
+        })
+    
+    if 'inputs' in fields:
+        raise ValueError('Only template jobs can take inputs')
+    job_type = spec.get('type', 'compute')
+    job_data = JOB_DEFINITIONS.get(job_type, JOB_DEFINITIONS['hash_file'])
+    return dict(fields, **{
+        'type': job_type,
+        'code': job_data['code'],
+        'code_hash': code_catalog.add(job_data['code']),
+        'description': job_data['description']
+    })
+
+def dependency_fields(spec, pending=()):
+    """The 'inputs' and 'after' fields for a job spec, empty if it has no dependencies"""
+    inputs = spec.get('inputs') or {}
+    after = spec.get('after') or []
+    if not isinstance(inputs, dict) or not isinstance(after, list):
+        raise ValueError('inputs must map arg names to job IDs and after must list job IDs')
+    unknown = [job_id for job_id in list(inputs.values()) + after
+               if job_id not in job_queue and job_id not in job_results and job_id not in pending]
+    if unknown:
+        raise ValueError(f"Unknown upstream jobs {unknown}")
+    fields = {}
+    if inputs:
+        fields['inputs'] = inputs
+    if after:
+        fields['after'] = after
+    return fields
+
+def create_job(fields, node_id, pinned=False, job_id=None):
+    """
+    Queue a job built by job_fields for node_id (or the shared pool) and return
+    its ID. A job with dependencies is held back until they report, node_id is
+    then only used if the job is pinned
+    """
+    job_id = job_id or job_id_allocator.next_id()
+    blocked = 'inputs' in fields or 'after' in fields
+    
+    job = dict(fields, **{
+        'status': 'blocked' if blocked else ('assigned' if node_id else 'pending'),
+        'assigned_to': node_id,
+        'pinned': pinned,
+        'submitted_at': time.time()
+    })
+    job_queue.add(job_id, job)
+    jobs_submitted.inc(type=job['type'])
+    
+    if blocked:
+        log.info('job_blocked', "⏳ Job {job_id} waiting on {upstream} jobs", sampled=True, job_id=job_id,
+                 upstream=len(set(fields.get('inputs', {}).values()) | set(fields.get('after', []))))
+        track_dependencies(job_id, job)
+    else:
+        log.info('job_queued', "📋 Job {job_id} assigned to {queue}", sampled=True, job_id=job_id,
+                 queue=node_id or 'shared pool')
+    return job_id
+
+def submit_one(fields, pinned_to=None, job_id=None):
+    """
+    Pick a node for a job and queue it, jobs with dependencies only get a node
+    once they are released
+
+    Returns:
+        tuple: (job_id, node_id, None) or (None, None, error message)
+    """
+    if ('inputs' in fields or 'after' in fields) and not pinned_to:
+        node_id = None
+    else:
+        node_id, error = find_target_node(pinned_to, fields.get('args'))
+        if error:
+            return None, None, error
+    return create_job(fields, node_id, pinned=bool(pinned_to), job_id=job_id), node_id, None
+
+def finished_result(job_id):
+    """A job's result record for the dependency tracker, None while it hasn't finished"""
+    record = job_results.get(job_id)
+    if record is not None:
+        return record
+    status = (job_queue.get(job_id) or {}).get('status')
+    if status == 'failed':
+        return {'result': DEAD_LETTER_ERROR, 'success': False}
+    if status == 'completed' or job_id not in job_queue:
+        # Finished, but the result was already trimmed or expired
+        return {'result': 'ERROR: result no longer available', 'success': False}
+    return None
+
+def track_dependencies(job_id, job):
+    dispatch_ready(*dependencies.add(job_id, job.get('args') or {}, job.get('inputs') or {},
+                                     job.get('after') or [], finished_result))
+
+def dependency_node(producers, args):
+    """Node to run a released job on, preferably the one that produced most of its inputs"""
+    active_nodes = nodes.active(30)
+    for node_id, _ in Counter(producers).most_common():
+        if node_id in active_nodes and scheduler.is_eligible(node_id, active_nodes[node_id]):
+            nodes.add_blobs(node_id, blob_refs(args))
+            return node_id
+    return find_target_node(args=args)[0]
+
+def dispatch_ready(ready, failed):
+    """Queue jobs whose dependencies have all reported and fail the ones that can't run"""
+    for job_id, args, producers in ready:
+        job = job_queue.get(job_id)
+        if job is None:
+            continue
+        node_id = job['assigned_to'] if job.get('pinned') else dependency_node(producers, args)
+        if job_queue.unblock(job_id, node_id, args):
+            log.info('job_released', "🔓 Job {job_id} released to {queue}", sampled=True, job_id=job_id,
+                     queue=node_id or 'shared pool')
+    fail_blocked(failed)
+
+def fail_blocked(failed):
+    # Safe under the job queue's lock, see dead_lettered
+    for job_id, reason in failed:
+        if (job_queue.get(job_id) or {}).get('status') != 'blocked':
+            continue
+        job_queue.set_status(job_id, 'failed')
+        record = {
+            'result': f"ERROR: {reason}",
+            'success': False,
+            'node_id': None,
+            'execution_time': 0,
+            'completed_at': time.time()
+        }
+        job_results.add(job_id, record)
+        changes.notify('result', job_id)
+        if journal:
+            journal.append('result', job_id=job_id, result=record)
+        log.warning('job_failed', "❌ Job {job_id} failed: {reason}", job_id=job_id, reason=reason)
+
+def dead_lettered(job_id):
+    # Called under the job queue's lock, failing dependents only takes the
+    # tracker's and result store's locks, never the scheduler's
+    record = {'result': DEAD_LETTER_ERROR, 'success': False}
+    ready, failed = dependencies.resolve(job_id, record)
+    fail_blocked(failed)
+    job = job_queue.get(job_id)
+    if job and 'mapreduce' in job:
+        # The shard will never report, count it as failed so the map/reduce job can finish
+        mr_id = mapreduces.merge(job_id, record)
+        if mr_id:
+            log.info('mapreduce_complete', "🧮 Map/reduce {mapreduce_id} complete", mapreduce_id=mr_id)
+
+job_queue.on_failed = dead_lettered
+
+def job_payload(job_id, job_data, node_id):
+    payload = {
+        'job_id': job_id,
+        'code_hash': job_data['code_hash'],
+        'type': job_data['type'],
+        'description': job_data.get('description', ''),
+        'lease_timeout': LEASE_TIMEOUT,
+        'speculative': job_data['assigned_to'] != node_id
+    }
+    if 'template' in job_data:
+        payload['template'] = job_data['template']
+        payload['args'] = job_data['args']
+        # Jobs claimed from the shared pool weren't placed by the scheduler, so note the blobs here
+        nodes.add_blobs(node_id, blob_refs(job_data['args']))
+    # Skip the source if the worker should still have it compiled
+    if not code_catalog.mark_sent(node_id, job_data['code_hash']):
+        payload['code'] = job_data.get('code') or code_catalog.get(job_data['code_hash'])
+    return payload
+
+def record_result(job_id, node_id, result, execution_time, success=True):
+    """Store a worker's result, returns False if the job is unknown"""
+    job, first = job_queue.complete(job_id)
+    if job is None:
+        return False
+    if not first:
+        # A re-dispatched or backup copy already reported, keep the first result
+        return True
+    
+    scheduler.record_result(node_id, execution_time)
+    runtime_stats.record(job['type'], nodes.device_id(node_id), execution_time, job.get('units'))
+    execution_time_seconds.observe(execution_time, type=job['type'])
+    jobs_finished.inc(type=job['type'], success=str(success is not False).lower())
+    record = {
+        'result': result,
+        'success': success is not False,
+        'node_id': node_id,
+        'execution_time': execution_time,
+        'completed_at': time.time()
+    }
+    job_results.add(job_id, record)
+    changes.notify('result', job_id)
+    if journal:
+        journal.append('result', job_id=job_id, result=record)
+    
+    log.info('result_received', "✅ Result received for {job_id} from {node_id}: {result}", sampled=True,
+             job_id=job_id, node_id=node_id, result=result, execution_time=execution_time)
+    # Release anything waiting on this job, with the result passed straight in as an arg
+    dispatch_ready(*dependencies.resolve(job_id, record))
+    if 'mapreduce' in job:
+        # Fold the shard into its map/reduce total as soon as it arrives
+        mr_id = mapreduces.merge(job_id, record)
+        if mr_id:
+            log.info('mapreduce_complete', "🧮 Map/reduce {mapreduce_id} complete", mapreduce_id=mr_id)
+    return True
+
+def straggler_threshold(job, node_id):
+    """Seconds a run may take before a backup copy is launched, None to never speculate"""
+    if not SPECULATION_PERCENTILE:
+        return None
+    predicted = runtime_stats.predict(job['type'], nodes.device_id(node_id), SPECULATION_PERCENTILE)
+    return predicted and max(predicted, SPECULATION_MIN_SECONDS)
+
+job_queue.straggler_threshold = straggler_threshold
+
+def expected_runtime(job, node_id):
+    """Seconds a job should take on a node from its device's profile, None without enough history"""
+    device_id = nodes.device_id(node_id)
+    if job.get('units'):
+        per_unit = runtime_stats.seconds_per_unit(job['type'], device_id)
+        if per_unit is not None:
+            return per_unit * job['units']
+    return runtime_stats.expected(job['type'], device_id)
+
+job_queue.expected_runtime = expected_runtime
+
+def claim_delay(job, node_id):
+    """
+    Seconds a pooled job waits before a node may claim it: the node's cost to
+    download the job's blobs beyond what the cheapest other active node would
+    pay. This is where late dispatch and re-queued jobs price locality
+    """
+    node_data = nodes.get(node_id)
+    refs = blob_refs(job.get('args'))
+    if node_data is None or set(refs) <= node_data.get('blobs', frozenset()):
+        return 0
+    blobs = input_blobs(job.get('args'))
+    cost = scheduler.transfer_time(node_data, blobs)
+    if not cost:
+        return 0
+    others = [scheduler.transfer_time(other_data, blobs) for other_id, other_data in nodes.active(30).items()
+              if other_id != node_id and scheduler.is_eligible(other_id, other_data)]
+    return max(cost - min(others), 0) if others else 0
+
+job_queue.claim_delay = claim_delay
+
+def job_changed(job_id):
+    # Under the job queue's lock, the change feed only takes its own
+    changes.notify('job', job_id)
+
+job_queue.on_change = job_changed
+
+def observe_dispatch(job, waited):
+    # Under the job queue's lock, the histogram only takes its own
+    dispatch_wait.observe(waited, type=job['type'])
+
+job_queue.on_dispatch = observe_dispatch
+
+def wait_time():
+    return min(max(request.args.get('wait', 0, type=float), 0), MAX_LONG_POLL)
+
+def touch_node(node_id):
+    nodes.touch(node_id)
+
+def claim_options(node_id):
+    """Whether a node may take pooled or stolen work, and the steal threshold"""
+    node_data = nodes.get(node_id)
+    shared = node_data is not None and scheduler.is_eligible(node_id, node_data)
+    return {'shared': shared, 'steal_min_depth': STEAL_MIN_DEPTH}
+
+def batch_options(node_id):
+    """claim_options plus the time budget a leased batch is sized to"""
+    node_data = nodes.get(node_id)
+    return dict(claim_options(node_id), budget=TARGET_JOB_SECONDS or None,
+                slots=scheduler.cores(node_data) if node_data else 1)
 
 @app.route('/submit_job', methods=['POST'])
 def submit_job():
-    global job_id_counter
     data = request.json
-    job_type = data.get('type', 'compute')
-    job_id = f"job_{job_id_counter}"
-    job_id_counter += 1
-    
-    job_definitions = {
-        'hash_file': {
-            'code': "import hashlib; result = hashlib.md5(b'androcompute').hexdigest()",
-            'description': 'Calculate MD5 hash of sample data'
-        },
-        'calculate_pi': {
-            'code': "import math; result = str(math.pi)[:10]",
-            'description': 'Calculate Pi to 10 digits'
-        },
-        'process_data': {
-            'code': "result = sum(i*i for i in range(1000))",
-            'description': 'Process numerical data'
-        }
-    }
+    pinned_to = data.get('node_id')
     
-    if nodes:
-        # Assign to newest active node (most recent last_seen)
-        active_nodes = {node_id: data for node_id, data in nodes.items() 
-                       if time.time() - data.get('last_seen', 0) < 30}  # Nodes active in last 30 seconds
-        
-        if active_nodes:
-            # Get the newest active node
-            newest_node = max(active_nodes.keys(), key=lambda x: active_nodes[x].get('last_seen', 0))
-            job_data = job_definitions.get(job_type, job_definitions['hash_file'])
+    try:
+        fields = job_fields(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job_id, node_id, error = submit_one(fields, pinned_to)
+    if error:
+        return jsonify({'error': error}), 400
+    
+    sync_journal()
+    return jsonify({
+        'job_id': job_id, 
+        'assigned_to': node_id, 
+        'status': 'submitted',
+        'description': fields['description']
+    })
+
+@app.route('/submit_jobs', methods=['POST'])
+def submit_jobs():
+    # Submit many jobs in one request: {"jobs": [{"type": ...}, ...]}, or fan one
+    # template out over many argument sets: {"template": "name@version", "args_list": [...]}
+    data = request.json
+    if data.get('template'):
+        batch = [{'template': data['template'], 'args': args, 'node_id': data.get('node_id')}
+                 for args in data.get('args_list') or []]
+        limit = MAX_FANOUT
+    else:
+        batch = data.get('jobs') or []
+        limit = MAX_BATCH_SIZE
+    if len(batch) > limit:
+        return jsonify({'error': f'At most {limit} jobs per batch'}), 400
+    
+    try:
+        specs = [(job_fields(job), job.get('node_id')) for job in batch]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    job_ids = []
+    assigned_to = []
+    for fields, pinned_to in specs:
+        job_id, node_id, error = submit_one(fields, pinned_to)
+        if error:
+            sync_journal()
+            return jsonify({'error': error, 'job_ids': job_ids, 'assigned_to': assigned_to}), 400
+        job_ids.append(job_id)
+        assigned_to.append(node_id)
+    
+    sync_journal()
+    return jsonify({'job_ids': job_ids, 'assigned_to': assigned_to, 'status': 'submitted'})
+
+@app.route('/submit_workflow', methods=['POST'])
+def submit_workflow():
+    # Submit jobs that feed each other in one request: {"jobs": [{"name": "a", "template": ...,
+    # "args": {...}}, {"name": "b", "template": ..., "inputs": {"arg": "a"}, "after": [...]}]}.
+    # inputs and after refer to jobs by name, anything that isn't a name is an existing job ID
+    batch = request.json.get('jobs') or []
+    if len(batch) > MAX_BATCH_SIZE:
+        return jsonify({'error': f'At most {MAX_BATCH_SIZE} jobs per workflow'}), 400
+    names = [job.get('name') for job in batch]
+    if not all(names) or len(set(names)) != len(names):
+        return jsonify({'error': 'Every workflow job needs a unique name'}), 400
+    
+    job_ids = {name: job_id_allocator.next_id() for name in names}
+    pending = set(job_ids.values())
+    try:
+        specs = []
+        # Created upstream first, so every job's dependencies exist by the time it is tracked
+        for job in workflow_order(batch):
+            inputs = {arg: job_ids.get(ref, ref) for arg, ref in (job.get('inputs') or {}).items()}
+            after = [job_ids.get(ref, ref) for ref in job.get('after') or []]
+            fields = job_fields(dict(job, inputs=inputs, after=after), pending)
+            specs.append((job['name'], fields, job.get('node_id')))
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    assigned_to = {}
+    for name, fields, pinned_to in specs:
+        job_id, node_id, error = submit_one(fields, pinned_to, job_id=job_ids[name])
+        if error:
+            sync_journal()
+            return jsonify({'error': error, 'job_ids': {name: job_ids[name] for name in assigned_to},
+                            'assigned_to': assigned_to}), 400
+        assigned_to[name] = node_id
+    
+    sync_journal()
+    return jsonify({'job_ids': job_ids, 'assigned_to': assigned_to, 'status': 'submitted'})
+
+@app.route('/templates', methods=['GET', 'POST'])
+def template_list():
+    # Register a template once: {"name", "version", "source", "description"},
+    # then submit jobs with {"template": "name@version", "args": {...}}
+    if request.method == 'GET':
+        return jsonify(templates.snapshot())
+    
+    data = request.json
+    if not data.get('name') or data.get('version') is None or not data.get('source'):
+        return jsonify({'error': 'name, version and source are required'}), 400
+    try:
+        template = register_template(data['name'], data['version'], data['source'], data.get('description', ''))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if journal:
+        journal.wait_durable(journal.append('template', template=template))
+    return jsonify({'template_id': template['id'], 'code_hash': template['code_hash']})
+
+def shard_count():
+    """Shards to split a map/reduce job into, one per core on the nodes that can take work"""
+    cores = sum(scheduler.cores(node_data) for node_id, node_data in nodes.active(30).items()
+                if scheduler.is_eligible(node_id, node_data))
+    return max(1, cores * SHARDS_PER_CORE)
+
+def plan_shards(template_id, args, units):
+    """
+    Size map/reduce shards to take about TARGET_JOB_SECONDS each on the node
+    they'll be queued for, so fast phones get bigger shards than slow ones
+
+    Args:
+        template_id (str): The template the shards run
+        args (dict): The whole job's args, for the input blobs it reads
+        units (int): Range length or item count to split
+
+    Returns:
+        tuple: (units per shard, node per shard) in shard order, or None if
+        there's no throughput history for the template yet or no active node
+    """
+    active_nodes = nodes.active(30)
+    if not TARGET_JOB_SECONDS or not active_nodes or runtime_stats.seconds_per_unit(template_id, None) is None:
+        return None
+    input_sizes = input_blobs(args)
+    planned = Counter()
+    # Never more than MAX_FANOUT shards, however slow the nodes
+    min_size = -(-units // MAX_FANOUT)
+    sizes, targets = [], []
+    remaining = units
+    while remaining > 0:
+        # Shards planned so far count as queued, so the scheduler spreads them out
+        node_id = None if DISPATCH_MODE == 'late' else scheduler.select(
+            active_nodes, lambda node_id: job_queue.load(node_id) + planned[node_id], input_sizes)
+        # Late binding doesn't know the node yet, the template's average across devices sizes the shard
+        per_unit = runtime_stats.seconds_per_unit(template_id, nodes.device_id(node_id) if node_id else None)
+        size = min(remaining, max(min_size, int(TARGET_JOB_SECONDS / per_unit), 1))
+        sizes.append(size)
+        targets.append(node_id)
+        planned[node_id] += 1
+        remaining -= size
+    return sizes, targets
+
+@app.route('/submit_mapreduce', methods=['POST'])
+def submit_mapreduce():
+    # Split one template job into shards run in parallel and merged as they finish:
+    # {"template": "name@version", "args": {...}, "split": {"range": ["start", "stop"]}
+    #  or {"items": "lines"}, "reducer": "sum", "k": 10, "shards": optional count}.
+    # Without shards, templates with throughput history are split so each shard takes
+    # about TARGET_JOB_SECONDS on its node, others into one shard per active core
+    data = request.json
+    if not data.get('template'):
+        return jsonify({'error': 'Map/reduce jobs need a template'}), 400
+    reducer = data.get('reducer', 'sum')
+    if reducer not in REDUCERS:
+        return jsonify({'error': f"Unknown reducer {reducer}, use one of {sorted(REDUCERS)}"}), 400
+    args = data.get('args') or {}
+    split = data.get('split') or {}
+    template = templates.get(data['template'])
+    try:
+        k = min(max(int(data.get('k') or 10), 1), MAX_TOP_K)
+        plan = None
+        if not data.get('shards') and template and isinstance(args, dict):
+            plan = plan_shards(template['id'], args, split_units(args, split))
+        shards = plan[0] if plan else min(max(int(data.get('shards') or shard_count()), 1), MAX_FANOUT)
+        args_list = shard_args(args, split, shards)
+        specs = [job_fields({'template': data.get('template'), 'args': shard}) for shard in args_list]
+    except (AttributeError, TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if plan:
+        node_id = plan[1][0]
+        for target in set(plan[1]) - {None}:
+            nodes.add_blobs(target, blob_refs(args))
+    else:
+        node_id, error = find_target_node(args=specs[0]['args'])
+        if error:
+            return jsonify({'error': error}), 400
+    
+    # Register the shards before queueing any, so none can finish before it's tracked
+    mr_id = mapreduce_id_allocator.next_id()
+    job_ids = [job_id_allocator.next_id() for _ in specs]
+    definition = {'template': specs[0]['template'], 'reducer': reducer, 'k': k,
+                  'job_ids': job_ids, 'submitted_at': time.time()}
+    mapreduces.add(mr_id, definition)
+    if journal:
+        journal.append('mapreduce', mapreduce_id=mr_id, mapreduce=definition)
+    
+    assigned_to = []
+    for index, (job_id, fields) in enumerate(zip(job_ids, specs)):
+        if plan:
+            node_id = plan[1][index]
+        elif index:
+            # If every node went quiet since the first pick the shard waits in the shared pool
+            node_id, _ = find_target_node(args=fields['args'])
+        # Shards record how much work they covered, for the devices' throughput profiles
+        create_job(dict(fields, mapreduce=mr_id, units=split_units(fields['args'], split)), node_id, job_id=job_id)
+        assigned_to.append(node_id)
+    
+    sync_journal()
+    log.info('mapreduce_split', "🧮 Map/reduce {mapreduce_id} split into {shards} shards", mapreduce_id=mr_id,
+             shards=len(job_ids))
+    return jsonify({'mapreduce_id': mr_id, 'shards': len(job_ids), 'job_ids': job_ids,
+                    'assigned_to': assigned_to, 'status': 'submitted'})
+
+@app.route('/mapreduce/<mr_id>')
+def mapreduce_status(mr_id):
+    # Progress plus the result merged from the shards finished so far
+    status = mapreduces.status(mr_id)
+    if status is None:
+        return jsonify({'error': 'Unknown map/reduce job'}), 404
+    status['dead_lettered'] = [job_id for job_id, error in status['errors'].items() if error == DEAD_LETTER_ERROR]
+    return jsonify(status)
+
+def sse(event, data):
+    """One Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def event_stream(events):
+    return Response(events, mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def observe_latency(response):
+    # Registered before compress_response so it runs after it and counts compression too.
+    # Streams are left out, they last as long as the client stays connected
+    if response.mimetype != 'text/event-stream' and 'request_started' in g:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_latency.observe(time.perf_counter() - g.request_started, route=route, method=request.method,
+                                status=response.status_code)
+    return response
+
+@app.after_request
+def compress_response(response):
+    # Compress large bodies for clients that accept it, workers on metered links mostly
+    encoding = wire.accepted_encoding(request.headers.get('Accept-Encoding'))
+    if (encoding and not response.is_streamed and not response.direct_passthrough
+            and 'Content-Encoding' not in response.headers
+            and (response.content_length or 0) >= wire.COMPRESS_MIN_BYTES):
+        response.set_data(wire.compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/stream/<node_id>')
+def job_stream(node_id):
+    # Push jobs to a worker the moment they are queued, over one long-lived
+    # Server-Sent Events response (/stream/<node_id>?slots=K). Results still go
+    # up by POST. The open stream counts as the node's heartbeat: it renews the
+    # leases on every job it pushed and sends "lost" for ones the node no longer
+    # holds. Workers that can't stream keep polling /get_jobs.
+    if node_id not in nodes:
+        return jsonify({'error': 'Unknown node, register first'}), 404
+    slots = max(request.args.get('slots', 1, type=int), 1)
+    
+    def events():
+        # Jobs pushed to this worker that it is still running
+        pushed = set()
+        yield ': connected\n\n'
+        while True:
+            touch_node(node_id)
+            gone = job_queue.renew(node_id, list(pushed))
+            pushed.difference_update(gone)
+            # Jobs this worker finished itself just leave, the rest it should abandon
+            lost = [job_id for job_id in gone if (job_results.get(job_id) or {}).get('node_id') != node_id]
+            if lost:
+                yield sse('lost', lost)
             
-            jobs[job_id] = {
-                'type': job_type,
-                'status': 'assigned',
-                'assigned_to': newest_node,
-                'code': job_data['code'],
-                'description': job_data['description'],
-                'submitted_at': time.time()
-            }
+            # Never push more than the worker has slots for, it reports fewer when throttled
+            capacity = (nodes.get(node_id) or {}).get('resources', {}).get('slots')
+            capacity = slots if capacity is None else capacity
+            if len(pushed) >= capacity:
+                job_queue.wait(node_id, STREAM_KEEPALIVE)
+                continue
             
-            print(f"📋 Job {job_id} assigned to {newest_node}")
-            return jsonify({
-                'job_id': job_id, 
-                'assigned_to': newest_node, 
-                'status': 'submitted',
-                'description': job_data['description']
-            })
-        else:
-            return jsonify({'error': 'No active nodes available'}), 400
-    return jsonify({'error': 'No nodes available'}), 400
+            leased = job_queue.pop_many(node_id, capacity - len(pushed), timeout=STREAM_KEEPALIVE,
+                                        **batch_options(node_id))
+            if leased:
+                pushed.update(job_id for job_id, _ in leased)
+                log.info('jobs_pushed', "📡 {count} jobs pushed to {node_id}", sampled=True, count=len(leased),
+                         node_id=node_id)
+                yield sse('jobs', [job_payload(job_id, job_data, node_id) for job_id, job_data in leased])
+            else:
+                yield ': keepalive\n\n'
+    
+    log.info('stream_opened', "📡 Job stream opened by {node_id}", node_id=node_id)
+    return event_stream(events())
+
+@app.route('/dashboard/stream')
+def dashboard_stream():
+    # Tell open dashboards to redraw whenever something changes, instead of them reloading on a timer
+    def events():
+        version = changes.version
+        yield ': connected\n\n'
+        while True:
+            latest = changes.wait(version, STREAM_KEEPALIVE)
+            if latest == version:
+                yield ': keepalive\n\n'
+                continue
+            version = latest
+            yield sse('update', {'version': version})
+            # Coalesce bursts, anything that changes meanwhile goes out in the next update
+            time.sleep(1 / DASHBOARD_PUSH_RATE)
+    
+    return event_stream(events())
 
 @app.route('/get_job/<node_id>')
 def get_job(node_id):
     # Update node's last seen time
-    if node_id in nodes:
-        nodes[node_id]['last_seen'] = time.time()
-    
-    # Find assigned jobs for this node
-    for job_id, job_data in jobs.items():
-        if job_data['assigned_to'] == node_id and job_data['status'] == 'assigned':
-            jobs[job_id]['status'] = 'executing'
-            print(f"🎯 Job {job_id} sent to {node_id}")
-            return jsonify({
-                'job_id': job_id,
-                'code': job_data['code'],
-                'type': job_data['type'],
-                'description': job_data.get('description', '')
-            })
+    touch_node(node_id)
+    
+    # Take the next job queued for this node, optionally long-polling for one
+    wait = wait_time()
+    job_id, job_data = job_queue.pop(node_id, timeout=wait, **claim_options(node_id))
+    if wait:
+        touch_node(node_id)
+    if job_id:
+        log.info('job_sent', "🎯 Job {job_id} sent to {node_id}", sampled=True, job_id=job_id, node_id=node_id)
+        return jsonify(job_payload(job_id, job_data, node_id))
     
     return jsonify({'job_id': None})
 
+@app.route('/get_jobs/<node_id>')
+def get_jobs(node_id):
+    # Lease up to ?max=K jobs at once, long-polling only for the first
+    touch_node(node_id)
+    
+    max_jobs = min(max(request.args.get('max', 1, type=int), 1), MAX_BATCH_SIZE)
+    wait = wait_time()
+    leased = job_queue.pop_many(node_id, max_jobs, timeout=wait, **batch_options(node_id))
+    if wait:
+        touch_node(node_id)
+    if leased:
+        log.info('jobs_sent', "🎯 {count} jobs sent to {node_id}", sampled=True, count=len(leased), node_id=node_id)
+    
+    return jsonify({'jobs': [job_payload(job_id, job_data, node_id) for job_id, job_data in leased]})
+
 @app.route('/submit_result', methods=['POST'])
 def submit_result():
     data = request.json
     job_id = data.get('job_id')
-    node_id = data.get('node_id')
-    result = data.get('result')
-    execution_time = data.get('execution_time')
-    
-    if job_id in jobs:
-        jobs[job_id]['status'] = 'completed'
-        job_results[job_id] = {
-            'result': result,
-            'node_id': node_id,
-            'execution_time': execution_time,
-            'completed_at': time.time()
-        }
-        
-        print(f"✅ Result received for {job_id} from {node_id}: {result}")
+    
+    if record_result(job_id, data.get('node_id'), data.get('result'), data.get('execution_time'),
+                     data.get('success')):
+        sync_journal()
         return jsonify({'status': 'result_accepted', 'job_id': job_id})
     
     return jsonify({'error': 'Job not found'}), 404
 
+@app.route('/submit_results', methods=['POST'])
+def submit_results():
+    # Upload many results in one request: {"results": [{"job_id": ..., ...}, ...]}, optionally
+    # with the node's latest {"node_id", "resources"} so a streaming worker needs no heartbeat
+    if request.json.get('node_id'):
+        nodes.touch(request.json['node_id'], request.json.get('resources'))
+        changes.notify('node', request.json['node_id'])
+    accepted = []
+    not_found = []
+    for data in request.json.get('results') or []:
+        job_id = data.get('job_id')
+        if record_result(job_id, data.get('node_id'), data.get('result'), data.get('execution_time'),
+                         data.get('success')):
+            accepted.append(job_id)
+        else:
+            not_found.append(job_id)
+    
+    sync_journal()
+    return jsonify({'status': 'results_accepted', 'accepted': accepted, 'not_found': not_found})
+
+@app.route('/heartbeat', methods=['POST'])
+def heartbeat():
+    # Keep the node alive and renew leases on the jobs it is still running
+    data = request.json
+    node_id = data.get('node_id')
+    if not nodes.touch(node_id, data.get('resources')):
+        return jsonify({'registered': False, 'lost': data.get('job_ids', [])})
+    nodes.set_blobs(node_id, data.get('blobs'))
+    changes.notify('node', node_id)
+    if hand_back(node_id):
+        sync_journal()
+    
+    lost = job_queue.renew(node_id, data.get('job_ids', []))
+    return jsonify({'registered': True, 'lost': lost})
+
+def hand_back(node_id, job_ids=()):
+    """Re-queue leased jobs a node won't start, and everything queued for it once it has paused"""
+    paused = scheduler.is_paused(nodes.get(node_id) or {})
+    if not job_ids and not paused:
+        return []
+    released = job_queue.hand_back(node_id, job_ids, queued=paused)
+    if released:
+        jobs_handed_back.inc(len(released))
+        log.info('jobs_handed_back', "↩️ {count} jobs handed back by {node_id} ({power_state})", count=len(released),
+                 node_id=node_id, power_state=(nodes.get(node_id) or {}).get('resources', {}).get('power_state'))
+    return released
+
+@app.route('/release_jobs', methods=['POST'])
+def release_jobs():
+    # A worker gives back leased jobs it won't start, e.g. after its power governor
+    # paused it: {"node_id": ..., "job_ids": [...], "resources": {...}}
+    data = request.json
+    node_id = data.get('node_id')
+    if not nodes.touch(node_id, data.get('resources')):
+        return jsonify({'error': 'Unknown node, register first'}), 404
+    changes.notify('node', node_id)
+    released = hand_back(node_id, data.get('job_ids') or [])
+    sync_journal()
+    return jsonify({'status': 'released', 'released': released})
+
+@app.route('/dead_letter')
+def dead_letter():
+    # Every failed job still held: those whose lease expired MAX_ATTEMPTS times,
+    # map/reduce shards included, and blocked jobs failed because a job they
+    # depend on failed. Their result says which
+    return jsonify({job_id: job_queue.get(job_id) for job_id in job_queue.with_status('failed')})
+
+@app.route('/code/<code_hash>')
+def get_code(code_hash):
+    # Source for a hash the worker was sent but no longer has cached
+    code = code_catalog.get(code_hash)
+    if code is None:
+        return jsonify({'error': 'Unknown code hash'}), 404
+    return jsonify({'code': code})
+
+@app.route('/blobs/<digest>', methods=['PUT'])
+def upload_blob(digest):
+    # Store input data under its SHA-256 for jobs to reference as {"$blob": digest}.
+    # Send it whole, or in chunks with Content-Range: bytes <start>-<end>/<total>,
+    # each starting where the last left off. A 409 says where to resume from
+    header = request.headers.get('Content-Range')
+    content_range = parse_content_range_header(header)
+    if header and content_range is None:
+        return jsonify({'error': 'Content-Range must be bytes <start>-<end>/<total>'}), 400
+    offset, total = (content_range.start, content_range.length) if content_range else (0, None)
+    received = blobs.received(digest)
+    if offset != received and digest not in blobs:
+        return jsonify({'error': f"Upload continues at byte {received}", 'received': received}), 409
+    try:
+        received = blobs.write(digest, request.stream, offset, total)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'received': blobs.received(digest)}), 400
+    
+    complete = digest in blobs
+    if complete:
+        log.info('blob_stored', "📦 Blob {digest:.12} stored ({size} bytes)", digest=digest, size=received)
+    return jsonify({'digest': digest, 'received': received, 'complete': complete}), 201 if complete else 202
+
+@app.route('/blobs/<digest>')
+def download_blob(digest):
+    # Blobs never change, so workers cache them forever and resume with Range requests
+    path = blobs.path(digest)
+    if path is None:
+        return jsonify({'error': 'Unknown blob', 'received': blobs.received(digest)}), 404
+    return send_file(path, mimetype='application/octet-stream', conditional=True, etag=digest,
+                     max_age=365 * 24 * 3600)
+
+@app.route('/blobs/<digest>', methods=['DELETE'])
+def delete_blob(digest):
+    if not blobs.remove(digest):
+        return jsonify({'error': 'Unknown blob'}), 404
+    return jsonify({'status': 'deleted', 'digest': digest})
+
+@app.route('/blobs')
+def list_blobs():
+    return jsonify(blobs.list())
+
+@app.route('/metrics')
+def metrics_page():
+    # Prometheus scrape target: queue depths, dispatch and execution time histograms,
+    # request latency per route, lease expiries and node churn
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route('/profile/<node_id>')
+def node_profile(node_id):
+    # Performance per job type on the node's device: samples, moving average and
+    # p50/p90 runtime, and units of work per second for jobs that report them
+    return jsonify({'node_id': node_id, 'device_id': nodes.device_id(node_id),
+                    'job_types': runtime_stats.profile(nodes.device_id(node_id))})
+
 @app.route('/job_status/<job_id>')
 def job_status(job_id):
-    return jsonify(jobs.get(job_id, {}))
+    return jsonify(job_queue.get(job_id) or {})
 
 @app.route('/results')
 def get_results():
-    return jsonify(job_results)
+    # Page through results oldest first: /results?cursor=<next_cursor>&limit=100
+    limit = min(max(request.args.get('limit', 100, type=int), 1), MAX_RESULTS_PAGE)
+    page, next_cursor = job_results.page(request.args.get('cursor', type=int), limit)
+    return jsonify({'results': page, 'next_cursor': next_cursor})
 
 @app.route('/clear_completed', methods=['POST'])
 def clear_completed():
-    # Remove completed jobs and old results
-    global jobs, job_results
+    # Remove completed jobs via the status index, keeping assigned/executing ones
+    job_queue.remove_with_status('completed')
     
-    # Keep only assigned/executing jobs
-    jobs = {job_id: job_data for job_id, job_data in jobs.items() 
-            if job_data['status'] in ['assigned', 'executing']}
+    # Keep only recent results (last 10), dropping the oldest in insertion order
+    dropped = job_results.trim(10)
+    if journal and dropped:
+        journal.append('drop_results', job_ids=dropped)
     
-    # Keep only recent results (last 10)
-    all_results = list(job_results.items())
-    if len(all_results) > 10:
-        job_results = dict(all_results[-10:])
+    # Finished map/reduce jobs keep their merged result until cleared here
+    finished = mapreduces.remove_completed()
+    if journal and finished:
+        journal.append('drop_mapreduces', mapreduce_ids=finished)
+    # Too much went to list it, open dashboards start over
+    changes.notify()
     
-    return jsonify({'status': 'cleared', 'jobs_remaining': len(jobs)})
+    return jsonify({'status': 'cleared', 'jobs_remaining': len(job_queue)})
 
 @app.route('/cleanup_nodes', methods=['POST'])
 def cleanup_nodes():
     # Remove inactive nodes (not seen in 2 minutes)
-    global nodes
-    current_time = time.time()
-    inactive_nodes = [node_id for node_id, node_data in nodes.items() 
-                     if current_time - node_data.get('last_seen', 0) > 120]
+    inactive_nodes = nodes.remove_inactive(120)
+    node_events.inc(len(inactive_nodes), event='removed')
+    for node_id in inactive_nodes:
+        changes.notify('node', node_id)
     
+    requeued = 0
     for node_id in inactive_nodes:
-        del nodes[node_id]
+        # The device's performance profile is kept for when it comes back
+        scheduler.forget(node_id)
+        code_catalog.forget(node_id)
+        # Hand the node's queued and running jobs to the remaining nodes
+        requeued += len(job_queue.release_node(node_id))
     
-    return jsonify({'status': 'cleaned', 'inactive_removed': len(inactive_nodes)})
+    return jsonify({'status': 'cleaned', 'inactive_removed': len(inactive_nodes), 'jobs_requeued': requeued})
+
+if journal:
+    recover_state()
+    job_queue.journal = journal
+    journal.snapshot_source = journal_state
+    journal.on_error = journal_write_failed
+    # Compact straight away so the replayed log isn't read again next time
+    journal.snapshot(journal_state)
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # Threaded so long-polling workers don't block each other, the shared
+    # state is lock-protected so any threaded or gevent server works too
+    # HTTP/1.1 lets workers keep their connections open between requests
+    WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+    # No reloader, its parent process would import this module too and open the same journal
+    app.run(debug=True, threaded=True, use_reloader=False)
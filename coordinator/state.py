@@ -0,0 +1,240 @@
+"""
+Shared coordinator state that is safe to use from many request threads
+Each structure has its own lock so node heartbeats, ID allocation and job
+claims never wait on each other
+"""
+
+import hashlib
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class IdAllocator:
+    """Hands out unique, increasing IDs like job_1, job_2, ..."""
+
+    def __init__(self, prefix, start=1):
+        self.prefix = prefix
+        self._counter = itertools.count(start)
+        self.lock = threading.Lock()
+
+    def next_id(self):
+        with self.lock:
+            return f"{self.prefix}{next(self._counter)}"
+
+    def advance_past(self, ids):
+        """Make sure later IDs are numbered above any of ids, e.g. after recovery"""
+        numbers = [int(i[len(self.prefix):]) for i in ids
+                   if i.startswith(self.prefix) and i[len(self.prefix):].isdigit()]
+        if numbers:
+            with self.lock:
+                current = next(self._counter)
+                self._counter = itertools.count(max(current, max(numbers) + 1))
+
+
+class NodeRegistry:
+    """Registered worker nodes and when each was last heard from"""
+
+    def __init__(self):
+        self._nodes = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, node_id):
+        return node_id in self._nodes
+
+    def __len__(self):
+        return len(self._nodes)
+
+    def get(self, node_id):
+        return self._nodes.get(node_id)
+
+    def register(self, node_id, resources, device_id=None):
+        """
+        Add or replace a node
+
+        Args:
+            node_id (str): The node, new each time a worker starts
+            resources (dict): Its device readings
+            device_id (str): Stable ID of the phone it runs on, defaults to node_id
+        """
+        with self.lock:
+            self._nodes[node_id] = {
+                'resources': resources,
+                'status': 'online',
+                'last_seen': time.time(),
+                'device_id': device_id or node_id
+            }
+
+    def device_id(self, node_id):
+        """The device a node runs on, node_id itself for unknown nodes"""
+        node_data = self._nodes.get(node_id)
+        return node_data.get('device_id', node_id) if node_data else node_id
+
+    def set_blobs(self, node_id, digests):
+        """Replace what a node reports having in its blob cache"""
+        node_data = self._nodes.get(node_id)
+        if node_data is not None and digests is not None:
+            with self.lock:
+                node_data['blobs'] = frozenset(digests)
+
+    def add_blobs(self, node_id, digests):
+        """Note blobs a node is about to fetch for a job queued on it"""
+        node_data = self._nodes.get(node_id)
+        if node_data is not None and digests:
+            with self.lock:
+                node_data['blobs'] = node_data.get('blobs', frozenset()) | frozenset(digests)
+
+    def touch(self, node_id, resources=None):
+        """
+        Record that a node was just heard from, returns False if it isn't registered
+
+        Args:
+            node_id (str): The node
+            resources (dict): Fresh readings (battery, temperature, CPU use, ...)
+                to merge into the ones it registered with
+        """
+        node_data = self._nodes.get(node_id)
+        if node_data is None:
+            return False
+        if resources:
+            # Swapped in whole so readers never see a half-updated dict
+            node_data['resources'] = dict(node_data['resources'], **resources)
+        node_data['last_seen'] = time.time()
+        return True
+
+    def snapshot(self, node_ids=None):
+        """Copy of every node's data, or just node_ids' that are registered, safe to iterate or serialize"""
+        with self.lock:
+            if node_ids is None:
+                node_ids = list(self._nodes)
+            return {node_id: dict(self._nodes[node_id], blobs=sorted(self._nodes[node_id].get('blobs', ())))
+                    for node_id in node_ids if node_id in self._nodes}
+
+    def active(self, max_age):
+        """Nodes heard from within the last max_age seconds"""
+        cutoff = time.time() - max_age
+        with self.lock:
+            return {node_id: node_data for node_id, node_data in self._nodes.items()
+                    if node_data.get('last_seen', 0) >= cutoff}
+
+    def remove_inactive(self, max_age):
+        """Drop nodes not heard from in max_age seconds and return their IDs"""
+        cutoff = time.time() - max_age
+        with self.lock:
+            inactive = [node_id for node_id, node_data in self._nodes.items()
+                        if node_data.get('last_seen', 0) < cutoff]
+            for node_id in inactive:
+                del self._nodes[node_id]
+            return inactive
+
+
+class CodeCatalog:
+    """Job source by SHA-256, and which hashes each node should still have compiled"""
+
+    def __init__(self):
+        self._code = {}
+        self._sent = {}
+        self.lock = threading.Lock()
+
+    def add(self, code):
+        """Store source and return its hash"""
+        digest = hashlib.sha256(code.encode()).hexdigest()
+        self._code.setdefault(digest, code)
+        return digest
+
+    def get(self, digest):
+        return self._code.get(digest)
+
+    def reset_node(self, node_id, cache_size):
+        """Start tracking a (re-)registered node whose cache holds cache_size entries"""
+        with self.lock:
+            self._sent[node_id] = (OrderedDict(), cache_size)
+
+    def forget(self, node_id):
+        with self.lock:
+            self._sent.pop(node_id, None)
+
+    def mark_sent(self, node_id, digest):
+        """
+        Record that a node is about to receive code with this hash
+
+        Mirrors the worker's LRU, so the answer is a best guess. The worker
+        fetches /code/<hash> itself if it guessed wrong.
+
+        Returns:
+            bool: True if the node should already have it compiled
+        """
+        with self.lock:
+            tracked = self._sent.get(node_id)
+            if tracked is None:
+                return False
+            hashes, cache_size = tracked
+            cached = digest in hashes
+            hashes[digest] = None
+            hashes.move_to_end(digest)
+            while len(hashes) > cache_size:
+                hashes.popitem(last=False)
+            return cached
+
+
+class ChangeFeed:
+    """
+    A version number bumped whenever coordinator state changes, with a bounded
+    log of what changed so observers fetch only that instead of everything
+    """
+
+    def __init__(self, history=10000):
+        """
+        Args:
+            history (int): Changes remembered, observers further behind start over
+        """
+        self.version = 0
+        # (version, kind, key) for the most recent changes, oldest first
+        self._log = deque(maxlen=history)
+        # Oldest version changes_since can still answer for
+        self._floor = 0
+        self.lock = threading.Lock()
+        self._changed = threading.Condition(self.lock)
+
+    def notify(self, kind=None, key=None):
+        """
+        Record a change, e.g. notify('job', job_id). Without a kind the change
+        is too broad to list and every observer starts over
+        """
+        with self.lock:
+            self.version += 1
+            if kind is None:
+                self._log.clear()
+                self._floor = self.version
+            else:
+                if len(self._log) == self._log.maxlen:
+                    self._floor = self._log[0][0]
+                self._log.append((self.version, kind, key))
+            self._changed.notify_all()
+
+    def changes_since(self, version):
+        """
+        What changed after version, newest changes are scanned first so this
+        costs the number of changes, not the size of the state
+
+        Returns:
+            tuple: (current version, {kind: set of keys}), the dict is None when
+            version is too old or unknown and the observer has to start over
+        """
+        with self.lock:
+            if version is None or version < self._floor or version > self.version:
+                return self.version, None
+            changed = {}
+            for entry_version, kind, key in reversed(self._log):
+                if entry_version <= version:
+                    break
+                changed.setdefault(kind, set()).add(key)
+            return self.version, changed
+
+    def wait(self, version, timeout):
+        """Block until the version moves past version or timeout passes, returns the current version"""
+        with self.lock:
+            if self.version == version:
+                self._changed.wait(timeout)
+            return self.version
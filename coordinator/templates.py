@@ -0,0 +1,151 @@
+"""
+Job templates for the AndroCompute coordinator
+A template is a Python function registered once by name and version. Jobs
+then carry only the template ID and their arguments, and workers compile the
+template once and call it for every job that uses it.
+"""
+
+import ast
+import hashlib
+import threading
+
+# Every template defines this top-level function, called with the job's args as keywords
+ENTRY_POINT = 'run'
+
+BUILTIN_TEMPLATES = [
+    {
+        'name': 'calculate_pi',
+        'version': 1,
+        'description': 'Leibniz series for Pi over terms [start, stop)',
+        'source': '''
+def run(start=0, stop=1000000):
+    total = 0.0
+    for i in range(start, stop):
+        total += (-1) ** i / (2 * i + 1)
+    return total * 4
+'''
+    },
+    {
+        'name': 'hash_data',
+        'version': 1,
+        'description': 'Hex digest of a string',
+        'source': '''
+def run(data='androcompute', algorithm='md5'):
+    return hashlib.new(algorithm, data.encode()).hexdigest()
+'''
+    },
+    {
+        'name': 'process_data',
+        'version': 1,
+        'description': 'Sum of squares over [start, stop)',
+        'source': '''
+def run(start=0, stop=1000):
+    return sum(i * i for i in range(start, stop))
+'''
+    },
+    {
+        'name': 'fibonacci',
+        'version': 1,
+        'description': 'The nth Fibonacci number',
+        'source': '''
+def run(n=20):
+    a, b = 0, 1
+    for _ in range(n):
+        a, b = b, a + b
+    return a
+'''
+    },
+    {
+        'name': 'find_primes',
+        'version': 1,
+        'description': 'Primes in [start, stop)',
+        'source': '''
+def run(start=2, stop=51):
+    def is_prime(n):
+        if n < 2:
+            return False
+        if n < 4:
+            return True
+        if n % 2 == 0 or n % 3 == 0:
+            return False
+        i = 5
+        while i * i <= n:
+            if n % i == 0 or n % (i + 2) == 0:
+                return False
+            i += 6
+        return True
+    return [n for n in range(start, stop) if is_prime(n)]
+'''
+    },
+    {
+        'name': 'word_frequency',
+        'version': 1,
+        'description': 'Word counts in a list of lines of text',
+        'source': '''
+def run(lines):
+    counts = {}
+    for line in lines:
+        for word in line.lower().split():
+            word = ''.join(char for char in word if char.isalnum())
+            if word:
+                counts[word] = counts.get(word, 0) + 1
+    return counts
+'''
+    },
+]
+
+
+def template_id(name, version):
+    return f"{name}@{version}"
+
+
+class TemplateRegistry:
+    """Registered templates by 'name@version', each version immutable once registered"""
+
+    def __init__(self):
+        self._templates = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, tid):
+        return tid in self._templates
+
+    def get(self, tid):
+        return self._templates.get(tid)
+
+    def register(self, name, version, source, description=''):
+        """
+        Register a template
+
+        Returns:
+            dict: The template record, including its 'id' and 'code_hash'
+
+        Raises:
+            ValueError: If the source doesn't parse, doesn't define run(), or
+                name@version is already registered with different source
+        """
+        try:
+            tree = ast.parse(source)
+        except SyntaxError as e:
+            raise ValueError(f"Template doesn't parse: {e}")
+        if not any(isinstance(node, ast.FunctionDef) and node.name == ENTRY_POINT for node in tree.body):
+            raise ValueError(f"Template must define a top-level {ENTRY_POINT}() function")
+
+        tid = template_id(name, version)
+        record = {
+            'id': tid,
+            'name': name,
+            'version': version,
+            'description': description,
+            'source': source,
+            'code_hash': hashlib.sha256(source.encode()).hexdigest()
+        }
+        with self.lock:
+            existing = self._templates.get(tid)
+            if existing and existing['code_hash'] != record['code_hash']:
+                raise ValueError(f"Template {tid} is already registered, bump the version to change it")
+            self._templates[tid] = record
+        return record
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self._templates)
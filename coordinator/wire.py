@@ -0,0 +1,238 @@
+"""
+Wire format for AndroCompute requests and responses
+Bodies are msgpack when both ends have it installed, with long numeric lists
+and matrices packed as raw typed buffers instead of one number at a time, and
+JSON otherwise. Bodies over COMPRESS_MIN_BYTES are compressed with zstd where
+available, else deflate. The same module is in coordinator/ and
+android-worker/, which are deployed separately; `python wire.py` fails if
+the two copies differ.
+"""
+
+import base64
+import json
+import os
+import struct
+import sys
+import zlib
+from array import array
+from itertools import chain
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+JSON = 'application/json'
+MSGPACK = 'application/msgpack'
+# Smaller bodies aren't worth the CPU to compress
+COMPRESS_MIN_BYTES = 1024
+# Largest body decompress() will produce, so a small compressed body can't expand to gigabytes
+MAX_DECOMPRESSED_BYTES = 64 * 1024 * 1024
+# Fewest numbers sent as a typed buffer, below this the header outweighs the saving
+MIN_ARRAY_LENGTH = 16
+# msgpack extension type for typed buffers: typecode, dimensions, little-endian values
+ARRAY_EXT = 1
+# msgpack extension type for integers outside its 64-bit range: signed big-endian bytes
+BIGINT_EXT = 2
+# Integers msgpack encodes natively, from int64 min to uint64 max
+MSGPACK_INT_RANGE = (-2 ** 63, 2 ** 64 - 1)
+
+
+class BodyTooLarge(ValueError):
+    """A compressed body that expands past the decompression limit"""
+
+
+def formats():
+    """Content types this end can read and write, preferred first"""
+    return [MSGPACK, JSON] if msgpack else [JSON]
+
+
+def encodings():
+    """Content encodings this end can read and write, preferred first"""
+    return ['zstd', 'deflate'] if zstandard else ['deflate']
+
+
+def negotiate(ours, theirs):
+    """Our most preferred option the other end also supports, None if there's none"""
+    return next((option for option in ours if option in (theirs or ())), None)
+
+
+def accepted_encoding(accept_encoding):
+    """Encoding to compress a response with given the request's Accept-Encoding header"""
+    offered = [part.split(';')[0].strip() for part in (accept_encoding or '').split(',')]
+    return negotiate(encodings(), offered)
+
+
+def _typed(values):
+    # A list of one numeric type, or a list of equal-length such lists, as (array, shape)
+    if type(values[0]) is list:
+        columns = len(values[0])
+        if not columns or any(type(row) is not list or len(row) != columns for row in values):
+            return None
+        flat, shape = list(chain.from_iterable(values)), (len(values), columns)
+    else:
+        flat, shape = values, (len(values),)
+    if len(flat) < MIN_ARRAY_LENGTH:
+        return None
+    kind = type(flat[0])
+    # bool is an int subclass, the exact type check keeps True/False out
+    if kind not in (int, float) or any(type(value) is not kind for value in flat):
+        return None
+    try:
+        return array('q' if kind is int else 'd', flat), shape
+    except OverflowError:
+        # Ints beyond 64 bits are packed one at a time, see _pack_int
+        return None
+
+
+def _pack_array(values, shape):
+    if sys.byteorder == 'big':
+        values.byteswap()
+    header = struct.pack(f'<cB{len(shape)}I', values.typecode.encode(), len(shape), *shape)
+    return msgpack.ExtType(ARRAY_EXT, header + values.tobytes())
+
+
+def _pack_int(value):
+    if MSGPACK_INT_RANGE[0] <= value <= MSGPACK_INT_RANGE[1]:
+        return value
+    # Results like fib(285) overflow msgpack's integers, JSON has no such limit
+    length = (value.bit_length() + 8) // 8
+    return msgpack.ExtType(BIGINT_EXT, value.to_bytes(length, 'big', signed=True))
+
+
+def _unpack_ext(code, data):
+    if code == BIGINT_EXT:
+        return int.from_bytes(data, 'big', signed=True)
+    if code != ARRAY_EXT:
+        return msgpack.ExtType(code, data)
+    typecode, ndim = struct.unpack_from('<cB', data)
+    shape = struct.unpack_from(f'<{ndim}I', data, 2)
+    values = array(typecode.decode())
+    values.frombytes(data[2 + 4 * ndim:])
+    if sys.byteorder == 'big':
+        values.byteswap()
+    values = values.tolist()
+    if ndim == 2:
+        rows, columns = shape
+        return [values[row * columns:(row + 1) * columns] for row in range(rows)]
+    return values
+
+
+def _prepare(obj):
+    # Swap long numeric lists for typed buffers, ints past 64 bits for BIGINT_EXT and bytes
+    # for the {"$bytes"} form the JSON format uses, so decoded values are always JSON-safe
+    kind = type(obj)
+    if kind is int:
+        return _pack_int(obj)
+    if kind is dict:
+        return {key: _prepare(value) for key, value in obj.items()}
+    if kind is list or kind is tuple:
+        typed = _typed(obj) if obj and kind is list else None
+        if typed is not None:
+            return _pack_array(*typed)
+        return [_prepare(value) for value in obj]
+    if kind is bytes:
+        return {'$bytes': base64.b64encode(obj).decode()}
+    return obj
+
+
+def _json_default(obj):
+    if isinstance(obj, bytes):
+        return {'$bytes': base64.b64encode(obj).decode()}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def pack(obj, content_type=JSON):
+    """Serialize obj as content_type"""
+    if content_type == MSGPACK:
+        return msgpack.packb(_prepare(obj), use_bin_type=True)
+    return json.dumps(obj, separators=(',', ':'), default=_json_default).encode()
+
+
+def unpack(body, content_type=JSON):
+    """
+    Deserialize a body of the given Content-Type
+
+    Raises:
+        ValueError: If the body isn't valid for its content type
+    """
+    if (content_type or '').split(';')[0].strip() == MSGPACK:
+        if msgpack is None:
+            raise ValueError("msgpack body received but msgpack isn't installed")
+        try:
+            return msgpack.unpackb(body, raw=False, ext_hook=_unpack_ext, strict_map_key=False)
+        except Exception as e:
+            raise ValueError(f"Invalid msgpack body: {e}")
+    return json.loads(body)
+
+
+def compress(body, encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor().compress(body)
+    if encoding == 'deflate':
+        return zlib.compress(body)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress(body, encoding, limit=MAX_DECOMPRESSED_BYTES):
+    """
+    Undo a Content-Encoding, bodies without one are returned as they are
+
+    Raises:
+        BodyTooLarge: If the body would decompress to more than limit bytes
+        ValueError: If the encoding is unsupported or the body is corrupt
+    """
+    if not encoding or encoding == 'identity':
+        return body
+    try:
+        if encoding == 'zstd' and zstandard is not None:
+            # max_output_size only bounds frames that don't declare their size, so check those that do.
+            # An undeclared size past the limit fails as an incomplete frame
+            if zstandard.frame_content_size(body) > limit:
+                raise BodyTooLarge(f"Body decompresses to more than {limit} bytes")
+            return zstandard.ZstdDecompressor().decompress(body, max_output_size=limit)
+        if encoding == 'deflate':
+            decompressor = zlib.decompressobj()
+            data = decompressor.decompress(body, limit)
+            if decompressor.unconsumed_tail:
+                raise BodyTooLarge(f"Body decompresses to more than {limit} bytes")
+            if not decompressor.eof:
+                raise ValueError(f"Corrupt {encoding} body: incomplete or truncated stream")
+            return data
+    except (zlib.error, getattr(zstandard, 'ZstdError', zlib.error)) as e:
+        raise ValueError(f"Corrupt {encoding} body: {e}")
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+if __name__ == '__main__':
+    # Round-trip check: python wire.py
+    sample = {'big': 2 ** 64 + 1, 'negative': -2 ** 200, 'edges': [2 ** 64 - 1, -2 ** 63],
+              'mixed': [2 ** 70] + list(range(MIN_ARRAY_LENGTH)), 'matrix': [[1.5] * 4] * 4,
+              'ints': list(range(MIN_ARRAY_LENGTH)), 'bytes': b'\x00\xff', 'text': 'ok', 'flag': True}
+    expected = dict(sample, bytes={'$bytes': 'AP8='})
+    for content_type in formats():
+        for encoding in encodings():
+            body = decompress(compress(pack(sample, content_type), encoding), encoding)
+            assert unpack(body, content_type) == expected, (content_type, encoding)
+    for encoding in encodings():
+        bomb = compress(b'\0' * (MAX_DECOMPRESSED_BYTES + 1), encoding)
+        try:
+            decompress(bomb, encoding)
+        except BodyTooLarge:
+            pass
+        else:
+            raise AssertionError(f"{encoding} body past MAX_DECOMPRESSED_BYTES was decompressed")
+    print(f"✅ Round trip OK for {', '.join(formats())}")
+
+    # The coordinator and the worker each ship a copy, they must not drift apart
+    here = os.path.dirname(os.path.abspath(__file__))
+    copies = [os.path.join(here, '..', package, 'wire.py') for package in ('coordinator', 'android-worker')]
+    if all(os.path.exists(path) for path in copies):
+        with open(copies[0], 'rb') as first, open(copies[1], 'rb') as second:
+            assert first.read() == second.read(), "coordinator/wire.py and android-worker/wire.py differ"
+        print("✅ coordinator/wire.py and android-worker/wire.py are identical")
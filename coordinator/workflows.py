@@ -0,0 +1,150 @@
+"""
+Job dependencies for the AndroCompute coordinator
+A job can wait on other jobs and take their results as arguments. It is held
+back from every queue and released the moment its last upstream job reports,
+with the upstream results filled into its args
+"""
+
+import threading
+from collections import deque
+
+
+def workflow_order(jobs):
+    """
+    Order a workflow's jobs so every job comes after the jobs it depends on
+
+    Args:
+        jobs (list): Job specs with a unique 'name', 'inputs' (arg -> name or
+            job ID) and 'after' (list of names or job IDs). References that
+            aren't names in the workflow are left to the caller
+
+    Returns:
+        list: The same specs in dependency order
+
+    Raises:
+        ValueError: If the jobs depend on each other in a cycle
+    """
+    by_name = {job['name']: job for job in jobs}
+    upstream = {name: {ref for ref in list((job.get('inputs') or {}).values()) + list(job.get('after') or [])
+                       if ref in by_name}
+                for name, job in by_name.items()}
+    downstream = {name: [] for name in by_name}
+    for name, refs in upstream.items():
+        for ref in refs:
+            downstream[ref].append(name)
+
+    waiting = {name: len(refs) for name, refs in upstream.items()}
+    ready = deque(name for name, count in waiting.items() if count == 0)
+    order = []
+    while ready:
+        name = ready.popleft()
+        order.append(by_name[name])
+        for dependent in downstream[name]:
+            waiting[dependent] -= 1
+            if waiting[dependent] == 0:
+                ready.append(dependent)
+    if len(order) < len(jobs):
+        raise ValueError(f"Workflow has a dependency cycle through {sorted(set(by_name) - {job['name'] for job in order})}")
+    return order
+
+
+class DependencyTracker:
+    """Blocked jobs, the upstream jobs each one still waits on and the results it has collected"""
+
+    def __init__(self):
+        # job_id -> {'inputs', 'args', 'waiting_on', 'producers'}
+        self._blocked = {}
+        # upstream job_id -> [blocked job_ids waiting on it]
+        self._dependents = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, job_id):
+        return job_id in self._blocked
+
+    def __len__(self):
+        return len(self._blocked)
+
+    def add(self, job_id, args, inputs, after, finished):
+        """
+        Track a job until the jobs it depends on have reported
+
+        Args:
+            job_id (str): The blocked job
+            args (dict): The job's own template args
+            inputs (dict): arg name -> upstream job ID whose result fills that arg
+            after (list): Upstream job IDs to wait for without taking their results
+            finished (callable): job_id -> that job's result record, or None if
+                it hasn't reported yet. Called under the tracker's lock, so an
+                upstream can't report in between being checked and being waited on
+
+        Returns:
+            tuple: (ready, failed) as returned by resolve
+        """
+        with self.lock:
+            blocked = {
+                'inputs': inputs,
+                'args': dict(args),
+                'waiting_on': set(inputs.values()) | set(after),
+                'producers': []
+            }
+            for upstream in list(blocked['waiting_on']):
+                record = finished(upstream)
+                if record is None:
+                    self._dependents.setdefault(upstream, []).append(job_id)
+                elif not record.get('success', True):
+                    return [], [(job_id, f"Upstream job {upstream} failed")]
+                else:
+                    self._satisfy(blocked, upstream, record)
+
+            if not blocked['waiting_on']:
+                return [(job_id, blocked['args'], blocked['producers'])], []
+            self._blocked[job_id] = blocked
+            return [], []
+
+    def resolve(self, job_id, record):
+        """
+        Release or fail the jobs waiting on a job that just reported
+
+        Args:
+            job_id (str): The upstream job
+            record (dict): Its result record, {'result', 'success', 'node_id', ...}
+
+        Returns:
+            tuple: (ready, failed) where ready lists (job_id, args, producer
+            node IDs) for jobs with every input now filled, and failed lists
+            (job_id, reason) for jobs that can never run, including jobs
+            downstream of those
+        """
+        with self.lock:
+            dependents = self._dependents.pop(job_id, [])
+            ready, failed = [], []
+            if not record.get('success', True):
+                self._fail(dependents, job_id, failed)
+                return ready, failed
+
+            for dependent in dependents:
+                blocked = self._blocked.get(dependent)
+                if blocked is None:
+                    continue
+                self._satisfy(blocked, job_id, record)
+                if not blocked['waiting_on']:
+                    del self._blocked[dependent]
+                    ready.append((dependent, blocked['args'], blocked['producers']))
+            return ready, failed
+
+    def _satisfy(self, blocked, upstream, record):
+        for arg, source in blocked['inputs'].items():
+            if source == upstream:
+                blocked['args'][arg] = record.get('result')
+        blocked['waiting_on'].discard(upstream)
+        if record.get('node_id'):
+            blocked['producers'].append(record['node_id'])
+
+    def _fail(self, dependents, upstream, failed):
+        stack = [(dependent, upstream) for dependent in dependents]
+        while stack:
+            dependent, cause = stack.pop()
+            if self._blocked.pop(dependent, None) is None:
+                continue
+            failed.append((dependent, f"Upstream job {cause} failed"))
+            stack.extend((downstream, dependent) for downstream in self._dependents.pop(dependent, []))
@@ -0,0 +1,528 @@
+"""
+Load-generation benchmark for the AndroCompute coordinator
+Simulates hundreds to thousands of virtual workers, spread over a few
+processes that each run them as asyncio tasks, while jobs are submitted at a
+steady rate with sizes drawn from a chosen distribution. Reports throughput,
+dispatch and end-to-end latency percentiles and the coordinator's CPU and
+memory use, and writes them as JSON to compare coordinator versions
+
+    python benchmark.py --workers 1000 --rate 200 --duration 60 --output run.json
+
+Without --url a private coordinator is started from ../coordinator with its
+journal and blobs in a temporary directory.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+
+from multi_node_test import random_resources
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+COORDINATOR_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'coordinator')
+# Runs the coordinator like server.py's __main__, minus the debug reloader
+LAUNCH_COORDINATOR = """
+import sys
+from werkzeug.serving import WSGIRequestHandler
+import server
+WSGIRequestHandler.protocol_version = 'HTTP/1.1'
+server.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)
+"""
+
+# Virtual workers do nothing but sleep, so any template with these args will do
+BENCH_TEMPLATE = """
+import time
+def run(seconds, submitted=None, pad=None):
+    time.sleep(seconds)
+    return seconds
+"""
+BENCH_TEMPLATE_ID = 'benchmark_sleep@1'
+
+# Seconds between virtual worker heartbeats, as in the real worker
+HEARTBEAT_INTERVAL = 15
+# Virtual workers registering at once, so startup doesn't look like an attack
+REGISTER_CONCURRENCY = 50
+# Seconds between submission batches
+SUBMIT_TICK = 0.1
+# Most jobs in one /submit_jobs fan-out
+SUBMIT_BATCH = 500
+# Seconds between coordinator CPU/memory samples
+SAMPLE_INTERVAL = 1.0
+
+
+def job_seconds_sampler(spec):
+    """
+    Job duration distribution from a spec string
+
+    Args:
+        spec (str): fixed:S, uniform:LOW:HIGH, exponential:MEAN or
+            lognormal:MU:SIGMA, all in seconds
+
+    Raises:
+        ValueError: If the spec isn't one of those
+    """
+    kind, _, params = spec.partition(':')
+    values = [float(value) for value in params.split(':') if value]
+    samplers = {
+        ('fixed', 1): lambda: values[0],
+        ('uniform', 2): lambda: random.uniform(*values),
+        ('exponential', 1): lambda: random.expovariate(1 / values[0]),
+        ('lognormal', 2): lambda: random.lognormvariate(*values),
+    }
+    sampler = samplers.get((kind, len(values)))
+    if sampler is None:
+        raise ValueError(f"Bad job size spec {spec!r}, use fixed:S, uniform:LOW:HIGH, exponential:MEAN or lognormal:MU:SIGMA")
+    return sampler
+
+
+def percentiles(samples):
+    """p50/p95/p99, mean and max of a list of seconds, nearest-rank"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+    return {
+        'count': len(ordered),
+        'p50': rank(50),
+        'p95': rank(95),
+        'p99': rank(99),
+        'mean': sum(ordered) / len(ordered),
+        'max': ordered[-1]
+    }
+
+
+class HttpClient:
+    """Minimal keep-alive HTTP/1.1 JSON client on asyncio streams, cheap enough to run thousands at once"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None, timeout=30):
+        """
+        Send a request, reconnecting once if the kept-alive connection was closed
+
+        Returns:
+            tuple: (status code, decoded JSON body or None)
+        """
+        body = json.dumps(payload).encode() if payload is not None else b''
+        head = (f"{method} {path} HTTP/1.1\r\nHost: {self.host}:{self.port}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n").encode()
+        for attempt in range(2):
+            if self.writer is None:
+                self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+            try:
+                self.writer.write(head + body)
+                await self.writer.drain()
+                return await asyncio.wait_for(self._response(), timeout)
+            except (ConnectionError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                # Half-read responses leave the connection unusable
+                self.close()
+                if attempt:
+                    raise
+
+    async def _response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await self.reader.readexactly(int(headers['content-length']))
+        else:
+            body = await self.reader.read()
+        if headers.get('connection', '').lower() == 'close' or 'content-length' not in headers and 'transfer-encoding' not in headers:
+            self.close()
+        return status, json.loads(body) if body else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class WorkerStats:
+    """Measurements from the virtual workers in one process"""
+
+    def __init__(self):
+        # job_id -> seconds, speculative backup copies of a job are only counted once
+        self.dispatch = {}
+        self.end_to_end = {}
+        self.completed = 0
+        self.requests = 0
+        self.errors = 0
+
+
+async def virtual_worker(node_id, config, stats, completed, stop):
+    """Register, then lease, 'run' and report jobs like a real worker until stop is set"""
+    client = HttpClient(config['host'], config['port'])
+    resources = random_resources()
+    cores = resources['cpu_cores']
+    in_flight = []
+    last_heartbeat = time.time()
+    try:
+        while not stop.is_set():
+            try:
+                status, data = await client.request(
+                    'GET', f"/get_jobs/{node_id}?max={cores}&wait={config['poll_wait']}",
+                    timeout=config['poll_wait'] + 10)
+                stats.requests += 1
+                leased_at = time.time()
+                jobs = (data or {}).get('jobs', []) if status == 200 else []
+                for job in jobs:
+                    stats.dispatch.setdefault(job['job_id'], leased_at - job['args']['submitted'])
+
+                if jobs:
+                    # A phone runs a batch across its cores, so the batch takes as long as its longest job
+                    in_flight = [job['job_id'] for job in jobs]
+                    await asyncio.sleep(max(job['args']['seconds'] for job in jobs))
+                    results = [{
+                        'job_id': job['job_id'],
+                        'node_id': node_id,
+                        'result': 'x' * config['result_bytes'],
+                        'success': True,
+                        'execution_time': job['args']['seconds']
+                    } for job in jobs]
+                    status, _ = await client.request('POST', '/submit_results', {'results': results, 'node_id': node_id})
+                    stats.requests += 1
+                    reported_at = time.time()
+                    if status != 200:
+                        stats.errors += 1
+                    else:
+                        for job in jobs:
+                            stats.end_to_end.setdefault(job['job_id'], reported_at - job['args']['submitted'])
+                        stats.completed += len(jobs)
+                        with completed.get_lock():
+                            completed.value += len(jobs)
+                    in_flight = []
+
+                if time.time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    await client.request('POST', '/heartbeat', {'node_id': node_id, 'job_ids': in_flight,
+                                                                'resources': resources})
+                    stats.requests += 1
+                    last_heartbeat = time.time()
+            except Exception:
+                stats.errors += 1
+                await asyncio.sleep(1)
+    finally:
+        client.close()
+
+
+async def register_worker(node_id, config, semaphore):
+    async with semaphore:
+        client = HttpClient(config['host'], config['port'])
+        try:
+            status, _ = await client.request('POST', '/register', {'node_id': node_id, 'resources': random_resources()})
+            return status == 200
+        finally:
+            client.close()
+
+
+async def run_workers(node_ids, config, completed, registered, stop):
+    semaphore = asyncio.Semaphore(REGISTER_CONCURRENCY)
+    ok = await asyncio.gather(*(register_worker(node_id, config, semaphore) for node_id in node_ids),
+                              return_exceptions=True)
+    with registered.get_lock():
+        registered.value += sum(1 for result in ok if result is True)
+
+    stats = WorkerStats()
+    # multiprocessing.Event.is_set() doesn't block, so the tasks poll it between requests
+    await asyncio.gather(*(virtual_worker(node_id, config, stats, completed, stop) for node_id in node_ids))
+    return stats
+
+
+def worker_process(node_ids, config, completed, registered, stop, results):
+    """Entry point of one load-generating process"""
+    stats = asyncio.run(run_workers(node_ids, config, completed, registered, stop))
+    results.put({
+        'dispatch': stats.dispatch,
+        'end_to_end': stats.end_to_end,
+        'completed': stats.completed,
+        'requests': stats.requests,
+        'errors': stats.errors
+    })
+
+
+def submit_jobs(url, rate, duration, sample_seconds, pad_bytes):
+    """
+    Submit jobs at rate per second for duration seconds
+
+    Returns:
+        tuple: (jobs submitted, jobs per second achieved, /submit_jobs latencies, failed submissions)
+    """
+    session = requests.Session()
+    attempted, submitted, latencies, failures = 0, 0, [], 0
+    start = time.time()
+    while time.time() - start < duration:
+        due = int(rate * (time.time() - start)) - attempted
+        while due > 0:
+            count = min(due, SUBMIT_BATCH)
+            now = time.time()
+            args_list = [{'seconds': sample_seconds(), 'submitted': now, 'pad': 'x' * pad_bytes}
+                         for _ in range(count)]
+            # Failed batches aren't retried, so a struggling coordinator isn't sent a growing backlog
+            attempted += count
+            due -= count
+            try:
+                response = session.post(f"{url}/submit_jobs", json={'template': BENCH_TEMPLATE_ID, 'args_list': args_list},
+                                        timeout=30)
+                latencies.append(time.time() - now)
+                response.raise_for_status()
+                submitted += count
+            except requests.RequestException:
+                failures += 1
+        time.sleep(SUBMIT_TICK)
+    return submitted, submitted / (time.time() - start), latencies, failures
+
+
+class UsageSampler(threading.Thread):
+    """Samples a process's CPU and resident memory once a second while the benchmark runs"""
+
+    def __init__(self, pid):
+        super().__init__(daemon=True)
+        self.process = psutil.Process(pid)
+        self.cpu = []
+        self.rss = []
+        self.running = True
+
+    def run(self):
+        self.process.cpu_percent()
+        while self.running:
+            time.sleep(SAMPLE_INTERVAL)
+            try:
+                self.cpu.append(self.process.cpu_percent())
+                self.rss.append(self.process.memory_info().rss)
+            except psutil.Error:
+                return
+
+    def summary(self):
+        if not self.cpu:
+            return None
+        return {
+            'cpu_percent_mean': sum(self.cpu) / len(self.cpu),
+            'cpu_percent_max': max(self.cpu),
+            'rss_mb_max': max(self.rss) / 1024 / 1024,
+            'rss_mb_end': self.rss[-1] / 1024 / 1024
+        }
+
+
+def launch_coordinator(workdir):
+    """Start a private coordinator on a free port, returns (process, url)"""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ,
+               ANDROCOMPUTE_JOURNAL_DIR=os.path.join(workdir, 'journal'),
+               ANDROCOMPUTE_BLOB_DIR=os.path.join(workdir, 'blobs'))
+    process = subprocess.Popen([sys.executable, '-c', LAUNCH_COORDINATOR, str(port)], cwd=COORDINATOR_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            requests.get(f"{url}/nodes", timeout=1)
+            return process, url
+        except requests.RequestException:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError('Coordinator failed to start')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=COORDINATOR_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run_benchmark(options):
+    """
+    Run one benchmark
+
+    Args:
+        options (argparse.Namespace): See the command line arguments
+
+    Returns:
+        dict: The report, as written to --output
+    """
+    sample_seconds = job_seconds_sampler(options.job_seconds)
+    workdir = tempfile.TemporaryDirectory()
+    coordinator, url, pid = None, options.url, options.coordinator_pid
+    if url is None:
+        coordinator, url = launch_coordinator(workdir.name)
+        pid = coordinator.pid
+    parsed = urlparse(url)
+    config = {'host': parsed.hostname, 'port': parsed.port or 80, 'poll_wait': options.poll_wait,
+              'result_bytes': options.result_bytes}
+    requests.post(f"{url}/templates", json={'name': 'benchmark_sleep', 'version': 1, 'source': BENCH_TEMPLATE},
+                  timeout=10).raise_for_status()
+
+    sampler = None
+    if pid and psutil is not None:
+        sampler = UsageSampler(pid)
+        sampler.start()
+
+    completed = multiprocessing.Value('q', 0)
+    registered = multiprocessing.Value('q', 0)
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    node_ids = [f"bench_{os.getpid()}_{index}" for index in range(options.workers)]
+    processes = [multiprocessing.Process(target=worker_process,
+                                         args=(node_ids[index::options.processes], config, completed,
+                                               registered, stop, results))
+                 for index in range(options.processes)]
+    try:
+        print(f"🚀 Starting {options.workers} virtual workers in {options.processes} processes against {url}")
+        for process in processes:
+            process.start()
+        deadline = time.time() + 60
+        while registered.value < options.workers and time.time() < deadline:
+            time.sleep(0.2)
+        print(f"✅ {registered.value} workers registered, submitting {options.rate} jobs/s for {options.duration}s")
+
+        start = time.time()
+        submitted, submit_rate, submit_latencies, submit_failures = submit_jobs(url, options.rate, options.duration,
+                                                                   sample_seconds, options.pad_bytes)
+        # Let the backlog drain so every job's latency is counted
+        drain_deadline = time.time() + options.drain
+        while completed.value < submitted and time.time() < drain_deadline:
+            time.sleep(0.2)
+        finished = time.time()
+        stop.set()
+        worker_stats = [results.get(timeout=options.poll_wait + 30) for _ in processes]
+        for process in processes:
+            process.join(timeout=10)
+    finally:
+        stop.set()
+        if sampler is not None:
+            sampler.running = False
+        if coordinator is not None:
+            coordinator.terminate()
+            coordinator.wait(timeout=10)
+        workdir.cleanup()
+
+    # First lease and first report of each job, wherever its copies ran
+    dispatch, end_to_end = {}, {}
+    for stats in worker_stats:
+        for job_id, seconds in stats['dispatch'].items():
+            dispatch[job_id] = min(seconds, dispatch.get(job_id, seconds))
+        for job_id, seconds in stats['end_to_end'].items():
+            end_to_end[job_id] = min(seconds, end_to_end.get(job_id, seconds))
+    done = len(end_to_end)
+    return {
+        'coordinator': {'url': options.url or 'launched', 'revision': git_revision()},
+        'config': {
+            'workers': options.workers,
+            'processes': options.processes,
+            'rate': options.rate,
+            'duration': options.duration,
+            'job_seconds': options.job_seconds,
+            'poll_wait': options.poll_wait,
+            'result_bytes': options.result_bytes,
+            'pad_bytes': options.pad_bytes
+        },
+        'started_at': start,
+        'jobs': {
+            'submitted': submitted,
+            'completed': done,
+            'duplicate_results': sum(stats['completed'] for stats in worker_stats) - done,
+            'submit_rate': submit_rate,
+            'submit_failures': submit_failures,
+            'worker_errors': sum(stats['errors'] for stats in worker_stats),
+            'requests': sum(stats['requests'] for stats in worker_stats)
+        },
+        'throughput': done / (finished - start) if finished > start else 0,
+        'dispatch_latency': percentiles(list(dispatch.values())),
+        'end_to_end_latency': percentiles(list(end_to_end.values())),
+        'submit_latency': percentiles(submit_latencies),
+        'coordinator_usage': sampler.summary() if sampler else None
+    }
+
+
+def print_report(report):
+    jobs = report['jobs']
+    print(f"📊 {jobs['completed']}/{jobs['submitted']} jobs completed, {report['throughput']:.1f} jobs/s "
+          f"(submitted at {jobs['submit_rate']:.1f} jobs/s)")
+    for name in ('dispatch_latency', 'end_to_end_latency', 'submit_latency'):
+        stats = report[name]
+        if stats:
+            print(f"   {name}: p50 {stats['p50'] * 1000:.1f}ms  p95 {stats['p95'] * 1000:.1f}ms  "
+                  f"p99 {stats['p99'] * 1000:.1f}ms  max {stats['max'] * 1000:.1f}ms")
+    usage = report['coordinator_usage']
+    if usage:
+        print(f"   coordinator: CPU {usage['cpu_percent_mean']:.0f}% mean / {usage['cpu_percent_max']:.0f}% max, "
+              f"RSS {usage['rss_mb_max']:.0f} MB max")
+    if jobs['submit_failures'] or jobs['worker_errors']:
+        print(f"⚠️ {jobs['submit_failures']} failed submissions, {jobs['worker_errors']} worker errors")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', help='Coordinator to load, default starts a private one')
+    parser.add_argument('--coordinator-pid', type=int, help='PID to sample CPU/memory of when using --url')
+    parser.add_argument('--workers', type=int, default=200, help='Virtual workers (default 200)')
+    parser.add_argument('--processes', type=int, default=min(os.cpu_count() or 1, 4),
+                        help='Processes the virtual workers are spread over')
+    parser.add_argument('--rate', type=float, default=50, help='Jobs submitted per second (default 50)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to submit for (default 30)')
+    parser.add_argument('--drain', type=float, default=30, help='Most seconds to wait for the backlog after (default 30)')
+    parser.add_argument('--job-seconds', default='exponential:0.5',
+                        help='Job duration distribution: fixed:S, uniform:LOW:HIGH, exponential:MEAN or lognormal:MU:SIGMA')
+    parser.add_argument('--poll-wait', type=int, default=20, help='Long-poll seconds for /get_jobs (default 20)')
+    parser.add_argument('--result-bytes', type=int, default=16, help='Size of each result (default 16)')
+    parser.add_argument('--pad-bytes', type=int, default=0, help='Extra bytes of args per job (default 0)')
+    parser.add_argument('--output', help='Write the report as JSON here')
+    options = parser.parse_args(argv)
+    options.processes = max(1, min(options.processes, options.workers))
+
+    report = run_benchmark(options)
+    print_report(report)
+    if options.output:
+        with open(options.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Report written to {options.output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -136,6 +136,96 @@ JOB_TYPES = {
     'string_operations': STRING_OPERATIONS_JOB
 }
 
+# Parameterized versions of the jobs above, registered once as templates so
+# each job only carries its arguments. Each defines run(**args).
+TEMPLATES = {
+    'series_sum': """
+def run(terms=11):
+    # Sum of 1 + 1/2 + 1/4 + ... over the given number of terms
+    return sum(1 / (2 ** i) for i in range(terms))
+""",
+    'matrix_multiply': """
+def run(matrix_a, matrix_b):
+    return [[sum(matrix_a[i][k] * matrix_b[k][j] for k in range(len(matrix_b)))
+             for j in range(len(matrix_b[0]))]
+            for i in range(len(matrix_a))]
+""",
+    'string_operations': """
+def run(text):
+    return {
+        'uppercase': text.upper(),
+        'lowercase': text.lower(),
+        'word_count': len(text.split()),
+        'character_count': len(text),
+        'reversed': text[::-1]
+    }
+""",
+    # Reads its text from a blob: submit {"text": {"$blob": upload_blob(url, data)}}
+    # and the data reaches each worker once, however many jobs read it
+    'blob_word_frequency': """
+def run(text, top=5):
+    counts = {}
+    for word in bytes(text).decode().lower().split():
+        word = word.strip('.,!?')
+        counts[word] = counts.get(word, 0) + 1
+    return sorted(counts.items(), key=lambda item: item[1], reverse=True)[:top]
+"""
+}
+
+def register_templates(coordinator_url, version=1):
+    """
+    Register TEMPLATES with a coordinator
+    
+    Args:
+        coordinator_url (str): URL of the coordinator
+        version (int): Template version, bump it after changing a template
+        
+    Returns:
+        dict: template name -> template ID to submit jobs with
+    """
+    import requests
+    
+    template_ids = {}
+    for name, source in TEMPLATES.items():
+        response = requests.post(f"{coordinator_url}/templates", json={
+            'name': name,
+            'version': version,
+            'source': source
+        }, timeout=10)
+        response.raise_for_status()
+        template_ids[name] = response.json()['template_id']
+    return template_ids
+
+def upload_blob(coordinator_url, data, chunk_size=4 * 1024 * 1024):
+    """
+    Upload input data for jobs to reference as {"$blob": digest}, in chunks
+    that resume where the coordinator left off if the connection drops
+
+    Args:
+        coordinator_url (str): URL of the coordinator
+        data (bytes): The blob's content
+        chunk_size (int): Bytes sent per request
+
+    Returns:
+        str: The blob's SHA-256, its ID on the coordinator
+    """
+    import hashlib
+    import requests
+
+    digest = hashlib.sha256(data).hexdigest()
+    offset = 0
+    while offset < len(data):
+        chunk = data[offset:offset + chunk_size]
+        response = requests.put(f"{coordinator_url}/blobs/{digest}", data=chunk, headers={
+            'Content-Range': f"bytes {offset}-{offset + len(chunk) - 1}/{len(data)}"
+        }, timeout=60)
+        if response.status_code not in (201, 202, 409):
+            response.raise_for_status()
+        if response.json().get('complete'):
+            break
+        offset = response.json()['received']
+    return digest
+
 def get_job_code(job_type):
     """
     Get the executable Python code for a job type
@@ -170,3 +260,9 @@ if __name__ == "__main__":
             print(f"❌ {job_name} failed: {e}")
     
     print(f"\n📊 Available jobs: {list_available_jobs()}")
+    
+    print("\n🧪 Testing templates locally...")
+    for name, source in TEMPLATES.items():
+        namespace = {}
+        exec(source, namespace)
+        print(f"✅ {name}: {namespace['run']}")
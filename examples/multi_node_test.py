@@ -8,29 +8,35 @@ import time
 import requests
 import random
 
+def random_resources():
+    """Plausible phone resources for a simulated worker"""
+    return {
+        'cpu_cores': random.randint(2, 8),
+        'memory_total': 1024 * 1024 * random.randint(512, 2048),
+        'battery_level': random.randint(20, 100),
+        'is_charging': random.choice([True, False])
+    }
+
 class TestWorker:
     """Simulated Android worker for testing"""
     
-    def __init__(self, worker_id, coordinator_url="http://localhost:5000"):
+    def __init__(self, worker_id, coordinator_url="http://localhost:5000", poll_wait=20):
         self.worker_id = f"test_worker_{worker_id}"
         self.coordinator_url = coordinator_url
         self.running = True
         self.jobs_completed = 0
+        self.poll_wait = poll_wait  # Long-poll seconds, 0 to poll every 2 seconds
+        self.session = requests.Session()  # Keep-alive connection, like the real worker
         
     def register(self):
         """Register with coordinator"""
         data = {
             'node_id': self.worker_id,
-            'resources': {
-                'cpu_cores': random.randint(2, 8),
-                'memory_total': 1024 * 1024 * random.randint(512, 2048),
-                'battery_level': random.randint(20, 100),
-                'is_charging': random.choice([True, False])
-            }
+            'resources': random_resources()
         }
         
         try:
-            response = requests.post(f"{self.coordinator_url}/register", json=data, timeout=5)
+            response = self.session.post(f"{self.coordinator_url}/register", json=data, timeout=5)
             print(f"✅ {self.worker_id} registered")
             return True
         except Exception as e:
@@ -41,8 +47,12 @@ class TestWorker:
         """Simulate job processing"""
         while self.running:
             try:
-                # Check for jobs
-                response = requests.get(f"{self.coordinator_url}/get_job/{self.worker_id}", timeout=5)
+                # Check for jobs, letting the coordinator hold the request until one arrives
+                response = self.session.get(
+                    f"{self.coordinator_url}/get_job/{self.worker_id}",
+                    params={'wait': self.poll_wait},
+                    timeout=self.poll_wait + 5
+                )
                 
                 if response.status_code == 200:
                     job_data = response.json()
@@ -61,14 +71,18 @@ class TestWorker:
                             'execution_time': random.uniform(1.0, 3.0)
                         }
                         
-                        requests.post(f"{self.coordinator_url}/submit_result", json=result_data, timeout=5)
+                        self.session.post(f"{self.coordinator_url}/submit_result", json=result_data, timeout=5)
                         self.jobs_completed += 1
                         print(f"✅ {self.worker_id} completed job {self.jobs_completed}")
+                        continue
                 
             except Exception as e:
                 print(f"⚠️ {self.worker_id} error: {e}")
+                time.sleep(2)  # Back off before retrying
+                continue
             
-            time.sleep(2)  # Check every 2 seconds
+            if not self.poll_wait:
+                time.sleep(2)  # Check every 2 seconds
     
     def start(self):
         """Start the test worker"""